@@ -0,0 +1,8 @@
+from django.urls import path, include
+from albums.urls import async_urlpatterns
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('api/', include(async_urlpatterns)),
+    *wsgi_urlpatterns,
+]
@@ -1,12 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from albums.metrics import metrics_view
+from albums.storage import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('albums.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:name>", serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Album, AlbumPage, MediaItem, AlbumShare
+from .models import (
+    Album, AlbumPage, MediaItem, AlbumShare, FileDeletion, ImportCheckpoint, Upload
+)
 
 @admin.register(Album)
 class AlbumAdmin(admin.ModelAdmin):
@@ -18,7 +20,7 @@ class AlbumPageAdmin(admin.ModelAdmin):
 @admin.register(MediaItem)
 class MediaItemAdmin(admin.ModelAdmin):
     list_display = ['caption', 'page', 'media_type', 'position', 'created_at']
-    list_filter = ['media_type', 'created_at']
+    list_filter = ['media_type', 'derivative_status', 'created_at']
     search_fields = ['caption', 'page__title']
     readonly_fields = ['id', 'created_at', 'updated_at']
 
@@ -27,3 +29,21 @@ class AlbumShareAdmin(admin.ModelAdmin):
     list_display = ['album', 'share_token', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     readonly_fields = ['id', 'share_token', 'created_at']
+
+@admin.register(FileDeletion)
+class FileDeletionAdmin(admin.ModelAdmin):
+    list_display = ['file_key', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['file_key']
+    readonly_fields = ['created_at']
+
+@admin.register(ImportCheckpoint)
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['source', 'records', 'updated_at']
+    readonly_fields = ['updated_at']
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'size', 'received', 'file_key', 'updated_at']
+    search_fields = ['filename', 'file_key']
+    readonly_fields = ['id', 'created_at', 'updated_at']
@@ -0,0 +1,36 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+# Attempts before an allocation conflict is surfaced to the caller
+ALLOCATION_ATTEMPTS = 5
+
+def lock_parent(model, pk):
+    """
+    Take the parent's write lock for the rest of the transaction by touching
+    its updated_at. An UPDATE is a row lock on PostgreSQL and MySQL and takes
+    SQLite's single writer lock up front (waiting on busy_timeout), where a
+    read-then-write transaction would fail with "database is locked".
+    """
+    return model.objects.filter(pk=pk).update(updated_at=timezone.now())
+
+def next_number(queryset, field, first):
+    last = queryset.aggregate(last=Max(field))['last']
+    return first if last is None else last + 1
+
+def allocate(parent_model, parent_pk, queryset, field, first, create):
+    """
+    Create a child numbered one past the current maximum of `field` in
+    `queryset`, serialised against every other writer of the same parent.
+    create(number) runs inside the locked transaction and returns the new
+    row. A unique-constraint clash (from a writer that skipped the lock) is
+    retried with a freshly read maximum.
+    """
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                lock_parent(parent_model, parent_pk)
+                return create(next_number(queryset, field, first))
+        except IntegrityError:
+            if attempt == ALLOCATION_ATTEMPTS - 1:
+                raise
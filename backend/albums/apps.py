@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AlbumsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'albums'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .metrics import install_query_wrapper
+        from .sqlite import apply_pragmas
+        # Pragmas first, so they are not counted as request queries
+        connection_created.connect(apply_pragmas)
+        connection_created.connect(install_query_wrapper)
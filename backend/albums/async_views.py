@@ -0,0 +1,114 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.permissions import AllowAny
+from rest_framework.request import Request
+from .cache import LRUBackend, get_shared_album_cache
+from .conditional import (
+    album_validators, page_validators, apply_validators, not_modified, remember_validators
+)
+
+# Order DRF lists methods in the Allow header
+HTTP_METHODS = ('get', 'post', 'put', 'patch', 'delete', 'head', 'options')
+
+def negotiate_json(request, viewset):
+    """(renderer, media type) DRF would answer `request` with, or None unless that is JSON"""
+    renderers = [renderer() for renderer in viewset.renderer_classes]
+    try:
+        renderer, media_type = viewset.content_negotiation_class().select_renderer(
+            Request(request), renderers
+        )
+    except NotAcceptable:
+        return None
+    return (renderer, media_type) if renderer.format == 'json' else None
+
+def async_front(drf_view, fast_path):
+    """
+    Async view in front of `drf_view`, the router's view for one route. JSON
+    GETs are first offered to fast_path(request, renderer, variant, **kwargs),
+    a coroutine answering the cheap cases (304s, cache hits) without a worker
+    thread, which returns None to fall back. Everything else runs the DRF
+    view in a thread, unchanged. Only for routes open to anyone: the fast
+    path skips DRF authentication and permissions.
+    """
+    viewset, actions = drf_view.cls, drf_view.actions
+    assert all(issubclass(permission, AllowAny) for permission in viewset.permission_classes)
+    delegate = sync_to_async(drf_view)
+    allow = ', '.join(
+        method.upper() for method in HTTP_METHODS
+        if method in actions or method == 'options' or (method == 'head' and 'get' in actions)
+    )
+
+    async def view(request, **kwargs):
+        if request.method == 'GET':
+            negotiated = negotiate_json(request, viewset)
+            if negotiated is not None:
+                renderer, media_type = negotiated
+                variant = f"{media_type}?{request.META.get('QUERY_STRING', '')}"
+                response = await fast_path(request, renderer, variant, **kwargs)
+                if response is not None:
+                    response['Allow'] = allow
+                    return response
+        return await delegate(request, **kwargs)
+
+    # DRF views check CSRF themselves; metrics name routes after cls/actions
+    view.csrf_exempt = True
+    view.cls, view.actions = viewset, actions
+    return view
+
+def conditional_fast_path(compute):
+    """Fast path answering 304s; a full render reuses the validators it computed"""
+    async def fast_path(request, renderer, variant, pk):
+        validators = await sync_to_async(compute)(pk, variant)
+        if validators is None:
+            return None
+        remember_validators(request, compute, pk, variant, validators)
+        return not_modified(request, validators)
+    return fast_path
+
+album_fast_path = conditional_fast_path(album_validators)
+page_media_fast_path = conditional_fast_path(page_validators)
+
+async def shared_album_fast_path(request, renderer, variant, share_token):
+    """Serve shared albums straight from the rendered-response cache"""
+    cache = get_shared_album_cache()
+    # A miss is counted by SharedAlbumViewSet.retrieve, which looks again
+    if isinstance(cache.backend, LRUBackend):
+        entry = cache.get(share_token, variant, count_miss=False)
+    else:
+        # Shared caches (Redis, Memcached) block on the network
+        entry = await sync_to_async(cache.get, thread_sensitive=False)(
+            share_token, variant, count_miss=False
+        )
+    if entry is None:
+        return None
+    body, validators = entry
+    response = not_modified(request, validators)
+    if response is None:
+        response = apply_validators(HttpResponse(body, content_type=renderer.media_type), validators)
+    response['X-Cache'] = 'HIT'
+    return response
+
+class AsyncURLConfMiddleware:
+    """
+    Resolve requests served through ASGI against settings.ASGI_ROOT_URLCONF,
+    which puts the async fronts ahead of the router. Under WSGI an async
+    view only adds an event loop per request, so the plain routes are kept.
+    The chain stays async only while every middleware supports it.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.urlconf = settings.ASGI_ROOT_URLCONF
+        return await self.get_response(request)
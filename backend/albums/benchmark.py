@@ -0,0 +1,363 @@
+import gc
+import json
+import logging
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+import django
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from . import compression, renderers
+from .models import Album, AlbumPage, MediaItem, AlbumShare, Upload
+from .serializers import AlbumSerializer
+from .urls import router
+
+Scenario = namedtuple('Scenario', ['route', 'method', 'path', 'data', 'headers'], defaults=[None])
+
+UPLOAD_SIZE = 4 * 1024 * 1024
+UPLOAD_CHUNK = bytes(256 * 1024)
+
+# Album detail wire formats: (renderer, API version, content coding). The
+# first, DRF's own renderer uncompressed, is what responses used to be
+WIRE_FORMATS = {
+    'drf-json': (JSONRenderer, '1', None),
+    'orjson': (renderers.ORJSONRenderer, '1', None),
+    'orjson-v2': (renderers.ORJSONRenderer, '2', None),
+    'orjson-v2-gzip': (renderers.ORJSONRenderer, '2', 'gzip'),
+    'orjson-v2-br': (renderers.ORJSONRenderer, '2', 'br'),
+    'msgpack-v2': (renderers.MessagePackRenderer, '2', None),
+    'msgpack-v2-br': (renderers.MessagePackRenderer, '2', 'br'),
+}
+
+# Relative growth in a metric that counts as a regression, with absolute
+# floors so sub-millisecond noise never fails a comparison
+THRESHOLD_FLOORS = {'p95_ms': 1.0, 'peak_kib': 64}
+
+def router_routes():
+    """(url name, method) for every endpoint the albums router serves"""
+    routes = set()
+    for pattern in router.urls:
+        actions = getattr(pattern.callback, 'actions', None) or {'get': 'root'}
+        for method in actions:
+            if method == 'head':
+                continue
+            routes.add((pattern.name, method.upper()))
+    return routes
+
+def fixture():
+    """Pick the objects the scenarios act on: the album with most pages and its fullest page"""
+    album = Album.objects.order_by('-page_count', 'id').first()
+    page = AlbumPage.objects.filter(album=album).order_by('-image_count', '-video_count', 'id').first()
+    media = MediaItem.objects.filter(page=page).order_by('position', 'id').first()
+    share, _ = AlbumShare.objects.get_or_create(
+        album=album, defaults={'share_token': f'bench-{album.pk}'}
+    )
+    upload, _ = Upload.objects.get_or_create(filename='bench.bin', defaults={'size': UPLOAD_SIZE})
+    caption = media.caption.split()[0] if media and media.caption else 'beach'
+    return {
+        'album': album, 'page': page, 'media': media, 'token': share.share_token, 'word': caption,
+        'upload': upload,
+    }
+
+def scenarios(objects):
+    """One request per router endpoint, built against `objects` from fixture()"""
+    album, page, media = objects['album'], objects['page'], objects['media']
+    token = objects['token']
+    page_ids = [str(pk) for pk in album.pages.order_by('-page_number').values_list('id', flat=True)]
+    media_ids = [str(pk) for pk in page.media_items.order_by('-position').values_list('id', flat=True)]
+    new_media = {
+        'media_type': 'image', 'file_url': 'https://utfs.io/f/bench.jpg',
+        'file_key': 'bench', 'caption': 'benchmark upload',
+    }
+    return {
+        'api-root': Scenario('api-root', 'GET', '/api/', None),
+        'album-list': Scenario('album-list', 'GET', '/api/albums/', None),
+        'album-list-summary': Scenario('album-list', 'GET', '/api/albums/?view=summary', None),
+        'album-create': Scenario('album-list', 'POST', '/api/albums/', {'title': 'Benchmark'}),
+        'album-detail': Scenario('album-detail', 'GET', f'/api/albums/{album.pk}/', None),
+        'album-update': Scenario(
+            'album-detail', 'PUT', f'/api/albums/{album.pk}/', {'title': 'Renamed'}
+        ),
+        'album-partial-update': Scenario(
+            'album-detail', 'PATCH', f'/api/albums/{album.pk}/', {'title': 'Renamed'}
+        ),
+        'album-destroy': Scenario('album-detail', 'DELETE', f'/api/albums/{album.pk}/', None),
+        'album-add-page': Scenario(
+            'album-add-page', 'POST', f'/api/albums/{album.pk}/add_page/',
+            {'title': 'Benchmark', 'page_number': len(page_ids) + 1}
+        ),
+        'album-export': Scenario(
+            'album-export', 'GET', f'/api/albums/{album.pk}/export/?output=ndjson', None
+        ),
+        'album-pages': Scenario('album-pages', 'GET', f'/api/albums/{album.pk}/pages/', None),
+        'album-pages-skeleton': Scenario(
+            'album-pages', 'GET', f'/api/albums/{album.pk}/pages/?view=skeleton', None
+        ),
+        'album-pages-window': Scenario(
+            'album-pages', 'GET', f'/api/albums/{album.pk}/pages/?from=1&to=10', None
+        ),
+        'album-reorder-pages': Scenario(
+            'album-reorder-pages', 'POST', f'/api/albums/{album.pk}/reorder_pages/',
+            {'page_order': page_ids}
+        ),
+        'album-shared-link': Scenario(
+            'album-shared-link', 'GET', f'/api/albums/{album.pk}/shared_link/', None
+        ),
+        'page-list': Scenario('albumpage-list', 'GET', '/api/pages/', None),
+        'page-create': Scenario(
+            'albumpage-list', 'POST', '/api/pages/',
+            {'title': 'Benchmark', 'page_number': len(page_ids) + 1}
+        ),
+        'page-detail': Scenario('albumpage-detail', 'GET', f'/api/pages/{page.pk}/', None),
+        'page-update': Scenario(
+            'albumpage-detail', 'PUT', f'/api/pages/{page.pk}/',
+            {'title': 'Renamed', 'page_number': page.page_number}
+        ),
+        'page-partial-update': Scenario(
+            'albumpage-detail', 'PATCH', f'/api/pages/{page.pk}/', {'title': 'Renamed'}
+        ),
+        'page-destroy': Scenario('albumpage-detail', 'DELETE', f'/api/pages/{page.pk}/', None),
+        'page-add-media': Scenario(
+            'albumpage-add-media', 'POST', f'/api/pages/{page.pk}/add_media/', new_media
+        ),
+        'page-add-media-bulk': Scenario(
+            'albumpage-add-media-bulk', 'POST', f'/api/pages/{page.pk}/add_media_bulk/',
+            [dict(new_media, file_key=f'bench-{n}') for n in range(50)]
+        ),
+        'page-media': Scenario('albumpage-media', 'GET', f'/api/pages/{page.pk}/media/', None),
+        'page-reorder-media': Scenario(
+            'albumpage-reorder-media', 'POST', f'/api/pages/{page.pk}/reorder_media/',
+            {'media_order': media_ids}
+        ),
+        'media-list': Scenario('mediaitem-list', 'GET', '/api/media/', None),
+        'media-create': Scenario('mediaitem-list', 'POST', '/api/media/', new_media),
+        'media-detail': Scenario('mediaitem-detail', 'GET', f'/api/media/{media.pk}/', None),
+        'media-update': Scenario(
+            'mediaitem-detail', 'PUT', f'/api/media/{media.pk}/',
+            dict(new_media, file_key=media.file_key)
+        ),
+        'media-partial-update': Scenario(
+            'mediaitem-detail', 'PATCH', f'/api/media/{media.pk}/', {'caption': 'Edited'}
+        ),
+        'media-similar': Scenario('mediaitem-similar', 'GET', f'/api/media/{media.pk}/similar/', None),
+        'media-destroy': Scenario('mediaitem-detail', 'DELETE', f'/api/media/{media.pk}/', None),
+        'media-delete-from-uploadthing': Scenario(
+            'mediaitem-delete-from-uploadthing', 'DELETE',
+            f'/api/media/{media.pk}/delete_from_uploadthing/', None
+        ),
+        'shared-list': Scenario('shared-album-list', 'GET', '/api/shared/', None),
+        'shared-detail': Scenario('shared-album-detail', 'GET', f'/api/shared/{token}/', None),
+        'shared-pages-window': Scenario(
+            'shared-album-pages', 'GET', f'/api/shared/{token}/pages/?from=1&to=10', None
+        ),
+        'shared-export': Scenario(
+            'shared-album-export', 'GET', f'/api/shared/{token}/export/?output=ndjson', None
+        ),
+        'search': Scenario('search-list', 'GET', f"/api/search/?q={objects['word']}", None),
+        'duplicates-album': Scenario('duplicates-list', 'GET', f'/api/duplicates/?album={album.pk}', None),
+        'duplicates-library': Scenario(
+            'duplicates-list', 'GET', f'/api/duplicates/?user={album.created_by_id}', None
+        ),
+        'duplicates-check': Scenario(
+            'duplicates-check', 'GET', f"/api/duplicates/check/?sha256={'0' * 64}", None
+        ),
+        'upload-create': Scenario(
+            'upload-list', 'POST', '/api/uploads/', {'filename': 'bench.jpg', 'size': UPLOAD_SIZE}
+        ),
+        'upload-detail': Scenario('upload-detail', 'GET', f"/api/uploads/{objects['upload'].pk}/", None),
+        'upload-append': Scenario(
+            'upload-detail', 'PATCH', f"/api/uploads/{objects['upload'].pk}/", UPLOAD_CHUNK,
+            {'HTTP_UPLOAD_OFFSET': '0'}
+        ),
+    }
+
+class _Rollback(Exception):
+    pass
+
+def _request(client, scenario):
+    """
+    Issue the request, reading a streamed body so it is part of the cost.
+    Returns the response and the queries it ran.
+    """
+    # Writes run in a transaction that is rolled back, so every iteration
+    # (and every later scenario) sees the same data
+    reset_queries()
+    try:
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                if isinstance(scenario.data, bytes):
+                    body, content_type = scenario.data, 'application/offset+octet-stream'
+                else:
+                    body = json.dumps(scenario.data) if scenario.data is not None else ''
+                    content_type = 'application/json'
+                response = client.generic(
+                    scenario.method, scenario.path, body, content_type=content_type,
+                    **(scenario.headers or {})
+                )
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+            if scenario.method != 'GET':
+                raise _Rollback
+    except _Rollback:
+        pass
+    return response, len(queries)
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+def measure(client, scenario, iterations=20, warmup=2):
+    """Latency percentiles, queries per request and peak traced memory of one scenario"""
+    for _ in range(warmup):
+        _request(client, scenario)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _request(client, scenario)
+        timings.append((time.perf_counter() - start) * 1000)
+    # Counted and traced on separate runs so neither skews the timings
+    response, queries = _request(client, scenario)
+    tracemalloc.start()
+    try:
+        _request(client, scenario)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'route': scenario.route,
+        'method': scenario.method,
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': queries,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def run(iterations=20, warmup=2, only=None, meta=None):
+    """Benchmark every scenario against the current database; returns the report dict"""
+    objects = fixture()
+    cases = scenarios(objects)
+    if only:
+        cases = {name: case for name, case in cases.items() if name in only}
+    client = Client(raise_request_exception=False)
+    # Failing endpoints are reported by status; keep their tracebacks out of the output
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    # Upload chunks land in a scratch media root
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            endpoints = {name: measure(client, case, iterations, warmup) for name, case in cases.items()}
+    finally:
+        request_logger.setLevel(level)
+    covered = {(case.route, case.method) for case in scenarios(objects).values()}
+    counts = Album.objects.aggregate(
+        albums=Count('id', distinct=True), pages=Count('pages', distinct=True)
+    )
+    return {
+        'meta': dict(meta or {}, **{
+            'created_at': timezone.now().isoformat(),
+            'iterations': iterations,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'albums': counts['albums'],
+            'pages': counts['pages'],
+            'media': MediaItem.objects.count(),
+        }),
+        'endpoints': endpoints,
+        'uncovered': sorted(f'{method} {name}' for name, method in router_routes() - covered),
+    }
+
+def compare(report, baseline, tolerance=0.25):
+    """
+    Regressions of `report` against `baseline`, as readable strings. Latency
+    and memory may grow by `tolerance` (a fraction) before counting; any
+    extra query per request counts.
+    """
+    regressions = []
+    for name, before in baseline.get('endpoints', {}).items():
+        after = report['endpoints'].get(name)
+        if after is None:
+            continue
+        if after['status'] != before['status']:
+            regressions.append(f"{name}: status {before['status']} -> {after['status']}")
+        if after['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {after['queries']}")
+        for metric, floor in THRESHOLD_FLOORS.items():
+            limit = max(before[metric] * (1 + tolerance), before[metric] + floor)
+            if after[metric] > limit:
+                regressions.append(f'{name}: {metric} {before[metric]} -> {after[metric]}')
+    return regressions
+
+def _cpu_p50(work, iterations):
+    """p50 of process_time over `iterations` calls of work(), in ms, and its last result"""
+    timings = []
+    for _ in range(iterations):
+        # Collect between runs, not inside the timings
+        gc.collect()
+        start = time.process_time()
+        result = work()
+        timings.append((time.process_time() - start) * 1000)
+    return round(percentile(timings, 50), 3), result
+
+def wire_formats(iterations=20):
+    """
+    Bytes and CPU per album detail response (the album with most pages) in
+    each of WIRE_FORMATS: p50 process_time in ms to serialize the prefetched
+    tree (once per API version, shared by the formats using it), render it
+    and compress it. The tree is loaded once up front, so database time is
+    left out. Formats needing an optional package that is not installed are
+    skipped.
+    """
+    album = Album.objects.with_tree().order_by('-page_count', 'id').first()
+    factory = APIRequestFactory()
+    serialized = {}
+    for version in sorted({version for _, version, _ in WIRE_FORMATS.values()}):
+        request = Request(factory.get(f'/api/albums/{album.pk}/'))
+        request.version = version
+        serialized[version] = _cpu_p50(
+            lambda: AlbumSerializer(album, context={'request': request}).data, iterations
+        )
+
+    formats = {}
+    for name, (renderer_class, version, coding) in WIRE_FORMATS.items():
+        if renderer_class is renderers.MessagePackRenderer and renderers.msgpack is None:
+            continue
+        if coding is not None and coding not in compression.available_encodings():
+            continue
+        renderer = renderer_class()
+        serialize_ms, data = serialized[version]
+        render_ms, body = _cpu_p50(lambda: renderer.render(data, renderer.media_type, {}), iterations)
+        compress_ms = 0.0
+        if coding is not None:
+            compress_ms, body = _cpu_p50(lambda: compression.compress(body, coding), iterations)
+        formats[name] = {
+            'bytes': len(body),
+            'serialize_ms': serialize_ms,
+            'render_ms': render_ms,
+            'compress_ms': compress_ms,
+            'cpu_ms': round(serialize_ms + render_ms + compress_ms, 3),
+        }
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'iterations': iterations,
+            'python': platform.python_version(),
+            'album_pages': album.page_count,
+            'album_media': album.image_count + album.video_count,
+        },
+        'formats': formats,
+    }
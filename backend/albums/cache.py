@@ -0,0 +1,198 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+class LRUBackend:
+    """
+    In-process LRU store bounded by the total size of its values. Entries are
+    local to the worker process: a write only invalidates the worker that
+    made it, so with several workers give entries a short `timeout`, which
+    bounds how long the others serve stale bodies, or use DjangoCacheBackend
+    with a shared cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, timeout=None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _sizeof(cls, key, value):
+        if isinstance(value, (bytes, str)):
+            return len(key) + len(value)
+        if isinstance(value, tuple):
+            return sum(cls._sizeof('', part) for part in value) + len(key)
+        return len(key) + 64
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self.size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+class DjangoCacheBackend:
+    """Store entries in one of the project's CACHES aliases"""
+
+    def __init__(self, alias='default', timeout=3600):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+class SharedAlbumCache:
+    """
+    Rendered JSON for shared albums, keyed by share token, album content
+    version and request variant (query string).
+
+    Each album has a random version string; any write to the album bumps it,
+    which orphans every body rendered for the old version. A version that
+    was evicted is simply regenerated, so stale bodies can never resurface.
+    """
+
+    def __init__(self, backend, prefix='albums:shared'):
+        self.backend = backend
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, kind, *parts):
+        # Tokens and Accept-derived variants may hold spaces or run long;
+        # hashing keeps every key short and safe for memcached
+        digest = hashlib.sha1('\0'.join(str(part) for part in parts).encode()).hexdigest()
+        return '%s:%s:%s' % (self.prefix, kind, digest)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def album_for_token(self, token):
+        return self.backend.get(self._key('token', token))
+
+    def remember_token(self, token, album_id):
+        self.backend.set(self._key('token', token), str(album_id))
+
+    def forget_token(self, token):
+        self.backend.delete(self._key('token', token))
+
+    def version(self, album_id, create=True):
+        key = self._key('version', album_id)
+        version = self.backend.get(key)
+        if version is None and create:
+            version = uuid.uuid4().hex
+            self.backend.set(key, version)
+        return version
+
+    def bump(self, album_id):
+        self.backend.set(self._key('version', album_id), uuid.uuid4().hex)
+
+    def get(self, token, variant='', count_miss=True):
+        """
+        Return the cached (body, validators) entry for a token, or None.
+        Callers that fall back to a lookup which counts pass count_miss=False.
+        """
+        album_id = self.album_for_token(token)
+        version = self.version(album_id, create=False) if album_id else None
+        entry = self.backend.get(self._key('body', token, version, variant)) if version else None
+        if entry is not None or count_miss:
+            self._count(entry is not None)
+        return entry
+
+    def set(self, token, version, body, validators=None, variant=''):
+        self.backend.set(self._key('body', token, version, variant), (body, validators))
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses}
+        for name in ('size', 'evictions'):
+            if hasattr(self.backend, name):
+                stats[name] = getattr(self.backend, name)
+        return stats
+
+_shared_album_cache = None
+_cache_lock = threading.Lock()
+
+def get_shared_album_cache():
+    """Build the process-wide SharedAlbumCache from settings.SHARED_ALBUM_CACHE"""
+    global _shared_album_cache
+    if _shared_album_cache is None:
+        with _cache_lock:
+            if _shared_album_cache is None:
+                config = getattr(settings, 'SHARED_ALBUM_CACHE', {})
+                backend_class = import_string(config.get('BACKEND', 'albums.cache.LRUBackend'))
+                _shared_album_cache = SharedAlbumCache(backend_class(**config.get('OPTIONS', {})))
+    return _shared_album_cache
+
+@receiver(setting_changed)
+def _reset_shared_album_cache(setting, **kwargs):
+    global _shared_album_cache
+    if setting == 'SHARED_ALBUM_CACHE':
+        _shared_album_cache = None
+
+def invalidate_album(album_id):
+    """Bump an album's content version once the current transaction commits"""
+    transaction.on_commit(lambda: get_shared_album_cache().bump(album_id))
+
+def invalidate_share(token):
+    transaction.on_commit(lambda: get_shared_album_cache().forget_token(token))
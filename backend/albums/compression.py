@@ -0,0 +1,129 @@
+import zlib
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+def available_encodings():
+    """Content codings this server can produce, preferred first"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def negotiate(accept_encoding):
+    """
+    The coding to answer an Accept-Encoding header with, or None for the
+    identity: the client's highest q-value, ties going to our preference.
+    """
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in available_encodings():
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compressor(coding):
+    """(feed, finish) functions of a fresh streaming compressor for `coding`"""
+    if coding == 'br':
+        c = brotli.Compressor(quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+        return c.process, c.finish
+    # wbits 31: a gzip header and trailer around the deflate stream
+    c = zlib.compressobj(settings.RESPONSE_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return c.compress, c.flush
+
+def compress(body, coding):
+    feed, finish = compressor(coding)
+    return feed(body) + finish()
+
+def compress_sequence(chunks, coding):
+    feed, finish = compressor(coding)
+    for chunk in chunks:
+        data = feed(chunk)
+        if data:
+            yield data
+    yield finish()
+
+async def acompress_sequence(chunks, coding):
+    feed, finish = compressor(coding)
+    async for chunk in chunks:
+        data = feed(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def compressible(response):
+    """Whether `response` is API data worth compressing, as opposed to media or HTML"""
+    if response.has_header('Content-Encoding') or response.has_header('Content-Range'):
+        return False
+    # Media files (FileResponse) know their length and go out as stored
+    if response.streaming and response.has_header('Content-Length'):
+        return False
+    if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+        return False
+    content_type = response.get('Content-Type', '').partition(';')[0].strip().lower()
+    return content_type in settings.RESPONSE_COMPRESSION_TYPES
+
+class CompressionMiddleware:
+    """
+    Compress API responses of RESPONSE_COMPRESSION_TYPES with brotli (when
+    installed) or gzip, whichever the client ranks higher, once they reach
+    RESPONSE_COMPRESSION_MIN_BYTES. Streamed exports are compressed as they
+    stream. Leave HTML out of the types: pages with CSRF tokens are what
+    BREACH attacks. Strong ETags become weak, as with Django's
+    GZipMiddleware. Put it right after MetricsMiddleware so the metrics count
+    the bytes actually sent.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if not compressible(response):
+            return response
+        patch_vary_headers(response, ['Accept-Encoding'])
+        coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_sequence(response.streaming_content, coding)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content, coding)
+        else:
+            body = compress(response.content, coding)
+            if len(body) >= len(response.content):
+                return response
+            response.content = body
+            response['Content-Length'] = str(len(body))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
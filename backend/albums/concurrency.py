@@ -0,0 +1,111 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.test import Client, override_settings
+from .benchmark import percentile
+from .models import Album, AlbumPage
+
+# Settings each SQLite profile runs under
+PROFILES = {
+    'default': lambda: {'pragmas': {}, 'immediate': False, 'write_lock': False, 'conn_max_age': 0},
+    'production': lambda: {
+        'pragmas': settings.SQLITE_PRODUCTION_PRAGMAS, 'immediate': True, 'write_lock': False,
+        'conn_max_age': 600,
+    },
+    # The production profile with SQLiteWriteLockMiddleware queueing writers
+    'write-lock': lambda: {
+        'pragmas': settings.SQLITE_PRODUCTION_PRAGMAS, 'immediate': False, 'write_lock': True,
+        'conn_max_age': 600,
+    },
+}
+
+def _worker(role, targets, seconds, start, results):
+    """Issue requests of one role until `seconds` have passed; report counts and latencies"""
+    client = Client(raise_request_exception=False)
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    path = targets[role]
+    body = json.dumps({
+        'media_type': 'image', 'file_url': 'https://utfs.io/f/load.jpg',
+        'file_key': 'load', 'caption': 'load test',
+    })
+    latencies, errors = [], 0
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        began = time.perf_counter()
+        if role == 'read':
+            response = client.get(path)
+        else:
+            response = client.post(path, body, content_type='application/json')
+        latencies.append((time.perf_counter() - began) * 1000)
+        if response.status_code >= 500:
+            errors += 1
+        # The test client leaves connections open; honour CONN_MAX_AGE like a server would
+        close_old_connections()
+    results.put((role, latencies, errors))
+
+def run_profile(name, source, readers=4, writers=2, seconds=5.0):
+    """
+    Copy the SQLite database `source` and load it from `readers` processes
+    reading the fullest album and `writers` processes adding media to its
+    first page, all under the named profile. Returns throughput, tail latency
+    and server errors per role.
+    """
+    profile = PROFILES[name]()
+    directory = tempfile.mkdtemp(prefix=f'album-load-{name}-')
+    old_name, old_age = connection.settings_dict['NAME'], connection.settings_dict['CONN_MAX_AGE']
+    connection.close()
+    shutil.copy(source, os.path.join(directory, 'db.sqlite3'))
+    context = multiprocessing.get_context('fork')
+    try:
+        connection.settings_dict['NAME'] = os.path.join(directory, 'db.sqlite3')
+        connection.settings_dict['CONN_MAX_AGE'] = profile['conn_max_age']
+        with override_settings(
+            SQLITE_PRAGMAS=profile['pragmas'], SQLITE_IMMEDIATE_TRANSACTIONS=profile['immediate'],
+            SQLITE_WRITE_LOCK=profile['write_lock'],
+            METRICS_ENABLED=False,
+        ):
+            album = Album.objects.order_by('-page_count', 'id').first()
+            page = AlbumPage.objects.filter(album=album).order_by('page_number').first()
+            targets = {'read': f'/api/albums/{album.pk}/', 'write': f'/api/pages/{page.pk}/add_media/'}
+            # Children must open their own connections
+            connection.close()
+            start, results = context.Event(), context.Queue()
+            roles = ['read'] * readers + ['write'] * writers
+            processes = [
+                context.Process(target=_worker, args=(role, targets, seconds, start, results))
+                for role in roles
+            ]
+            for process in processes:
+                process.start()
+            start.set()
+            collected = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'], connection.settings_dict['CONN_MAX_AGE'] = old_name, old_age
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {}
+    for role, workers in (('read', readers), ('write', writers)):
+        latencies = [ms for r, values, _ in collected if r == role for ms in values]
+        report[role] = {
+            'workers': workers,
+            'requests': len(latencies),
+            'per_second': round(len(latencies) / seconds, 1),
+            'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+            'errors': sum(errors for r, _, errors in collected if r == role),
+        }
+    return report
+
+def run(source, readers=4, writers=2, seconds=5.0, profiles=tuple(PROFILES)):
+    """run_profile() for each profile against the same starting database"""
+    return {name: run_profile(name, source, readers, writers, seconds) for name in profiles}
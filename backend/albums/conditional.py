@@ -0,0 +1,101 @@
+import hashlib
+from collections import namedtuple
+from django.db.models import Count, Max, Min, Q
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from .models import Album, AlbumPage
+
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
+
+def _validators(scope, pk, last_modified, counts, variant):
+    # Counts are part of the tag so deleting a child (which leaves every
+    # remaining updated_at untouched) still changes the representation
+    raw = '|'.join([scope, str(pk), last_modified.isoformat(), *map(str, counts), variant])
+    return Validators('"%s"' % hashlib.sha256(raw.encode()).hexdigest()[:32], last_modified)
+
+def _latest(*values):
+    return max(value for value in values if value is not None)
+
+def album_validators(album_id, variant=''):
+    """ETag/Last-Modified for an album tree from one aggregate query, or None if missing"""
+    row = Album.objects.filter(pk=album_id).aggregate(
+        album_updated=Max('updated_at'),
+        pages_updated=Max('pages__updated_at'),
+        media_updated=Max('pages__media_items__updated_at'),
+        page_count=Count('pages', distinct=True),
+        media_count=Count('pages__media_items'),
+    )
+    if row['album_updated'] is None:
+        return None
+    last_modified = _latest(row['album_updated'], row['pages_updated'], row['media_updated'])
+    return _validators('album', album_id, last_modified, (row['page_count'], row['media_count']), variant)
+
+def window_validators(album_id, first, last, variant=''):
+    """
+    ETag/Last-Modified for the pages of an album numbered first..last, or
+    None if the album is missing. The tag only follows the window and the
+    page-number bounds its links depend on, so media edits on other pages
+    leave it alone; Last-Modified, which cannot see bounds, follows every page.
+    """
+    in_window = Q(pages__page_number__range=(first, last))
+    row = Album.objects.filter(pk=album_id).aggregate(
+        album_updated=Max('updated_at'),
+        pages_updated=Max('pages__updated_at'),
+        media_updated=Max('pages__media_items__updated_at', filter=in_window),
+        page_count=Count('pages', filter=in_window, distinct=True),
+        media_count=Count('pages__media_items', filter=in_window),
+        window_updated=Max('pages__updated_at', filter=in_window),
+        first_page=Min('pages__page_number'),
+        last_page=Max('pages__page_number'),
+    )
+    if row['album_updated'] is None:
+        return None
+    window_modified = _latest(row['album_updated'], row['window_updated'], row['media_updated'])
+    counts = (row['page_count'], row['media_count'], row['first_page'], row['last_page'])
+    etag = _validators(f'window:{first}-{last}', album_id, window_modified, counts, variant).etag
+    return Validators(etag, _latest(window_modified, row['pages_updated']))
+
+def page_validators(page_id, variant=''):
+    """ETag/Last-Modified for a page and its media from one aggregate query, or None if missing"""
+    row = AlbumPage.objects.filter(pk=page_id).aggregate(
+        page_updated=Max('updated_at'),
+        media_updated=Max('media_items__updated_at'),
+        media_count=Count('media_items'),
+    )
+    if row['page_updated'] is None:
+        return None
+    last_modified = _latest(row['page_updated'], row['media_updated'])
+    return _validators('page', page_id, last_modified, (row['media_count'],), variant)
+
+def remember_validators(request, compute, pk, variant, validators):
+    """Keep validators an async front computed for the view that renders the request"""
+    request._validators = (compute, pk, variant, validators)
+
+def known_validators(request, compute, pk, variant=''):
+    """compute(pk, variant), reusing the result remember_validators() kept for this request"""
+    known = getattr(request, '_validators', None)
+    if known is not None and known[:3] == (compute, pk, variant):
+        return known[3]
+    return compute(pk, variant)
+
+def request_variant(request):
+    """Distinguish representations of the same resource (renderer and query string)"""
+    renderer = getattr(request, 'accepted_media_type', '') or ''
+    return f"{renderer}?{request.META.get('QUERY_STRING', '')}"
+
+def apply_validators(response, validators):
+    response['ETag'] = validators.etag
+    response['Last-Modified'] = http_date(validators.last_modified.timestamp())
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+def not_modified(request, validators):
+    """Return a 304 (or 412) response if the request's preconditions allow it, else None"""
+    response = get_conditional_response(
+        request,
+        etag=validators.etag,
+        last_modified=int(validators.last_modified.timestamp()),
+    )
+    if response is not None:
+        apply_validators(response, validators)
+    return response
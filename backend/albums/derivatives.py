@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .cache import invalidate_album
+from .duplicates import canonical_file
+from .imaging import THUMBNAIL, derivative_name, derive, narrower_widths, source_allowed
+from .models import MediaItem, PHASH_BAND_FIELDS, phash_bands
+from .outbox import enqueue_file_deletions
+from .signals import album_id_for_page
+from .stats import apply_stats
+from .storage import DERIVATIVES_DIR, is_content_key, is_local_key
+
+logger = logging.getLogger(__name__)
+
+def rendition_name(digest, size):
+    return derivative_name(DERIVATIVES_DIR, digest, size)
+
+def srcset(base, media):
+    """
+    srcset for a measured image: every rendition narrower than the original,
+    then the original itself. Empty until the pipeline has run.
+    `base` is the absolute MEDIA_URL.
+    """
+    if media.derivative_status != 'ready':
+        return ''
+    candidates = [
+        f'{base}{quote(rendition_name(media.content_hash, width))} {width}w'
+        for width in narrower_widths(media.width, settings.MEDIA_DERIVATIVE_WIDTHS)
+    ]
+    candidates.append(f'{media.file_url} {media.width}w')
+    return ', '.join(candidates)
+
+def thumbnail_url(base, media):
+    if media.derivative_status != 'ready':
+        return None
+    return base + quote(rendition_name(media.content_hash, THUMBNAIL))
+
+def executor(workers=None):
+    """
+    Process pool for rendering. Workers are spawned fresh rather than
+    forked, so they inherit no database connections or threads; they only
+    import albums.imaging.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers or settings.MEDIA_DERIVATIVE_WORKERS or None,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+def job_for(media):
+    """The worker job rendering `media`'s original, or None when it may not be fetched"""
+    options = {
+        'media_root': str(settings.MEDIA_ROOT),
+        'directory': DERIVATIVES_DIR,
+        'widths': settings.MEDIA_DERIVATIVE_WIDTHS,
+        'thumbnail_size': settings.MEDIA_THUMBNAIL_SIZE,
+        'quality': settings.MEDIA_DERIVATIVE_QUALITY,
+        'max_pixels': settings.MEDIA_DERIVATIVE_MAX_PIXELS,
+    }
+    if is_local_key(media.file_key):
+        if not is_content_key(media.file_key):
+            return None
+        # Local names are their own SHA-256
+        digest = os.path.splitext(os.path.basename(media.file_key))[0]
+        try:
+            path = default_storage.path(media.file_key)
+        except SuspiciousFileOperation:
+            return None
+        return {'path': path, 'digest': digest, 'options': options}
+    if not source_allowed(media.file_url, settings.MEDIA_DERIVATIVE_SOURCE_HOSTS):
+        return None
+    return {
+        'url': media.file_url,
+        'hosts': settings.MEDIA_DERIVATIVE_SOURCE_HOSTS,
+        'max_bytes': settings.MEDIA_DERIVATIVE_MAX_SOURCE_BYTES,
+        'timeout': (settings.UPLOADTHING_CONNECT_TIMEOUT, settings.UPLOADTHING_READ_TIMEOUT),
+        'options': options,
+    }
+
+def requeue(statuses=('ready', 'failed')):
+    """Send images back through the pipeline, e.g. after the widths changed"""
+    return MediaItem.objects.filter(media_type='image', derivative_status__in=statuses).update(
+        derivative_status='pending'
+    )
+
+def process_batch(pool, batch_size=100):
+    """
+    Render one batch of pending images in `pool` and store what was
+    measured: width, height, file size, content and perceptual hashes
+    replace whatever the client sent, and file size moves the page and album
+    totals. An original shared by several items is fetched and rendered
+    once. With MEDIA_REUSE_DUPLICATE_FILES, an item whose content is already
+    stored under another key is pointed at that file and its own copy is
+    queued for deletion. Rows whose file or size changed meanwhile are left
+    pending for another pass. Returns a dict of counts.
+    """
+    items = list(
+        MediaItem.objects.filter(media_type='image', derivative_status='pending')
+        .order_by('created_at')
+        .only('id', 'page_id', 'file_key', 'file_url', 'file_size')[:batch_size]
+    )
+    stats = {'claimed': len(items), 'ready': 0, 'failed': 0, 'skipped': 0, 'deduplicated': 0}
+    jobs = {}
+    for media in items:
+        if media.file_key not in jobs:
+            jobs[media.file_key] = job_for(media)
+    runnable = [key for key, job in jobs.items() if job is not None]
+    results = dict(zip(runnable, pool.map(derive, [jobs[key] for key in runnable])))
+
+    now = timezone.now()
+    albums = set()
+    for media in items:
+        result = results.get(media.file_key) or {'error': 'Not a source the pipeline may read'}
+        if 'error' in result:
+            logger.warning('No derivatives for media %s (%s): %s', media.pk, media.file_key, result['error'])
+            changes = {'derivative_status': 'failed'}
+        else:
+            changes = {
+                'derivative_status': 'ready', 'content_hash': result['digest'],
+                'width': result['width'], 'height': result['height'], 'file_size': result['size'],
+                'perceptual_hash': result['phash'],
+                **dict(zip(PHASH_BAND_FIELDS, phash_bands(result['phash']))),
+            }
+        with transaction.atomic():
+            canonical = None
+            if 'content_hash' in changes and settings.MEDIA_REUSE_DUPLICATE_FILES:
+                canonical = canonical_file(changes['content_hash'], media.file_key)
+                if canonical is not None:
+                    changes['file_key'], changes['file_url'] = canonical
+            updated = MediaItem.objects.filter(
+                pk=media.pk, file_key=media.file_key, file_size=media.file_size,
+                derivative_status='pending',
+            ).update(updated_at=now, **changes)
+            album_id = album_id_for_page(media.page_id)
+            if updated and 'file_size' in changes:
+                delta = changes['file_size'] - (media.file_size or 0)
+                apply_stats(media.page_id, album_id, {'total_file_size': delta})
+            if updated and canonical is not None:
+                # The duplicate upload goes unless something else still uses it
+                enqueue_file_deletions([media.file_key])
+        if not updated:
+            stats['skipped'] += 1
+            continue
+        stats['ready' if 'error' not in result else 'failed'] += 1
+        stats['deduplicated'] += canonical is not None
+        albums.add(album_id)
+    for album_id in albums:
+        invalidate_album(album_id)
+    return stats
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from django.db.models import Count, Q
+from .models import MediaItem, PHASH_BAND_BITS, PHASH_BANDS, PHASH_BAND_FIELDS, phash_bands
+
+# Multi-index hashing: hashes within distance d agree on some band to within
+# d // PHASH_BANDS bits. Probing one-bit neighbours of each band covers
+# distances up to 7; beyond that the probes (and false candidates) balloon.
+MAX_DISTANCE = 2 * PHASH_BANDS - 1
+MEDIA_FIELDS = ['id', 'page_id', 'page__album_id', 'file_key', 'file_url', 'caption', 'file_size']
+
+def hamming(a, b):
+    return ((a ^ b) & ((1 << 64) - 1)).bit_count()
+
+def band_probes(value, distance):
+    """Band values to look up for hashes within `distance` of a band equal to `value`"""
+    probes = {value}
+    if distance // PHASH_BANDS:
+        probes.update(value ^ (1 << bit) for bit in range(PHASH_BAND_BITS))
+    return probes
+
+def similar(phash, queryset, distance):
+    """
+    [(distance, media)] for items of `queryset` whose perceptual hash is
+    within `distance` of `phash`, closest first. Each band is looked up
+    through its own index, so the cost follows the number of candidates,
+    not the size of the table.
+    """
+    condition = Q()
+    for name, value in zip(PHASH_BAND_FIELDS, phash_bands(phash)):
+        condition |= Q(**{f'{name}__in': sorted(band_probes(value, distance))})
+    matches = []
+    for media in queryset.filter(condition):
+        d = hamming(phash, media.perceptual_hash)
+        if d <= distance:
+            matches.append((d, media))
+    matches.sort(key=lambda match: match[0])
+    return matches
+
+def scope(album_id=None, user_id=None):
+    """Media of one album, or of every album a user created"""
+    if album_id is not None:
+        return MediaItem.objects.filter(page__album_id=album_id)
+    return MediaItem.objects.filter(page__album__created_by_id=user_id)
+
+def exact_groups(queryset):
+    """Lists of ids of items in `queryset` sharing a content hash"""
+    shared = (
+        queryset.exclude(content_hash='').order_by().values('content_hash')
+        .annotate(copies=Count('id')).filter(copies__gt=1).values('content_hash')
+    )
+    groups = defaultdict(list)
+    rows = queryset.filter(content_hash__in=shared).order_by('created_at').values_list('content_hash', 'id')
+    for content_hash, pk in rows:
+        groups[content_hash].append(pk)
+    return list(groups.values())
+
+def similar_groups(queryset, distance):
+    """
+    Lists of ids of items in `queryset` whose images are near-duplicates:
+    connected through hashes within `distance`, across two or more distinct
+    contents (exact copies are exact_groups). One pass over the scope's
+    stored bands, bucketed in memory; up to distance 3 each band is matched
+    exactly, beyond that every one-bit neighbour is probed too.
+    """
+    contents = defaultdict(list)
+    bands = {}
+    phashes = {}
+    rows = (
+        queryset.exclude(content_hash='').filter(perceptual_hash__isnull=False)
+        .order_by('created_at').values_list('id', 'content_hash', 'perceptual_hash', *PHASH_BAND_FIELDS)
+    )
+    for pk, content_hash, phash, *values in rows:
+        contents[content_hash].append(pk)
+        phashes[content_hash] = phash
+        bands[phash] = values
+
+    parent = {content_hash: content_hash for content_hash in phashes}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    # Contents with the same hash join at once; probing then runs per distinct hash
+    by_phash = defaultdict(list)
+    for content_hash, phash in phashes.items():
+        by_phash[phash].append(content_hash)
+    buckets = [defaultdict(list) for _ in range(PHASH_BANDS)]
+    for phash, members in by_phash.items():
+        for other in members[1:]:
+            parent[find(other)] = find(members[0])
+        for bucket, value in zip(buckets, bands[phash]):
+            bucket[value].append(phash)
+    for phash, members in by_phash.items():
+        for bucket, value in zip(buckets, bands[phash]):
+            for probe in band_probes(value, distance):
+                for other in bucket.get(probe, ()):
+                    # Each pair once, from its smaller hash
+                    if other > phash and hamming(phash, other) <= distance:
+                        parent[find(by_phash[other][0])] = find(members[0])
+
+    components = defaultdict(list)
+    for content_hash in phashes:
+        components[find(content_hash)].append(content_hash)
+    return [
+        [pk for content_hash in members for pk in contents[content_hash]]
+        for members in components.values() if len(members) > 1
+    ]
+
+def describe(groups):
+    """Groups of ids as lists of item summaries, largest waste first"""
+    ids = [pk for group in groups for pk in group]
+    rows = {}
+    for start in range(0, len(ids), 500):
+        chunk = MediaItem.objects.filter(pk__in=ids[start:start + 500]).values(*MEDIA_FIELDS)
+        rows.update((row['id'], row) for row in chunk)
+    described = []
+    for group in groups:
+        items = [
+            {**{name: row[name] for name in MEDIA_FIELDS if name != 'page__album_id'},
+             'album_id': row['page__album_id']}
+            for row in (rows[pk] for pk in group)
+        ]
+        # Items sharing a file cost nothing extra; of the distinct files, all
+        # but the largest could go
+        sizes = sorted({item['file_key']: item['file_size'] or 0 for item in items}.values(), reverse=True)
+        described.append({'wasted_bytes': sum(sizes[1:]), 'items': items})
+    described.sort(key=lambda group: group['wasted_bytes'], reverse=True)
+    return described
+
+def canonical_file(content_hash, file_key):
+    """(file_key, file_url) of the oldest item holding the same content under another key"""
+    return (
+        MediaItem.objects.filter(content_hash=content_hash).exclude(file_key=file_key)
+        .order_by('created_at').values_list('file_key', 'file_url').first()
+    )
@@ -0,0 +1,167 @@
+import zipfile
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Album, AlbumPage, MediaItem
+from .storage import is_content_key
+
+ALBUM_FIELDS = [
+    'id', 'title', 'subtitle', 'description', 'cover_image_url', 'cover_image_key',
+    'created_by__username', 'page_count', 'image_count', 'video_count',
+    'total_file_size', 'video_seconds', 'created_at', 'updated_at', 'is_public',
+]
+PAGE_FIELDS = ['id', 'title', 'page_number', 'created_at', 'updated_at']
+MEDIA_FIELDS = [
+    'id', 'media_type', 'file_url', 'file_key', 'caption', 'duration', 'position',
+    'width', 'height', 'file_size', 'created_at', 'updated_at',
+]
+FORMATS = ['json', 'ndjson', 'zip']
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+FILE_CHUNK_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+def _dumps(value):
+    return _encoder.encode(value)
+
+def album_header(album_id):
+    """The album's own columns as a dict, or None when it does not exist"""
+    header = Album.objects.filter(pk=album_id).values(*ALBUM_FIELDS).first()
+    if header is not None:
+        header['created_by_username'] = header.pop('created_by__username')
+    return header
+
+def iter_tree(album_id, chunk_size=500):
+    """
+    Yield (page, media_items) for every page in display order, where
+    media_items is a lazy iterator. Pages and media are read with one
+    streaming query each and merged on page id, so nothing beyond one chunk
+    of each is ever held in memory. Consume media_items before advancing.
+    """
+    pages = (
+        AlbumPage.objects.filter(album_id=album_id)
+        .order_by('page_number', 'id').values(*PAGE_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    media = (
+        MediaItem.objects.filter(page__album_id=album_id)
+        .order_by('page__page_number', 'page_id', 'position', 'created_at', 'id')
+        .values('page_id', *MEDIA_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    pending = [next(media, None)]
+
+    def media_for(page_id):
+        while pending[0] is not None and pending[0]['page_id'] == page_id:
+            item = pending[0]
+            pending[0] = next(media, None)
+            del item['page_id']
+            yield item
+
+    for page in pages:
+        items = media_for(page['id'])
+        yield page, items
+        # Skip whatever the caller left unread
+        for _ in items:
+            pass
+
+def iter_ndjson(header, chunk_size=500):
+    """One JSON object per line: the album, then each page followed by its media"""
+    yield _dumps(dict(header, type='album')) + '\n'
+    for page, media_items in iter_tree(header['id'], chunk_size):
+        yield _dumps(dict(page, type='page', album_id=header['id'])) + '\n'
+        for item in media_items:
+            yield _dumps(dict(item, type='media', page_id=page['id'])) + '\n'
+
+def iter_json(header, chunk_size=500):
+    """The AlbumSerializer-shaped document, emitted a record at a time"""
+    yield _dumps(header)[:-1] + ',"pages":['
+    for index, (page, media_items) in enumerate(iter_tree(header['id'], chunk_size)):
+        yield (',' if index else '') + _dumps(page)[:-1] + ',"media_items":['
+        for position, item in enumerate(media_items):
+            yield (',' if position else '') + _dumps(item)
+        yield ']}'
+    yield ']}'
+
+class _ChunkSink:
+    """Write-only file object that hands zipfile output back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+def local_file_name(file_key):
+    """
+    Storage name of a self-hosted media file, or None for anything else:
+    remote keys, keys not spelled as content_name() spells the names of
+    finished uploads, and files that have gone missing.
+    """
+    if not is_content_key(file_key):
+        return None
+    try:
+        return file_key if default_storage.exists(file_key) else None
+    except (SuspiciousFileOperation, OSError):
+        return None
+
+def iter_zip(header, chunk_size=500):
+    """
+    A ZIP with album.json (the JSON manifest) followed by every media file
+    found in local storage under files/<page_number>/. Entries are written
+    with data descriptors to a non-seekable sink, so each chunk is yielded as
+    soon as it is compressed and files are copied FILE_CHUNK_SIZE at a time.
+    Remote-only media appear in the manifest by URL only.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('album.json', 'w', force_zip64=True) as entry:
+            for chunk in iter_json(header, chunk_size):
+                entry.write(chunk.encode())
+                yield sink.drain()
+        yield sink.drain()
+
+        for page, media_items in iter_tree(header['id'], chunk_size):
+            for item in media_items:
+                name = local_file_name(item['file_key'])
+                if name is None:
+                    continue
+                flat_name = name.replace('/', '_')
+                info = zipfile.ZipInfo(f"files/{page['page_number']}/{item['position']}-{flat_name}")
+                # Photos and videos are already compressed
+                info.compress_type = zipfile.ZIP_STORED
+                try:
+                    source = default_storage.open(name, 'rb')
+                except (SuspiciousFileOperation, OSError):
+                    continue
+                with source, archive.open(info, 'w', force_zip64=True) as entry:
+                    for data in iter(lambda: source.read(FILE_CHUNK_SIZE), b''):
+                        entry.write(data)
+                        yield sink.drain()
+                yield sink.drain()
+    yield sink.drain()
+
+def export_chunks(header, export_format, chunk_size=500):
+    """Non-empty byte chunks of the export in the requested format"""
+    if export_format == 'zip':
+        chunks = iter_zip(header, chunk_size)
+    elif export_format == 'ndjson':
+        chunks = (chunk.encode() for chunk in iter_ndjson(header, chunk_size))
+    else:
+        chunks = (chunk.encode() for chunk in iter_json(header, chunk_size))
+    return (chunk for chunk in chunks if chunk)
+
+def export_filename(header, export_format):
+    return f"album-{header['id']}.{export_format}"
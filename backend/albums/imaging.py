@@ -0,0 +1,164 @@
+"""
+Image work for the derivative pipeline (albums.derivatives). Runs in worker
+processes, so this module sticks to Pillow and requests: no Django imports,
+nothing that needs settings or a database connection.
+"""
+import hashlib
+import math
+import os
+import tempfile
+from fnmatch import fnmatch
+from urllib.parse import urljoin, urlsplit
+import requests
+from PIL import Image, ImageOps
+
+EXTENSION = '.webp'
+THUMBNAIL = 'thumb'
+COPY_CHUNK_SIZE = 1024 * 1024
+MAX_REDIRECTS = 5
+ORIENTATION = 0x0112
+# Short side an image is decoded at when only its perceptual hash is needed
+HASH_DECODE_SIZE = 64
+
+def derivative_name(directory, digest, size):
+    """Storage name of the `size` ('thumb' or a width) rendition of content with this SHA-256"""
+    return f'{directory}/{digest[:2]}/{digest[2:4]}/{digest}/{size}{EXTENSION}'
+
+def narrower_widths(width, widths):
+    """The widths below `width`, ascending: originals are never scaled up"""
+    return sorted(w for w in widths if width and w < width)
+
+def source_allowed(url, hosts):
+    """Whether `url` is http(s) on one of `hosts` (fnmatch patterns such as *.ufs.sh)"""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    return parts.scheme in ('http', 'https') and any(fnmatch(host, pattern) for pattern in hosts)
+
+def download(url, path, hosts, max_bytes, timeout):
+    """
+    Stream `url` into `path`, following redirects only to allowed hosts, and
+    return (sha256, size). Raises ValueError past max_bytes or off the list.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        if not source_allowed(url, hosts):
+            raise ValueError(f'Not an allowed source: {url}')
+        with requests.get(url, stream=True, timeout=timeout, allow_redirects=False) as response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers['Location'])
+                continue
+            response.raise_for_status()
+            digest, size = hashlib.sha256(), 0
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f'Larger than {max_bytes} bytes')
+                    digest.update(chunk)
+                    f.write(chunk)
+            return digest.hexdigest(), size
+    raise ValueError(f'More than {MAX_REDIRECTS} redirects')
+
+def dhash(image):
+    """
+    64-bit difference hash: whether each pixel of a 9x8 greyscale reduction
+    is brighter than its right neighbour. Resizing, recompression and small
+    edits move few bits. Returned signed, as a BigIntegerField stores it.
+    """
+    pixels = list(image.resize((9, 8), Image.BOX).convert('L').getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left, right = pixels[row * 9 + column], pixels[row * 9 + column + 1]
+            value = (value << 1) | (left > right)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _save(image, path, quality):
+    """Write atomically, so a reader never sees half a file and a crash leaves none"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, 'WEBP', quality=quality, method=4)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def render(source, digest, media_root, directory, widths, thumbnail_size, quality, max_pixels):
+    """
+    Render the thumbnail (a centred square) and every width in `widths`
+    narrower than the image at `source` under media_root, skipping
+    renditions already on disk. Returns the upright (width, height) and
+    the perceptual hash.
+
+    JPEGs are decoded at the smallest DCT scale that still covers the
+    largest rendition, and each width is resized from the next larger one
+    rather than from the full original.
+    """
+    # Pillow refuses only images over twice MAX_IMAGE_PIXELS (and merely
+    # warns above it), so the header's size is checked before any decoding
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(source) as original:
+        stored_width, stored_height = original.size
+        if stored_width * stored_height > max_pixels:
+            raise Image.DecompressionBombError(
+                f'{stored_width}x{stored_height} exceeds the limit of {max_pixels} pixels'
+            )
+        rotated = original.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8)
+        width, height = (stored_height, stored_width) if rotated else (stored_width, stored_height)
+        targets = narrower_widths(width, widths)
+        paths = {
+            size: os.path.join(media_root, derivative_name(directory, digest, size))
+            for size in [*targets, THUMBNAIL]
+        }
+        missing = {size for size, path in paths.items() if not os.path.exists(path)}
+
+        if missing:
+            # The widest rendition, or a thumbnail's short side
+            scale = max(max(targets, default=0) / width, thumbnail_size / min(width, height))
+        else:
+            scale = HASH_DECODE_SIZE / min(width, height)
+        if scale < 1:
+            original.draft('RGB', (math.ceil(stored_width * scale), math.ceil(stored_height * scale)))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            transparent = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+        if not missing:
+            return width, height, dhash(image)
+
+        thumbnail_source = image
+        for target in reversed(targets):
+            image = image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS, reducing_gap=3.0
+            )
+            if target in missing:
+                _save(image, paths[target], quality)
+            if min(image.size) >= thumbnail_size:
+                thumbnail_source = image
+        if THUMBNAIL in missing:
+            thumbnail = ImageOps.fit(thumbnail_source, (thumbnail_size, thumbnail_size), Image.LANCZOS)
+            _save(thumbnail, paths[THUMBNAIL], quality)
+    return width, height, dhash(image)
+
+def derive(job):
+    """
+    Worker entry point for one original: a local file (`path` and `digest`)
+    or a `url` to download. Returns {'digest', 'size', 'width', 'height',
+    'phash'}, or {'error': message} so one bad file never fails the batch.
+    """
+    options = job['options']
+    try:
+        if job.get('url'):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'original')
+                digest, size = download(
+                    job['url'], path, job['hosts'], job['max_bytes'], job['timeout']
+                )
+                width, height, phash = render(path, digest, **options)
+        else:
+            digest, size = job['digest'], os.path.getsize(job['path'])
+            width, height, phash = render(job['path'], digest, **options)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    return {'digest': digest, 'size': size, 'width': width, 'height': height, 'phash': phash}
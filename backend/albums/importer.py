@@ -0,0 +1,199 @@
+import csv
+import json
+import uuid
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import BooleanField
+from .cache import invalidate_album
+from .models import Album, AlbumPage, MediaItem, ImportCheckpoint
+from .search import album_entry, index_entries, media_entry, page_entry
+from .stats import apply_stats, total_stats
+
+# Legacy ids that are not UUIDs are mapped into this namespace, so a parent's
+# primary key is known from the record alone and a rerun maps ids identically
+IMPORT_NAMESPACE = uuid.UUID('6f1c1f8e-0d1e-4a55-9f0c-3c3f2a7f5d10')
+
+FIELDS = {
+    'album': (Album, [
+        'title', 'subtitle', 'description', 'cover_image_url', 'cover_image_key', 'is_public',
+    ]),
+    'page': (AlbumPage, ['title', 'page_number']),
+    'media': (MediaItem, [
+        'media_type', 'file_url', 'file_key', 'caption', 'duration', 'position',
+        'width', 'height', 'file_size',
+    ]),
+}
+
+class ImportRecordError(ValueError):
+    """A record that cannot be imported; carries its 1-based record number"""
+
+    def __init__(self, number, message):
+        super().__init__(f'record {number}: {message}')
+        self.number = number
+
+def import_uuid(kind, legacy_id):
+    if legacy_id in (None, ''):
+        return uuid.uuid4()
+    try:
+        return uuid.UUID(str(legacy_id))
+    except ValueError:
+        return uuid.uuid5(IMPORT_NAMESPACE, f'{kind}:{legacy_id}')
+
+def read_records(stream, input_format):
+    """Yield dicts from an NDJSON or CSV text stream, one record at a time"""
+    if input_format == 'csv':
+        for row in csv.DictReader(stream):
+            # Empty cells mean "use the model default"
+            yield {name: value for name, value in row.items() if value not in ('', None)}
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+class Batch:
+    """Model instances built from one batch of records, in dependency order"""
+
+    def __init__(self):
+        self.albums = []
+        self.pages = []
+        self.media = []
+        self.media_numbers = []
+        self.page_albums = {}
+
+    def __len__(self):
+        return len(self.albums) + len(self.pages) + len(self.media)
+
+class AlbumImporter:
+    """
+    Stream album, page and media records into the database with bulk_create.
+
+    Records carry a `type` of album, page or media, an optional `id` and a
+    parent reference (`album_id` for pages, `page_id` for media) holding the
+    parent's id from the same source; parents must come before their
+    children. Each batch is written in one transaction together with the
+    ImportCheckpoint for `source`, along with its album/page counters and
+    search entries, so an interrupted import resumes exactly where the last
+    commit left off.
+    """
+
+    def __init__(self, source, default_user, batch_size=5000, on_progress=None):
+        self.source = source
+        self.default_user = default_user
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self._users = {}
+        self._page_albums = {}
+
+    def checkpoint(self):
+        return ImportCheckpoint.objects.filter(source=self.source).values_list(
+            'records', flat=True
+        ).first() or 0
+
+    def reset(self):
+        ImportCheckpoint.objects.filter(source=self.source).delete()
+
+    def run(self, records):
+        """Import `records` after skipping the committed ones; returns records imported"""
+        done = self.checkpoint()
+        imported = 0
+        batch = Batch()
+        for number, record in enumerate(records, 1):
+            if number <= done:
+                continue
+            self._add(batch, number, record)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, number)
+                imported += len(batch)
+                batch = Batch()
+        if len(batch):
+            self._flush(batch, number)
+            imported += len(batch)
+        return imported
+
+    def _add(self, batch, number, record):
+        kind = record.get('type')
+        if kind not in FIELDS:
+            raise ImportRecordError(number, f'unknown type {kind!r}')
+        model, fields = FIELDS[kind]
+        values = {}
+        for name in fields:
+            if name in record:
+                field, value = model._meta.get_field(name), record[name]
+                if isinstance(field, BooleanField) and isinstance(value, str):
+                    value = value.strip().lower() in ('1', 'true', 't', 'yes')
+                try:
+                    values[name] = field.to_python(value)
+                except Exception as e:
+                    raise ImportRecordError(number, f'{name}: {e}')
+        pk = import_uuid(kind, record.get('id'))
+        if kind == 'album':
+            username = record.get('created_by_username')
+            batch.albums.append(Album(id=pk, created_by_id=self._user_id(username), **values))
+        elif kind == 'page':
+            if not record.get('album_id'):
+                raise ImportRecordError(number, 'page without album_id')
+            album_id = import_uuid('album', record['album_id'])
+            batch.pages.append(AlbumPage(id=pk, album_id=album_id, **values))
+            batch.page_albums[pk] = album_id
+        else:
+            if not record.get('page_id'):
+                raise ImportRecordError(number, 'media without page_id')
+            batch.media.append(MediaItem(id=pk, page_id=import_uuid('page', record['page_id']), **values))
+            batch.media_numbers.append(number)
+
+    def _user_id(self, username):
+        if not username:
+            return self.default_user.pk
+        if username not in self._users:
+            self._users[username] = User.objects.get_or_create(username=username)[0].pk
+        return self._users[username]
+
+    def _album_ids(self, batch):
+        """page -> album for every page the batch's media land on"""
+        page_albums = dict(batch.page_albums)
+        missing = {media.page_id for media in batch.media} - page_albums.keys() - self._page_albums.keys()
+        if missing:
+            self._page_albums.update(
+                AlbumPage.objects.filter(pk__in=missing).values_list('id', 'album_id')
+            )
+        for media, number in zip(batch.media, batch.media_numbers):
+            if media.page_id not in page_albums:
+                page_albums[media.page_id] = self._page_albums.get(media.page_id)
+                if page_albums[media.page_id] is None:
+                    raise ImportRecordError(number, f'unknown page {media.page_id}')
+        if len(self._page_albums) > 100000:
+            self._page_albums.clear()
+        return page_albums
+
+    def _flush(self, batch, number):
+        page_albums = self._album_ids(batch)
+        with transaction.atomic():
+            Album.objects.bulk_create(batch.albums, batch_size=500)
+            AlbumPage.objects.bulk_create(batch.pages, batch_size=500)
+            MediaItem.objects.bulk_create(batch.media, batch_size=500)
+
+            # Counters: one F() update per touched page and album
+            by_page = {}
+            for media in batch.media:
+                by_page.setdefault(media.page_id, []).append(media)
+            album_stats = {}
+            for page_id, items in by_page.items():
+                totals = total_stats(items)
+                apply_stats(page_id, None, totals)
+                merged = album_stats.setdefault(page_albums[page_id], [{}, 0])[0]
+                for name, value in totals.items():
+                    merged[name] = merged.get(name, 0) + value
+            for page in batch.pages:
+                album_stats.setdefault(page.album_id, [{}, 0])[1] += 1
+            for album_id, (totals, pages) in album_stats.items():
+                apply_stats(None, album_id, totals, pages=pages)
+                invalidate_album(album_id)
+
+            index_entries(
+                [album_entry(album) for album in batch.albums]
+                + [page_entry(page) for page in batch.pages]
+                + [media_entry(media, page_albums[media.page_id]) for media in batch.media if media.caption]
+            )
+            ImportCheckpoint.objects.update_or_create(source=self.source, defaults={'records': number})
+        if self.on_progress:
+            self.on_progress(number, len(batch))
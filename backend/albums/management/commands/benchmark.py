@@ -0,0 +1,65 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from albums import benchmark
+from albums.synthetic import generate
+from albums.management.commands.generate_albums import add_shape_arguments, shape_from_options
+
+class Command(BaseCommand):
+    help = (
+        'Drive every albums API endpoint through the test client against a '
+        'throwaway database filled with synthetic data, and write p50/p95/p99 '
+        'latency, queries per request and peak memory to a JSON report'
+    )
+
+    def add_arguments(self, parser):
+        add_shape_arguments(parser)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', help='Scenario names to run (default: all)')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--baseline', help='Compare against this earlier report')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth of latency and memory over the baseline')
+
+    def handle(self, *args, **options):
+        albums, pages, media = shape_from_options(options)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stderr.write(f'Generating {albums} albums x {pages} pages x {media} media...')
+            generate(albums, pages, media, options['seed'])
+            report = benchmark.run(
+                options['iterations'], options['warmup'], options['only'],
+                meta={'shape': [albums, pages, media], 'seed': options['seed']},
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        body = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+        for name, result in report['endpoints'].items():
+            self.stderr.write(
+                f"{name:32} {result['status']} p50 {result['p50_ms']:8.2f}ms "
+                f"p95 {result['p95_ms']:8.2f}ms q {result['queries']:3} "
+                f"mem {result['peak_kib']:9.1f}KiB"
+            )
+        if report['uncovered']:
+            self.stderr.write(f"Endpoints without a scenario: {', '.join(report['uncovered'])}")
+        if baseline is not None:
+            regressions = benchmark.compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+            self.stderr.write(self.style.SUCCESS('No regressions against baseline'))
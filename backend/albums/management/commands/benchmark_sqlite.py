@@ -0,0 +1,54 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from albums import concurrency
+from albums.synthetic import generate
+from albums.management.commands.generate_albums import add_shape_arguments, shape_from_options
+
+class Command(BaseCommand):
+    help = (
+        'Load a throwaway SQLite database from concurrent reader and writer '
+        'processes under the default and the production SQLite profile '
+        '(SQLITE_PRODUCTION), and production with SQLITE_WRITE_LOCK instead '
+        'of immediate transactions, and report requests per second for each'
+    )
+
+    def add_arguments(self, parser):
+        add_shape_arguments(parser)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--profiles', nargs='*', choices=list(concurrency.PROFILES),
+                            default=list(concurrency.PROFILES))
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        albums, pages, media = shape_from_options(options)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stderr.write(f'Generating {albums} albums x {pages} pages x {media} media...')
+            generate(albums, pages, media, options['seed'])
+            report = concurrency.run(
+                connection.settings_dict['NAME'], options['readers'], options['writers'],
+                options['seconds'], options['profiles'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        body = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+        for name, result in report.items():
+            for role in ('read', 'write'):
+                stats = result[role]
+                self.stderr.write(
+                    f"{name:12} {role:5} {stats['workers']:3} workers {stats['per_second']:9.1f}/s "
+                    f"p95 {stats['p95_ms'] or 0:8.2f}ms errors {stats['errors']}"
+                )
@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from albums import benchmark
+from albums.synthetic import generate
+from albums.management.commands.generate_albums import add_shape_arguments, shape_from_options
+
+class Command(BaseCommand):
+    help = (
+        'Measure bytes and CPU per album detail response in each wire format '
+        '(DRF JSON, orjson, MessagePack; with and without the items projection; '
+        'uncompressed, gzip and brotli) against a throwaway synthetic database'
+    )
+
+    def add_arguments(self, parser):
+        add_shape_arguments(parser)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        albums, pages, media = shape_from_options(options)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stderr.write(f'Generating {albums} albums x {pages} pages x {media} media...')
+            generate(albums, pages, media, options['seed'])
+            report = benchmark.wire_formats(options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report['meta'].update(shape=[albums, pages, media], seed=options['seed'])
+
+        body = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+        baseline = report['formats']['drf-json']
+        for name, result in report['formats'].items():
+            self.stderr.write(
+                f"{name:16} {result['bytes']:10} bytes ({result['bytes'] / baseline['bytes']:6.1%}) "
+                f"cpu {result['cpu_ms']:8.2f}ms ({result['cpu_ms'] / baseline['cpu_ms']:6.1%}): "
+                f"serialize {result['serialize_ms']:.2f} render {result['render_ms']:.2f} "
+                f"compress {result['compress_ms']:.2f}"
+            )
@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from albums import derivatives
+
+class Command(BaseCommand):
+    help = (
+        'Render thumbnails and responsive widths of pending images in a process '
+        'pool, and record their measured size, dimensions and content hash'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Rendering processes (default MEDIA_DERIVATIVE_WORKERS, else one per CPU)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Requeue every image first, e.g. after MEDIA_DERIVATIVE_WIDTHS changed')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Requeue images whose originals could not be read')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling instead of exiting once nothing is pending')
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help='Seconds to wait between polls when idle (with --loop)')
+
+    def handle(self, *args, **options):
+        if options['rebuild'] or options['retry_failed']:
+            statuses = ('ready', 'failed') if options['rebuild'] else ('failed',)
+            self.stdout.write(f'Requeued {derivatives.requeue(statuses)} images')
+        totals = {}
+        with derivatives.executor(options['workers']) as pool:
+            while True:
+                stats = derivatives.process_batch(pool, options['batch_size'])
+                for name, count in stats.items():
+                    totals[name] = totals.get(name, 0) + count
+                if stats['claimed'] > stats['skipped']:
+                    self.stdout.write(
+                        'ready {ready}, failed {failed}, skipped {skipped}, '
+                        'deduplicated {deduplicated}'.format(**stats)
+                    )
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            'Derivatives built: ready {ready}, failed {failed}, deduplicated {deduplicated}'.format(
+                **{name: totals.get(name, 0) for name in ('ready', 'failed', 'deduplicated')}
+            )
+        ))
@@ -0,0 +1,43 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from albums.synthetic import SHAPES, generate, generate_records
+
+def add_shape_arguments(parser):
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='small',
+                        help='Preset albums x pages x media shape')
+    parser.add_argument('--albums', type=int, help='Override the number of albums')
+    parser.add_argument('--pages', type=int, help='Override pages per album')
+    parser.add_argument('--media', type=int, help='Override media items per page')
+    parser.add_argument('--seed', type=int, default=0)
+
+def shape_from_options(options):
+    albums, pages, media = SHAPES[options['shape']]
+    shape = (
+        options['albums'] if options['albums'] is not None else albums,
+        options['pages'] if options['pages'] is not None else pages,
+        options['media'] if options['media'] is not None else media,
+    )
+    if min(shape) < 0 or shape[0] == 0:
+        raise CommandError('albums must be positive and pages/media non-negative')
+    return shape
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic data set into the database or an NDJSON file'
+
+    def add_arguments(self, parser):
+        add_shape_arguments(parser)
+        parser.add_argument('--output', help='Write import_albums NDJSON here instead of the database')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        albums, pages, media = shape_from_options(options)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                for record in generate_records(albums, pages, media, options['seed']):
+                    f.write(json.dumps(record) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+            return
+        total = generate(albums, pages, media, options['seed'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total} records ({albums} albums x {pages} pages x {media} media)'
+        ))
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from albums.importer import AlbumImporter, ImportRecordError, read_records
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import albums, pages and media from an NDJSON or CSV stream (the '
+        'NDJSON album export format), committing per batch and resuming from '
+        'the last committed batch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Input format (default: from the file extension, else ndjson)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Records written per transaction')
+        parser.add_argument('--user', default='anonymous',
+                            help='Owner of albums without created_by_username')
+        parser.add_argument('--source',
+                            help='Checkpoint name (default: the absolute input path)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any checkpoint and start from the first record')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        source = options['source'] or ('stdin' if path == '-' else os.path.abspath(path))
+        user, _ = User.objects.get_or_create(username=options['user'])
+
+        started = time.monotonic()
+        resumed_at = None
+
+        def on_progress(number, count):
+            elapsed = time.monotonic() - started
+            rate = (number - resumed_at) / elapsed if elapsed else 0
+            self.stderr.write(f'{number} records committed ({rate:,.0f} rows/s)')
+
+        importer = AlbumImporter(source, user, options['batch_size'], on_progress)
+        if options['restart']:
+            importer.reset()
+        resumed_at = importer.checkpoint()
+        if resumed_at:
+            self.stderr.write(f'Resuming {source} after record {resumed_at}')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            imported = importer.run(read_records(stream, input_format))
+        except (ImportRecordError, IntegrityError, ValueError) as e:
+            raise CommandError(
+                f'Import stopped: {e}. Committed batches are kept; rerun to resume '
+                f'after record {importer.checkpoint()}.'
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} records in {elapsed:.1f}s ({rate:,.0f} rows/s)'
+        ))
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from albums.outbox import process_batch
+from albums.services import get_uploadthing_service
+
+class Command(BaseCommand):
+    help = 'Delete queued UploadThing files from the FileDeletion outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-attempts', type=int, default=8,
+                            help='Dead-letter a key after this many failed attempts')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling instead of exiting once the outbox is drained')
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help='Seconds to wait between polls when idle (with --loop)')
+
+    def handle(self, *args, **options):
+        service = get_uploadthing_service()
+        totals = {}
+        while True:
+            stats = process_batch(service, options['batch_size'], options['max_attempts'])
+            for name, count in stats.items():
+                totals[name] = totals.get(name, 0) + count
+            if stats['claimed']:
+                self.stdout.write(
+                    'deleted {deleted}, skipped {skipped}, failed {failed}, dead {dead}'.format(**stats)
+                )
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            'Outbox drained: deleted {deleted}, skipped {skipped}, failed {failed}, dead {dead}'.format(
+                **{name: totals.get(name, 0) for name in ('deleted', 'skipped', 'failed', 'dead')}
+            )
+        ))
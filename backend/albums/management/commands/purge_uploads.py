@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from albums.storage import purge_uploads
+
+class Command(BaseCommand):
+    help = (
+        'Drop uploads untouched for --hours: unfinished part files are deleted and '
+        'finished files no media item uses are queued in the deletion outbox'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24.0)
+
+    def handle(self, *args, **options):
+        purged = purge_uploads(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} uploads'))
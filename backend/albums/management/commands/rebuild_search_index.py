@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from albums.search import rebuild
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from albums, pages and captions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} entries'))
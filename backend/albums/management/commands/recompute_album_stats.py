@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from albums.models import Album
+from albums.stats import recompute
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized page and media counters on albums and pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Albums recomputed per transaction')
+        parser.add_argument('album_ids', nargs='*', help='Only these albums (default: all)')
+
+    def handle(self, *args, **options):
+        queryset = Album.objects.order_by('pk')
+        if options['album_ids']:
+            queryset = queryset.filter(pk__in=options['album_ids'])
+        album_ids = list(queryset.values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        total = 0
+        for start in range(0, len(album_ids), batch_size):
+            with transaction.atomic():
+                total += recompute(album_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {total} albums'))
@@ -0,0 +1,55 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from albums.outbox import enqueue_file_deletions
+from albums.reconcile import reconcile
+from albums.services import get_uploadthing_service
+
+class Command(BaseCommand):
+    help = (
+        'Compare UploadThing storage with MediaItem/Album file keys and write an '
+        'NDJSON diff report; --purge queues orphaned remote files for deletion'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the NDJSON report here instead of stdout')
+        parser.add_argument('--page-size', type=int, default=500,
+                            help='Files requested per listFiles call')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Database rows read per iterator chunk')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Ignore remote files uploaded less than this many seconds ago')
+        parser.add_argument('--purge', action='store_true',
+                            help='Queue orphaned remote files in the deletion outbox')
+
+    def handle(self, *args, **options):
+        report = open(options['output'], 'w') if options['output'] else self.stdout
+        purge = options['purge']
+
+        def on_orphan(keys):
+            for key in keys:
+                report.write(json.dumps({'type': 'orphaned_remote', 'key': key}) + '\n')
+            if purge:
+                with transaction.atomic():
+                    enqueue_file_deletions(keys)
+
+        def on_missing(kind, rows):
+            for pk, key in rows:
+                report.write(json.dumps(
+                    {'type': 'missing_remote', 'source': kind, 'id': str(pk), 'key': key}
+                ) + '\n')
+
+        try:
+            stats = reconcile(
+                get_uploadthing_service(), on_orphan, on_missing,
+                page_size=options['page_size'], chunk_size=options['chunk_size'],
+                min_age=options['min_age'],
+            )
+        finally:
+            if report is not self.stdout:
+                report.close()
+
+        summary = ', '.join(f'{name} {count}' for name, count in stats.items())
+        self.stderr.write(self.style.SUCCESS(f'Reconciled: {summary}'))
+        if purge and stats['orphaned']:
+            self.stderr.write(f"Queued {stats['orphaned']} orphaned files; run process_file_deletions")
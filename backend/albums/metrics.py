@@ -0,0 +1,347 @@
+import heapq
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from .cache import get_shared_album_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    """Cumulative-on-export bucket counts plus sum, Prometheus style"""
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+class RouteStats:
+    __slots__ = ('latency', 'queries', 'query_seconds', 'response_bytes', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+class MetricsRegistry:
+    """
+    In-process aggregation per (route, method). Recording is a dict lookup and
+    a few additions under one lock; nothing is allocated per request beyond
+    the first sighting of a route. Each worker process keeps its own registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, method, status, seconds, queries, query_seconds, response_bytes):
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = RouteStats()
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.query_seconds += query_seconds
+            stats.response_bytes += response_bytes
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """Deep enough copy to render without holding the lock"""
+        with self._lock:
+            copies = {}
+            for key, stats in self._routes.items():
+                copy = RouteStats()
+                copy.latency.counts, copy.latency.sum = list(stats.latency.counts), stats.latency.sum
+                copy.queries.counts, copy.queries.sum = list(stats.queries.counts), stats.queries.sum
+                copy.query_seconds = stats.query_seconds
+                copy.response_bytes = stats.response_bytes
+                copy.statuses = dict(stats.statuses)
+                copies[key] = copy
+            return copies
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        """The registry in the Prometheus text exposition format"""
+        routes = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def labels(route, method, **extra):
+            pairs = [('route', route), ('method', method), *extra.items()]
+            return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+        family('album_http_requests_total', 'counter', 'Requests by route, method and status.')
+        for (route, method), stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'album_http_requests_total{{{labels(route, method, status=status)}}} {count}')
+
+        for name, attribute, help_text in [
+            ('album_http_request_duration_seconds', 'latency', 'Time spent handling the request.'),
+            ('album_db_queries_per_request', 'queries', 'SQL queries executed per request.'),
+        ]:
+            family(name, 'histogram', help_text)
+            for (route, method), stats in routes:
+                histogram = getattr(stats, attribute)
+                for bound, total in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{{labels(route, method, le=bound)}}} {total}')
+                lines.append(f'{name}_sum{{{labels(route, method)}}} {histogram.sum:g}')
+                lines.append(f'{name}_count{{{labels(route, method)}}} {sum(histogram.counts)}')
+
+        family('album_db_query_seconds_total', 'counter', 'Time spent in SQL queries.')
+        for (route, method), stats in routes:
+            lines.append(f'album_db_query_seconds_total{{{labels(route, method)}}} {stats.query_seconds:g}')
+        family('album_http_response_bytes_total', 'counter', 'Response body bytes sent.')
+        for (route, method), stats in routes:
+            lines.append(f'album_http_response_bytes_total{{{labels(route, method)}}} {stats.response_bytes}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+registry = MetricsRegistry()
+
+class RequestStats:
+    """Per-request query tally filled in by the connection execute wrapper"""
+    __slots__ = ('queries', 'query_seconds', 'slowest', 'keep')
+
+    def __init__(self, keep):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slowest = []
+        self.keep = keep
+
+_current = ContextVar('album_request_stats', default=None)
+
+def record_query(execute, sql, params, many, context):
+    """Connection execute wrapper; a pass-through outside instrumented requests"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.query_seconds += elapsed
+        if stats.keep:
+            # Bounded min-heap of the slowest statements
+            entry = (elapsed, stats.queries, sql)
+            if len(stats.slowest) < stats.keep:
+                heapq.heappush(stats.slowest, entry)
+            elif elapsed > stats.slowest[0][0]:
+                heapq.heapreplace(stats.slowest, entry)
+
+def install_query_wrapper(sender=None, connection=None, **kwargs):
+    """connection_created receiver: wrap every database connection once"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def route_name(request):
+    """viewset.action for DRF routes, the URL name or pattern otherwise"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    cls = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    if cls is not None:
+        action = (getattr(view, 'actions', None) or {}).get(request.method.lower())
+        return f'{cls.__name__}.{action}' if action else cls.__name__
+    return match.view_name or match.route
+
+class CountedStream:
+    """
+    A streamed body that counts the bytes it yields and attributes queries
+    made while producing them to the request. Its close(), which the
+    response calls when the server closes it, records the request once.
+    """
+
+    def __init__(self, chunks, stats, done):
+        self.chunks = iter(chunks)
+        self.stats = stats
+        self.done = done
+        self.sent = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Only attribute queries while producing a chunk, never while the
+        # server holds the context between chunks
+        token = _current.set(self.stats)
+        try:
+            chunk = next(self.chunks)
+        finally:
+            _current.reset(token)
+        self.sent += len(chunk)
+        return chunk
+
+    def close(self):
+        if self.done is not None:
+            done, self.done = self.done, None
+            done(self.sent)
+
+class AsyncCountedStream:
+    """CountedStream for async streaming responses"""
+
+    def __init__(self, chunks, stats, done):
+        self.chunks = aiter(chunks)
+        self.stats = stats
+        self.done = done
+        self.sent = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        token = _current.set(self.stats)
+        try:
+            chunk = await anext(self.chunks)
+        finally:
+            _current.reset(token)
+        self.sent += len(chunk)
+        return chunk
+
+    close = CountedStream.close
+
+class MetricsMiddleware:
+    """
+    Time every request and tally its SQL queries and response size per route.
+    Put it right after CorsMiddleware so the whole stack is measured. Streamed
+    responses are recorded when they close, so queries made while streaming
+    and time to the last byte are included; files, whose bodies are left to
+    the server, as they are returned. With METRICS_SLOW_REQUEST_SECONDS
+    set, slower requests log their METRICS_SLOW_QUERY_COUNT slowest queries.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        stats, start = self.begin()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        stats, start = self.begin()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    @staticmethod
+    def begin():
+        slow_after = settings.METRICS_SLOW_REQUEST_SECONDS
+        stats = RequestStats(settings.METRICS_SLOW_QUERY_COUNT if slow_after is not None else 0)
+        return stats, time.perf_counter()
+
+    def finish(self, request, response, stats, start):
+        route = route_name(request)
+
+        def done(size):
+            self.record(request, route, response, stats, start, size)
+
+        if not response.streaming:
+            done(len(response.content))
+        elif response.has_header('Content-Length'):
+            # Files: leave the body alone so the server can still sendfile()
+            # it, and record them as they are handed over
+            done(int(response['Content-Length']))
+        else:
+            # The response closes its streaming_content when it is closed
+            counted = AsyncCountedStream if response.is_async else CountedStream
+            response.streaming_content = counted(response.streaming_content, stats, done)
+        return response
+
+    def record(self, request, route, response, stats, start, size):
+        elapsed = time.perf_counter() - start
+        registry.observe(
+            route, request.method, response.status_code, elapsed,
+            stats.queries, stats.query_seconds, size
+        )
+        slow_after = settings.METRICS_SLOW_REQUEST_SECONDS
+        if slow_after is not None and elapsed >= slow_after:
+            slowest = sorted(stats.slowest, reverse=True)
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d queries in %.3fs%s',
+                request.method, request.path, route, elapsed, stats.queries, stats.query_seconds,
+                ''.join(f'\n  {seconds * 1000:.1f}ms {sql}' for seconds, _, sql in slowest),
+            )
+
+def render_shared_album_cache():
+    """This worker's shared album cache counters in the Prometheus text format"""
+    stats = get_shared_album_cache().stats()
+    lines = []
+    for name, key, kind, help_text in [
+        ('album_shared_cache_hits_total', 'hits', 'counter', 'Shared album bodies served from the cache.'),
+        ('album_shared_cache_misses_total', 'misses', 'counter', 'Shared album bodies rendered afresh.'),
+        ('album_shared_cache_evictions_total', 'evictions', 'counter', 'Entries evicted to stay in size.'),
+        ('album_shared_cache_bytes', 'size', 'gauge', 'Approximate size of the cached entries.'),
+    ]:
+        if key in stats:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {stats[key]}']
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, requiring the METRICS_TOKEN bearer token.
+    Without a token it is only open with DEBUG on.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            raise PermissionDenied
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        raise PermissionDenied
+    return HttpResponse(registry.render() + render_shared_album_cache(), content_type=CONTENT_TYPE)
+
+@receiver(setting_changed)
+def _reset_metrics(setting, **kwargs):
+    if setting.startswith('METRICS_'):
+        registry.reset()
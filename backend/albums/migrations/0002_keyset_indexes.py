@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['-created_at', '-id'], name='album_created_keyset'),
+        ),
+        migrations.AddIndex(
+            model_name='albumpage',
+            index=models.Index(fields=['page_number', 'id'], name='page_number_keyset'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['position', 'created_at', 'id'], name='media_position_keyset'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['page', 'position', 'created_at', 'id'], name='media_page_position_keyset'),
+        ),
+    ]
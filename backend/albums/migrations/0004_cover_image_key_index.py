@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0003_file_deletion_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='cover_image_key',
+            field=models.CharField(blank=True, db_index=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE albums_searchentry_fts USING fts5(
+        title, body,
+        content='albums_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER albums_searchentry_ai AFTER INSERT ON albums_searchentry BEGIN
+        INSERT INTO albums_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER albums_searchentry_ad AFTER DELETE ON albums_searchentry BEGIN
+        INSERT INTO albums_searchentry_fts(albums_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER albums_searchentry_au AFTER UPDATE ON albums_searchentry BEGIN
+        INSERT INTO albums_searchentry_fts(albums_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO albums_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS albums_searchentry_au',
+    'DROP TRIGGER IF EXISTS albums_searchentry_ad',
+    'DROP TRIGGER IF EXISTS albums_searchentry_ai',
+    'DROP TABLE IF EXISTS albums_searchentry_fts',
+]
+
+POSTGRES_FORWARD = [
+    'ALTER TABLE albums_searchentry ADD COLUMN search_vector tsvector',
+    """
+    CREATE FUNCTION albums_searchentry_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.body, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER albums_searchentry_vector BEFORE INSERT OR UPDATE ON albums_searchentry
+    FOR EACH ROW EXECUTE FUNCTION albums_searchentry_vector()
+    """,
+    'CREATE INDEX albums_searchentry_vector_gin ON albums_searchentry USING GIN (search_vector)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TRIGGER IF EXISTS albums_searchentry_vector ON albums_searchentry',
+    'DROP FUNCTION IF EXISTS albums_searchentry_vector()',
+    'DROP INDEX IF EXISTS albums_searchentry_vector_gin',
+    'ALTER TABLE albums_searchentry DROP COLUMN IF EXISTS search_vector',
+]
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0004_cover_image_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('album', 'Album'), ('page', 'Page'), ('media', 'Media')], max_length=10)),
+                ('object_id', models.UUIDField(unique=True)),
+                ('title', models.CharField(blank=True, max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='albums.album')),
+                ('media', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='albums.mediaitem')),
+                ('page', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='albums.albumpage')),
+            ],
+        ),
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:49
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill(apps, schema_editor):
+    # Historical models, so this mirrors albums.stats.recompute without the
+    # app code; later drift is repaired with the recompute_album_stats command
+    Album = apps.get_model('albums', 'Album')
+    AlbumPage = apps.get_model('albums', 'AlbumPage')
+    MediaItem = apps.get_model('albums', 'MediaItem')
+    fields = ['image_count', 'video_count', 'total_file_size', 'video_seconds']
+    pages = {}
+    for page in AlbumPage.objects.only('id', 'album_id').iterator():
+        page.image_count = page.video_count = page.total_file_size = page.video_seconds = 0
+        pages[page.pk] = page
+    rows = MediaItem.objects.order_by().values('page_id').annotate(
+        images=Count('id', filter=Q(media_type='image')),
+        videos=Count('id', filter=Q(media_type='video')),
+        size=Sum('file_size'),
+    )
+    for row in rows.iterator():
+        page = pages[row['page_id']]
+        page.image_count, page.video_count, page.total_file_size = row['images'], row['videos'], row['size'] or 0
+    videos = MediaItem.objects.filter(media_type='video').exclude(duration='')
+    for page_id, duration in videos.values_list('page_id', 'duration').iterator():
+        parts = duration.split(':')
+        if all(part.strip().isdigit() for part in parts):
+            seconds = 0
+            for part in parts:
+                seconds = seconds * 60 + int(part)
+            pages[page_id].video_seconds += seconds
+    AlbumPage.objects.bulk_update(pages.values(), fields, batch_size=500)
+
+    albums = {}
+    for page in pages.values():
+        totals = albums.setdefault(page.album_id, dict.fromkeys(fields + ['page_count'], 0))
+        for name in fields:
+            totals[name] += getattr(page, name)
+        totals['page_count'] += 1
+    for album_id, totals in albums.items():
+        Album.objects.filter(pk=album_id).update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='image_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='page_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='total_file_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='video_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='video_seconds',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='albumpage',
+            name='image_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='albumpage',
+            name='total_file_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='albumpage',
+            name='video_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='albumpage',
+            name='video_seconds',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
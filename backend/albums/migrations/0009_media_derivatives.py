@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0008_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='derivative_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(condition=models.Q(('derivative_status', 'pending'), ('media_type', 'image')), fields=['created_at'], name='media_derivatives_pending'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:30
+
+from django.db import migrations, models
+
+
+def requeue_measured_images(apps, schema_editor):
+    # Send measured images through the pipeline once more for their
+    # perceptual hash; their renditions are on disk, so only a decode is redone
+    MediaItem = apps.get_model('albums', 'MediaItem')
+    MediaItem.objects.filter(media_type='image', derivative_status='ready').update(
+        derivative_status='pending'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0009_media_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='phash_band0',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='phash_band1',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='phash_band2',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='phash_band3',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediaitem',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(condition=models.Q(('phash_band0__isnull', False)), fields=['phash_band0'], name='media_phash_band0'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(condition=models.Q(('phash_band1__isnull', False)), fields=['phash_band1'], name='media_phash_band1'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(condition=models.Q(('phash_band2__isnull', False)), fields=['phash_band2'], name='media_phash_band2'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(condition=models.Q(('phash_band3__isnull', False)), fields=['phash_band3'], name='media_phash_band3'),
+        ),
+        migrations.RunPython(requeue_measured_images, migrations.RunPython.noop),
+    ]
@@ -1,26 +1,114 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
-class Album(models.Model):
+def duration_seconds(value):
+    """Parse a "m:ss" or "h:mm:ss" duration into seconds; 0 when blank or malformed"""
+    seconds = 0
+    for part in (value or '').split(':'):
+        if not part.strip().isdigit():
+            return 0
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+# Perceptual hashes are also stored as 16-bit bands for multi-index hashing
+# (albums.duplicates): hashes within distance d share a band within d // 4
+PHASH_BAND_BITS = 16
+PHASH_BANDS = 64 // PHASH_BAND_BITS
+PHASH_BAND_FIELDS = [f'phash_band{band}' for band in range(PHASH_BANDS)]
+
+def phash_bands(phash):
+    """The bands of a perceptual hash, lowest bits first"""
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(phash >> (band * PHASH_BAND_BITS)) & mask for band in range(PHASH_BANDS)]
+
+class AlbumQuerySet(models.QuerySet):
+    def with_counts(self):
+        """Annotate media_count from the denormalized per-type counters"""
+        return self.annotate(media_count=models.F('image_count') + models.F('video_count'))
+
+    def with_owner(self):
+        """Join the creating user so created_by_username costs no extra query"""
+        return self.select_related('created_by')
+
+    def with_tree(self, media=True):
+        """Prefetch pages (and, unless media=False, their media) in display order"""
+        pages = AlbumPage.objects.with_media() if media else AlbumPage.objects.order_by('page_number')
+        return self.with_owner().prefetch_related(models.Prefetch('pages', queryset=pages))
+
+    def with_skeleton(self):
+        """Prefetch page skeletons (see AlbumPageQuerySet.skeletons) in display order"""
+        return self.with_owner().prefetch_related(
+            models.Prefetch('pages', queryset=AlbumPage.objects.skeletons())
+        )
+
+class AlbumPageQuerySet(models.QuerySet):
+    def with_media(self):
+        """Prefetch media items in their display order"""
+        return self.order_by('page_number').prefetch_related(
+            models.Prefetch(
+                'media_items',
+                queryset=MediaItem.objects.order_by('position', 'created_at')
+            )
+        )
+
+    def skeletons(self):
+        """Pages without their media, with media_count from the denormalized counters"""
+        return self.order_by('page_number').only('id', 'album_id', 'title', 'page_number').annotate(
+            media_count=models.F('image_count') + models.F('video_count')
+        )
+
+class MediaStats(models.Model):
+    """
+    Denormalized media totals. They only move through F() updates in
+    albums.stats, so a regular save() never writes back a stale copy.
+    """
+    image_count = models.IntegerField(default=0, editable=False)
+    video_count = models.IntegerField(default=0, editable=False)
+    total_file_size = models.BigIntegerField(default=0, editable=False)
+    video_seconds = models.IntegerField(default=0, editable=False)
+    
+    STATS_FIELDS = ['image_count', 'video_count', 'total_file_size', 'video_seconds']
+    
+    class Meta:
+        abstract = True
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STATS_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+class Album(MediaStats):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=200)
     subtitle = models.CharField(max_length=200, blank=True)
     description = models.TextField(blank=True)
     cover_image_url = models.URLField(blank=True, null=True)
-    cover_image_key = models.CharField(max_length=500, blank=True)  # UploadThing file key
+    cover_image_key = models.CharField(max_length=500, blank=True, db_index=True)  # UploadThing file key
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='albums')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
+    page_count = models.IntegerField(default=0, editable=False)
+    
+    STATS_FIELDS = MediaStats.STATS_FIELDS + ['page_count']
+    
+    objects = AlbumQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='album_created_keyset'),
+        ]
     
     def __str__(self):
         return self.title
 
-class AlbumPage(models.Model):
+class AlbumPage(MediaStats):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='pages')
     title = models.CharField(max_length=200)
@@ -28,9 +116,14 @@ class AlbumPage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AlbumPageQuerySet.as_manager()
+    
     class Meta:
         ordering = ['page_number']
         unique_together = ['album', 'page_number']
+        indexes = [
+            models.Index(fields=['page_number', 'id'], name='page_number_keyset'),
+        ]
     
     def __str__(self):
         return f"{self.album.title} - Page {self.page_number}: {self.title}"
@@ -40,23 +133,55 @@ class MediaItem(models.Model):
         ('image', 'Image'),
         ('video', 'Video'),
     ]
+    DERIVATIVE_STATUSES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     page = models.ForeignKey(AlbumPage, on_delete=models.CASCADE, related_name='media_items')
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
     file_url = models.URLField()
-    file_key = models.CharField(max_length=500)  # UploadThing file key
+    file_key = models.CharField(max_length=500, db_index=True)  # UploadThing file key
     caption = models.TextField(blank=True)
     duration = models.CharField(max_length=10, blank=True)  # For videos (e.g., "3:45")
     position = models.PositiveIntegerField(default=0)  # Position within the page
+    # Images are measured by albums.derivatives; client values stand in until then
     width = models.PositiveIntegerField(null=True, blank=True)
     height = models.PositiveIntegerField(null=True, blank=True)
     file_size = models.PositiveIntegerField(null=True, blank=True)  # In bytes
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the file
+    # 64-bit difference hash of an image, stored signed, and its bands
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    phash_band0 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_band1 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_band2 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_band3 = models.IntegerField(null=True, blank=True, editable=False)
+    derivative_status = models.CharField(
+        max_length=10, choices=DERIVATIVE_STATUSES, default='pending', editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['position', 'created_at']
+        indexes = [
+            models.Index(fields=['position', 'created_at', 'id'], name='media_position_keyset'),
+            models.Index(fields=['page', 'position', 'created_at', 'id'], name='media_page_position_keyset'),
+            # Only the derivative pipeline's backlog, so it stays small
+            models.Index(
+                fields=['created_at'], name='media_derivatives_pending',
+                condition=models.Q(media_type='image', derivative_status='pending'),
+            ),
+            *[
+                models.Index(
+                    fields=[name], name=f'media_{name}',
+                    condition=models.Q(**{f'{name}__isnull': False}),
+                )
+                for name in PHASH_BAND_FIELDS
+            ],
+        ]
     
     def __str__(self):
         return f"{self.page.title} - {self.media_type}: {self.caption[:50]}"
@@ -71,3 +196,84 @@ class AlbumShare(models.Model):
     
     def __str__(self):
         return f"Share: {self.album.title}"
+
+class FileDeletion(models.Model):
+    """
+    Outbox of remote files to delete. Rows are written in the same transaction
+    that removes the last database reference and are drained by the
+    process_file_deletions management command.
+    """
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('dead', 'Dead'),
+    ]
+    
+    file_key = models.CharField(max_length=500)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='file_deletion_due'),
+        ]
+    
+    def __str__(self):
+        return f"Delete {self.file_key} ({self.status})"
+
+class SearchEntry(models.Model):
+    """
+    One row per searchable album, page or media caption. The text columns are
+    mirrored into a full-text index by database triggers (an FTS5 table on
+    SQLite, a tsvector column on PostgreSQL); see albums.search.
+    """
+    KINDS = [
+        ('album', 'Album'),
+        ('page', 'Page'),
+        ('media', 'Media'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.UUIDField(unique=True)
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='+')
+    page = models.ForeignKey(AlbumPage, on_delete=models.CASCADE, null=True, related_name='+')
+    media = models.ForeignKey(MediaItem, on_delete=models.CASCADE, null=True, related_name='+')
+    title = models.CharField(max_length=200, blank=True)
+    body = models.TextField(blank=True)
+    
+    def __str__(self):
+        return f"{self.kind}: {self.title or self.body[:50]}"
+
+class ImportCheckpoint(models.Model):
+    """
+    How many records of an import source are committed. Advanced in the same
+    transaction as each import_albums batch, so a resumed run never skips or
+    repeats rows.
+    """
+    source = models.CharField(max_length=500, unique=True)
+    records = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.source}: {self.records} records"
+
+class Upload(models.Model):
+    """
+    A resumable upload into local media storage (see albums.storage). Chunks
+    are appended to a part file at `received`; once all `size` bytes are in,
+    the file moves to its content-addressed name, which becomes `file_key`.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    file_key = models.CharField(max_length=500, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes)"
@@ -0,0 +1,104 @@
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .models import Album, MediaItem, FileDeletion, Upload
+from .services import UploadThingError
+from .storage import delete_local_files, is_content_key, is_local_key
+
+# Claimed rows are hidden from other workers for this long; if a worker dies
+# mid-batch they become due again once the lease runs out
+LEASE = timedelta(minutes=5)
+RETRY_BASE = timedelta(seconds=30)
+RETRY_CAP = timedelta(hours=6)
+
+def enqueue_file_deletions(file_keys):
+    """Queue remote deletions for the given keys inside the caller's transaction"""
+    keys = sorted({key for key in file_keys if key})
+    if keys:
+        FileDeletion.objects.bulk_create([FileDeletion(file_key=key) for key in keys])
+
+def referenced_keys(file_keys):
+    """
+    Keys that are still used by a media item, album cover or unpurged upload.
+    Local keys not spelled as content_name() does count as used: another
+    spelling of the same file could be, and such files are never deleted.
+    """
+    keys = list(file_keys)
+    return (
+        {key for key in keys if is_local_key(key) and not is_content_key(key)}
+        | set(MediaItem.objects.filter(file_key__in=keys).values_list('file_key', flat=True))
+        | set(Album.objects.filter(cover_image_key__in=keys).values_list('cover_image_key', flat=True))
+        | set(Upload.objects.filter(file_key__in=keys).values_list('file_key', flat=True))
+    )
+
+def retry_delay(attempts):
+    return min(RETRY_BASE * (2 ** (attempts - 1)), RETRY_CAP)
+
+def claim_batch(batch_size):
+    """Lease up to batch_size due rows to this worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            FileDeletion.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        FileDeletion.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=now + LEASE
+        )
+    return rows
+
+def process_batch(service, batch_size=500, max_attempts=8):
+    """
+    Drain one batch of due deletions. Keys that regained a reference are
+    dropped without a remote call; remote failures are retried with
+    exponential backoff and dead-lettered after max_attempts.
+    Returns a dict of counts.
+    """
+    rows = claim_batch(batch_size)
+    stats = {'claimed': len(rows), 'deleted': 0, 'skipped': 0, 'failed': 0, 'dead': 0}
+    if not rows:
+        return stats
+
+    by_key = {}
+    for row in rows:
+        by_key.setdefault(row.file_key, []).append(row)
+
+    still_used = referenced_keys(by_key)
+    if still_used:
+        FileDeletion.objects.filter(file_key__in=still_used, pk__in=[r.pk for r in rows]).delete()
+        stats['skipped'] = sum(len(by_key.pop(key)) for key in still_used)
+
+    # Self-hosted files are removed from disk, the rest through UploadThing
+    local = [key for key in by_key if is_local_key(key)]
+    if local:
+        delete_local_files(local)
+        local_rows = [row for key in local for row in by_key.pop(key)]
+        FileDeletion.objects.filter(pk__in=[row.pk for row in local_rows]).delete()
+        stats['deleted'] += len(local_rows)
+
+    keys = list(by_key)
+    for start in range(0, len(keys), service.delete_batch_size):
+        chunk = keys[start:start + service.delete_batch_size]
+        chunk_rows = [row for key in chunk for row in by_key[key]]
+        try:
+            service.delete_files(chunk)
+        except UploadThingError as e:
+            _record_failure(chunk_rows, str(e), max_attempts, stats)
+        else:
+            FileDeletion.objects.filter(pk__in=[row.pk for row in chunk_rows]).delete()
+            stats['deleted'] += len(chunk_rows)
+    return stats
+
+def _record_failure(rows, error, max_attempts, stats):
+    now = timezone.now()
+    for row in rows:
+        row.attempts += 1
+        row.last_error = error[:2000]
+        if row.attempts >= max_attempts:
+            row.status = 'dead'
+            stats['dead'] += 1
+        else:
+            row.next_attempt_at = now + retry_delay(row.attempts)
+            stats['failed'] += 1
+    FileDeletion.objects.bulk_update(rows, ['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,233 @@
+import datetime
+import json
+import uuid
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Max, Min, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+def _nullable_fields(model, ordering):
+    """Names in `ordering` that may hold NULL; annotations count as nullable"""
+    nullable = set()
+    for field in ordering:
+        name = field.lstrip('-')
+        try:
+            if model._meta.get_field(name).null:
+                nullable.add(name)
+        except FieldDoesNotExist:
+            nullable.add(name)
+    return nullable
+
+def _order_by(ordering, nullable):
+    """order_by() arguments sorting NULL below every value, in either direction"""
+    expressions = []
+    for field in ordering:
+        name = field.lstrip('-')
+        if name not in nullable:
+            expressions.append(field)
+        elif field.startswith('-'):
+            expressions.append(F(name).desc(nulls_last=True))
+        else:
+            expressions.append(F(name).asc(nulls_first=True))
+    return expressions
+
+def _equal(name, value):
+    return Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+def _after(field, value, nullable):
+    """Rows whose `field` sorts strictly after `value`, NULL being the lowest value"""
+    name = field.lstrip('-')
+    descending = field.startswith('-')
+    if value is None:
+        # Everything that is set lies above NULL; nothing lies below it
+        return Q(pk__in=[]) if descending else Q(**{f'{name}__isnull': False})
+    condition = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+    if descending and name in nullable:
+        condition |= Q(**{f'{name}__isnull': True})
+    return condition
+
+def _seek_filter(ordering, position, nullable=()):
+    """
+    Build the lexicographic "row comes after position" condition for an
+    ordering, e.g. for ('-created_at', '-id'):
+    created_at < a OR (created_at = a AND id < b)
+    Fields in `nullable` sort NULL lowest, matching _order_by().
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        step = _after(field, position[index], nullable)
+        for previous, value in zip(ordering[:index], position):
+            step &= _equal(previous.lstrip('-'), value)
+        condition |= step
+    return condition
+
+def _invert(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full ordering tuple rather than on the
+    first field plus an offset, so every page is a bounded index range scan no
+    matter how deep the client has scrolled. `ordering` must end in a unique
+    column and should be backed by a composite index. Views list the local
+    columns ?ordering= may name in `ordering_fields`: cursors store their
+    values, which related paths do not have.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @classmethod
+    def is_requested(cls, request):
+        """Whether the client asked for a paginated response on an opt-in action"""
+        params = request.query_params
+        return cls.cursor_query_param in params or cls.page_size_query_param in params
+
+    def get_ordering(self, request, queryset, view):
+        # Honour an explicit ?ordering= from the view's OrderingFilter, keeping
+        # the default key behind it as a tie breaker
+        ordering = ()
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view) or ()
+                break
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        names = {field.lstrip('-') for field in ordering}
+        return tuple(ordering) + tuple(
+            field for field in self.ordering if field.lstrip('-') not in names
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = None
+        if self.cursor and self.cursor.position:
+            try:
+                position = json.loads(self.cursor.position)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        ordering = [_invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        nullable = _nullable_fields(queryset.model, ordering)
+        queryset = queryset.order_by(*_order_by(ordering, nullable))
+        if position is not None:
+            if not isinstance(position, list) or len(position) != len(ordering):
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(_seek_filter(ordering, position, nullable))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def _position(self, instance):
+        values = [_encode_value(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+        return json.dumps(values)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=False, position=self._position(self.page[-1]))
+        return self.encode_cursor(cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=True, position=self._position(self.page[0]))
+        return self.encode_cursor(cursor)
+
+class AlbumCursorPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+class AlbumPageCursorPagination(KeysetPagination):
+    ordering = ('page_number', 'id')
+
+class MediaItemCursorPagination(KeysetPagination):
+    ordering = ('position', 'created_at', 'id')
+
+class PageNumberWindow:
+    """
+    The pages of one album numbered ?from= to ?to= (inclusive), for readers
+    that lay an album out from its skeleton and load pages as they approach
+    them. Unlike a cursor, any window can be asked for directly; the
+    neighbouring windows are linked (also in a Link header) so they can be
+    fetched ahead. ?to= defaults to ALBUM_PAGE_WINDOW_SIZE pages on.
+    """
+    from_query_param = 'from'
+    to_query_param = 'to'
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return cls.from_query_param in params or cls.to_query_param in params
+
+    def __init__(self, request):
+        self.request = request
+        params = request.query_params
+        try:
+            self.first = int(params.get(self.from_query_param, 1))
+            self.last = int(params.get(self.to_query_param, self.first + settings.ALBUM_PAGE_WINDOW_SIZE - 1))
+        except ValueError:
+            raise ValidationError({'from': 'Expected integer page numbers'})
+        if not 0 <= self.first <= self.last:
+            raise ValidationError({'from': 'Expected 0 <= from <= to'})
+        if self.last - self.first >= settings.ALBUM_PAGE_WINDOW_MAX_SIZE:
+            raise ValidationError({'to': f'At most {settings.ALBUM_PAGE_WINDOW_MAX_SIZE} pages per window'})
+        self.size = self.last - self.first + 1
+
+    def paginate_queryset(self, queryset):
+        """The pages of `queryset` (one album's, in page order) inside the window"""
+        self.bounds = queryset.order_by().aggregate(first=Min('page_number'), last=Max('page_number'))
+        return list(queryset.filter(page_number__range=(self.first, self.last)))
+
+    def _link(self, first, last):
+        url = replace_query_param(self.request.build_absolute_uri(), self.from_query_param, first)
+        return replace_query_param(url, self.to_query_param, last)
+
+    def get_next_link(self):
+        if self.bounds['last'] is None or self.bounds['last'] <= self.last:
+            return None
+        return self._link(self.last + 1, self.last + self.size)
+
+    def get_previous_link(self):
+        if self.bounds['first'] is None or self.bounds['first'] >= self.first:
+            return None
+        return self._link(max(0, self.first - self.size), self.first - 1)
+
+    def get_paginated_response(self, data):
+        links = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        response = Response({
+            'from': self.first,
+            'to': self.last,
+            'first_page_number': self.bounds['first'],
+            'last_page_number': self.bounds['last'],
+            **links,
+            'results': data,
+        })
+        relations = {'next': 'next', 'previous': 'prev'}
+        header = ', '.join(f'<{url}>; rel="{relations[name]}"' for name, url in links.items() if url)
+        if header:
+            response['Link'] = header
+        return response
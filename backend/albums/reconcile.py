@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import tempfile
+import time
+from .models import Album, MediaItem
+from .outbox import referenced_keys
+from .storage import LOCAL_KEY_PREFIX
+
+class RemoteKeyIndex:
+    """
+    Disk-backed set of remote file keys, so the listing of millions of files
+    can be probed from the database side without holding it in memory
+    """
+
+    def __init__(self, directory):
+        self.connection = sqlite3.connect(os.path.join(directory, 'remote_keys.sqlite3'))
+        self.connection.execute('PRAGMA journal_mode=OFF')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        self.connection.execute('CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def add(self, keys):
+        self.connection.executemany('INSERT OR IGNORE INTO keys VALUES (?)', ((k,) for k in keys))
+
+    def existing(self, keys):
+        keys = list(keys)
+        found = set()
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            found.update(row[0] for row in self.connection.execute(
+                f'SELECT key FROM keys WHERE key IN ({marks})', chunk
+            ))
+        return found
+
+    def close(self):
+        self.connection.close()
+
+def iter_remote_files(service, page_size):
+    """Yield UploadThing file dicts one listFiles window at a time"""
+    offset = 0
+    while True:
+        page = service.list_files(limit=page_size, offset=offset)
+        files = page.get('files', [])
+        yield from files
+        offset += len(files)
+        if not files or not page.get('hasMore', len(files) == page_size):
+            return
+
+def _uploaded_at(remote):
+    value = remote.get('uploadedAt')
+    return value / 1000 if isinstance(value, (int, float)) and value > 1e11 else value
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def reconcile(service, on_orphan, on_missing, page_size=500, chunk_size=2000, min_age=3600):
+    """
+    Diff UploadThing storage against MediaItem.file_key and Album.cover_image_key;
+    self-hosted keys (albums.storage) are left out.
+
+    on_orphan(keys) receives batches of remote keys no row references; files
+    younger than min_age seconds are ignored since their rows may not have
+    been written yet. on_missing(kind, rows) receives batches of
+    (id, key) pairs whose key is not in the remote listing. Memory stays
+    bounded by page_size/chunk_size: remote keys are spilled to a temporary
+    indexed SQLite file and the database side is read with .iterator().
+    Returns a dict of counts.
+    """
+    stats = {'remote': 0, 'orphaned': 0, 'too_new': 0, 'missing_media': 0, 'missing_covers': 0}
+    cutoff = time.time() - min_age
+    with tempfile.TemporaryDirectory() as directory:
+        index = RemoteKeyIndex(directory)
+        try:
+            for files in _batches(iter_remote_files(service, page_size), page_size):
+                keys = [remote['key'] for remote in files if remote.get('key')]
+                index.add(keys)
+                stats['remote'] += len(keys)
+                used = referenced_keys(keys)
+                orphans = []
+                for remote in files:
+                    if not remote.get('key') or remote['key'] in used:
+                        continue
+                    uploaded_at = _uploaded_at(remote)
+                    if uploaded_at is not None and uploaded_at > cutoff:
+                        stats['too_new'] += 1
+                    else:
+                        orphans.append(remote['key'])
+                if orphans:
+                    stats['orphaned'] += len(orphans)
+                    on_orphan(orphans)
+
+            sources = [
+                ('media', 'missing_media',
+                 MediaItem.objects.exclude(file_key__startswith=LOCAL_KEY_PREFIX)
+                 .values_list('id', 'file_key')),
+                ('cover', 'missing_covers',
+                 Album.objects.exclude(cover_image_key='')
+                 .exclude(cover_image_key__startswith=LOCAL_KEY_PREFIX)
+                 .values_list('id', 'cover_image_key')),
+            ]
+            for kind, counter, rows in sources:
+                for chunk in _batches(rows.order_by().iterator(chunk_size=chunk_size), chunk_size):
+                    present = index.existing({key for _, key in chunk})
+                    missing = [(pk, key) for pk, key in chunk if key not in present]
+                    if missing:
+                        stats[counter] += len(missing)
+                        on_missing(kind, missing)
+        finally:
+            index.close()
+    return stats
@@ -0,0 +1,44 @@
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # MessagePackRenderer is only listed when msgpack is installed
+    msgpack = None
+
+# What orjson and msgpack cannot encode themselves (Decimal, lazy strings,
+# querysets...) is converted exactly as DRF's JSON encoder would
+_default = JSONEncoder().default
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on orjson: the same bytes for API data, several times
+    faster. Datetimes go through DRF's encoder so their format is unchanged;
+    an `indent` parameter in Accept pretty-prints with two spaces.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = self.options
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_default, option=options)
+        # Like JSONRenderer, keep the output a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack for clients that send Accept: application/msgpack"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default)
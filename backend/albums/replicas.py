@@ -0,0 +1,117 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+class RoutingState:
+    """Whether the current request must read from the primary, and whether it wrote"""
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+_state = ContextVar('album_db_routing', default=None)
+
+@contextmanager
+def use_primary():
+    """Send every read in the block to the primary"""
+    token = _state.set(RoutingState(pinned=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+class ReplicaRouter:
+    """
+    Reads of safe requests go to a random alias in settings.DATABASE_REPLICAS;
+    everything else uses the primary. Reads outside a request (management
+    commands, workers, shells) also stay on the primary, as do reads after
+    the request's first write, so a request always sees its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        return False if db in settings.DATABASE_REPLICAS else None
+
+class ReplicaRoutingMiddleware:
+    """
+    Give each request its routing state. Writing requests (and any request
+    that wrote) set a cookie keeping the client's reads on the primary for
+    DATABASE_PRIMARY_STICKY_SECONDS, longer than the replicas are expected
+    to lag, so authors read their own writes on the next request too.
+    """
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        state = self.state_for(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        state = self.state_for(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    def state_for(self, request):
+        return RoutingState(pinned=request.method not in SAFE_METHODS or self.is_sticky(request))
+
+    @staticmethod
+    def finish(state, response):
+        if state.wrote:
+            seconds = settings.DATABASE_PRIMARY_STICKY_SECONDS
+            response.set_cookie(
+                settings.DATABASE_PRIMARY_COOKIE, f'{time.time() + seconds:.3f}',
+                max_age=seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+    @staticmethod
+    def is_sticky(request):
+        try:
+            return float(request.COOKIES.get(settings.DATABASE_PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
@@ -0,0 +1,136 @@
+import re
+import uuid
+from django.db import connection
+from django.db.models import Q
+from .models import Album, AlbumPage, MediaItem, SearchEntry
+
+# Title matches outweigh body matches; FTS5's bm25 is lower-is-better
+TITLE_WEIGHT, BODY_WEIGHT = 10.0, 1.0
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def album_entry(album):
+    return SearchEntry(
+        kind='album', object_id=album.pk, album_id=album.pk,
+        title=album.title, body=' '.join(filter(None, [album.subtitle, album.description])),
+    )
+
+def page_entry(page):
+    return SearchEntry(
+        kind='page', object_id=page.pk, album_id=page.album_id, page_id=page.pk,
+        title=page.title,
+    )
+
+def media_entry(media, album_id):
+    return SearchEntry(
+        kind='media', object_id=media.pk, album_id=album_id, page_id=media.page_id,
+        media_id=media.pk, body=media.caption,
+    )
+
+def index_entries(entries):
+    """Insert or refresh entries in one statement per batch"""
+    SearchEntry.objects.bulk_create(
+        entries, batch_size=500, update_conflicts=True,
+        unique_fields=['object_id'], update_fields=['title', 'body'],
+    )
+
+def index_media(media_items, album_id):
+    """Index captions of media rows written without signals (bulk inserts)"""
+    index_entries([media_entry(media, album_id) for media in media_items if media.caption])
+
+def unindex(object_ids):
+    SearchEntry.objects.filter(object_id__in=list(object_ids)).delete()
+
+def rebuild(batch_size=2000):
+    """Drop and repopulate the whole index; returns the number of entries"""
+    SearchEntry.objects.all().delete()
+    total = 0
+    sources = [
+        (Album.objects.all(), album_entry),
+        (AlbumPage.objects.all(), page_entry),
+        (MediaItem.objects.exclude(caption='').select_related('page'),
+         lambda media: media_entry(media, media.page.album_id)),
+    ]
+    for queryset, build in sources:
+        batch = []
+        for obj in queryset.order_by().iterator(chunk_size=batch_size):
+            batch.append(build(obj))
+            if len(batch) >= batch_size:
+                index_entries(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            index_entries(batch)
+            total += len(batch)
+    return total
+
+def _tokens(query):
+    return TOKEN_RE.findall(query)[:16]
+
+def search(query, kind=None, limit=20, offset=0):
+    """
+    Ranked hits across albums, pages and captions. Each hit is a dict with
+    kind, object_id, album_id, page_id, title, snippet and rank. Every query
+    token is matched as a prefix and all tokens must match.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    if connection.vendor == 'sqlite':
+        sql, params = _sqlite_query(tokens, kind, limit, offset)
+    elif connection.vendor == 'postgresql':
+        sql, params = _postgres_query(tokens, kind, limit, offset)
+    else:
+        return _fallback_search(tokens, kind, limit, offset)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        hits = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for hit in hits:
+        # SQLite hands back UUIDs as bare hex strings
+        for name in ('object_id', 'album_id', 'page_id'):
+            if hit[name] is not None:
+                hit[name] = uuid.UUID(str(hit[name]))
+    return hits
+
+def _sqlite_query(tokens, kind, limit, offset):
+    # Quote every token so user input can never be read as FTS5 syntax
+    match = ' '.join('"%s"*' % token.replace('"', '') for token in tokens)
+    kind_clause = 'AND e.kind = %s' if kind else ''
+    sql = f"""
+        SELECT e.kind, e.object_id, e.album_id, e.page_id, e.title,
+               snippet(albums_searchentry_fts, -1, '[', ']', '...', 12) AS snippet,
+               bm25(albums_searchentry_fts, %s, %s) AS rank
+        FROM albums_searchentry_fts
+        JOIN albums_searchentry e ON e.id = albums_searchentry_fts.rowid
+        WHERE albums_searchentry_fts MATCH %s {kind_clause}
+        ORDER BY rank
+        LIMIT %s OFFSET %s
+    """
+    params = [TITLE_WEIGHT, BODY_WEIGHT, match] + ([kind] if kind else []) + [limit, offset]
+    return sql, params
+
+def _postgres_query(tokens, kind, limit, offset):
+    tsquery = ' & '.join(f'{token}:*' for token in tokens)
+    kind_clause = 'AND e.kind = %s' if kind else ''
+    sql = f"""
+        SELECT e.kind, e.object_id, e.album_id, e.page_id, e.title,
+               ts_headline('simple', e.body, q, 'StartSel=[, StopSel=], MaxFragments=1') AS snippet,
+               -ts_rank_cd(e.search_vector, q) AS rank
+        FROM albums_searchentry e, to_tsquery('simple', %s) q
+        WHERE e.search_vector @@ q {kind_clause}
+        ORDER BY rank
+        LIMIT %s OFFSET %s
+    """
+    params = [tsquery] + ([kind] if kind else []) + [limit, offset]
+    return sql, params
+
+def _fallback_search(tokens, kind, limit, offset):
+    queryset = SearchEntry.objects.all()
+    for token in tokens:
+        queryset = queryset.filter(Q(title__icontains=token) | Q(body__icontains=token))
+    if kind:
+        queryset = queryset.filter(kind=kind)
+    rows = queryset.order_by('kind', 'id').values(
+        'kind', 'object_id', 'album_id', 'page_id', 'title', 'body'
+    )[offset:offset + limit]
+    return [dict(row, snippet=row.pop('body')[:200], rank=0) for row in rows]
@@ -1,16 +1,118 @@
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from .models import Album, AlbumPage, MediaItem, AlbumShare
+from .derivatives import srcset, thumbnail_url
+from .models import Album, AlbumPage, MediaItem, AlbumShare, Upload
+from .storage import is_content_key, is_local_key, media_url
 
-class MediaItemSerializer(serializers.ModelSerializer):
+def parse_fieldset(value):
+    """
+    Split a comma separated fieldset such as "id,pages.title" into the
+    top-level names and a mapping of nested paths per top-level name.
+    Returns (None, {}) when no fieldset was given or it names no field
+    (?fields=), which both mean every field.
+    """
+    if value is None:
+        return None, {}
+    if isinstance(value, str):
+        value = value.split(',')
+    top, nested = set(), {}
+    for path in value:
+        path = path.strip()
+        if not path:
+            continue
+        name, _, rest = path.partition('.')
+        top.add(name)
+        if rest:
+            nested.setdefault(name, []).append(rest)
+    if not top:
+        return None, {}
+    return top, nested
+
+class SparseFieldsetMixin:
+    """
+    Trim serializer output with `fields` and opt into `Meta.expandable_fields`
+    with `expand`. Both accept dotted paths that are forwarded to nested
+    serializers. The root serializer falls back to the request's ?fields= and
+    ?expand= query parameters when no explicit value is passed.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self._sparse = (fields, expand)
+    
+    def _sparse_options(self):
+        if hasattr(self, '_sparse'):
+            return self._sparse
+        request = self.context.get('request')
+        if request is None:
+            return None, None
+        params = request.query_params
+        return params.get('fields'), params.get('expand')
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset, expansions = self._sparse_options()
+        wanted, wanted_nested = parse_fieldset(fieldset)
+        expand, expand_nested = parse_fieldset(expansions)
+        expand = (expand or set()) | (wanted or set())
+        
+        for name in getattr(self.Meta, 'expandable_fields', []):
+            if name not in expand:
+                fields.pop(name, None)
+        if wanted:
+            for name in list(fields):
+                if name not in wanted:
+                    del fields[name]
+        
+        for name, field in fields.items():
+            nested = getattr(field, 'child', field)
+            if isinstance(nested, SparseFieldsetMixin):
+                nested._sparse = (wanted_nested.get(name), expand_nested.get(name))
+        return fields
+
+def media_base(serializer):
+    """Absolute MEDIA_URL, worked out once per serialization"""
+    context = serializer.context
+    if 'media_base' not in context:
+        request = context.get('request')
+        base = settings.MEDIA_URL
+        context['media_base'] = request.build_absolute_uri(base) if request is not None else base
+    return context['media_base']
+
+def validate_stored_key(value):
+    """Self-hosted keys must be spelled exactly as the storage names the file"""
+    if is_local_key(value) and not is_content_key(value):
+        raise serializers.ValidationError('No such uploaded file')
+    return value
+
+class MediaItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    
     class Meta:
         model = MediaItem
         fields = [
             'id', 'media_type', 'file_url', 'file_key', 'caption', 
-            'duration', 'position', 'width', 'height', 'file_size',
-            'created_at', 'updated_at'
+            'duration', 'position', 'width', 'height', 'file_size', 'content_hash',
+            'srcset', 'thumbnail_url', 'created_at', 'updated_at'
         ]
+        read_only_fields = ['content_hash']
+    
+    def validate_file_key(self, value):
+        return validate_stored_key(value)
+    
+    def get_srcset(self, obj):
+        return srcset(media_base(self), obj)
+    
+    def get_thumbnail_url(self, obj):
+        return thumbnail_url(media_base(self), obj)
 
-class AlbumPageSerializer(serializers.ModelSerializer):
+class AlbumPageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     media_items = MediaItemSerializer(many=True, read_only=True)
     items = serializers.SerializerMethodField()  # For frontend compatibility
     
@@ -18,12 +120,22 @@ class AlbumPageSerializer(serializers.ModelSerializer):
         model = AlbumPage
         fields = [
             'id', 'title', 'page_number', 'media_items', 'items',
+            'image_count', 'video_count', 'total_file_size', 'video_seconds',
             'created_at', 'updated_at'
         ]
     
+    def get_fields(self):
+        fields = super().get_fields()
+        # API version 2 (negotiated in Accept) has no use for the legacy projection
+        request = self.context.get('request')
+        if getattr(request, 'version', None) == '2':
+            fields.pop('items', None)
+        return fields
+    
     def get_items(self, obj):
         """Transform media_items to match frontend format"""
         items = []
+        base = media_base(self)
         for media in obj.media_items.all():
             item = {
                 'type': media.media_type,
@@ -32,10 +144,23 @@ class AlbumPageSerializer(serializers.ModelSerializer):
             }
             if media.duration:
                 item['duration'] = media.duration
+            if media.derivative_status == 'ready':
+                item.update(
+                    srcset=srcset(base, media), thumbnail=thumbnail_url(base, media),
+                    width=media.width, height=media.height,
+                )
             items.append(item)
         return items
 
-class AlbumSerializer(serializers.ModelSerializer):
+class AlbumPageSkeletonSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """A page without its media, enough to lay out an album before pages load"""
+    media_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = AlbumPage
+        fields = ['id', 'title', 'page_number', 'media_count']
+
+class AlbumSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     pages = AlbumPageSerializer(many=True, read_only=True)
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
     
@@ -44,9 +169,30 @@ class AlbumSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'subtitle', 'description', 'cover_image_url', 
             'cover_image_key', 'pages', 'created_by', 'created_by_username',
-            'created_at', 'updated_at', 'is_public'
+            'page_count', 'image_count', 'video_count', 'total_file_size',
+            'video_seconds', 'created_at', 'updated_at', 'is_public'
         ]
         read_only_fields = ['created_by']
+    
+    def validate_cover_image_key(self, value):
+        return validate_stored_key(value)
+
+class AlbumSkeletonSerializer(AlbumSerializer):
+    """Album with page skeletons in place of the full tree (?view=skeleton)"""
+    pages = AlbumPageSkeletonSerializer(many=True, read_only=True)
+
+class AlbumSummarySerializer(AlbumSerializer):
+    """Lightweight album projection for grid listings; pages only via ?expand=pages"""
+    media_count = serializers.IntegerField(read_only=True)
+    
+    class Meta(AlbumSerializer.Meta):
+        fields = [
+            'id', 'title', 'subtitle', 'cover_image_url', 'created_by',
+            'created_by_username', 'page_count', 'media_count', 'image_count',
+            'video_count', 'total_file_size', 'video_seconds', 'created_at',
+            'updated_at', 'is_public', 'pages'
+        ]
+        expandable_fields = ['pages']
 
 class AlbumCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -55,11 +201,15 @@ class AlbumCreateSerializer(serializers.ModelSerializer):
             'title', 'subtitle', 'description', 'cover_image_url', 
             'cover_image_key', 'is_public'
         ]
+    
+    def validate_cover_image_key(self, value):
+        return validate_stored_key(value)
 
 class AlbumPageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = AlbumPage
         fields = ['title', 'page_number']
+        extra_kwargs = {'page_number': {'required': False}}
 
 class MediaItemCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -68,6 +218,19 @@ class MediaItemCreateSerializer(serializers.ModelSerializer):
             'media_type', 'file_url', 'file_key', 'caption', 
             'duration', 'position', 'width', 'height', 'file_size'
         ]
+    
+    def validate_file_key(self, value):
+        return validate_stored_key(value)
+    
+    def validate(self, data):
+        """Self-hosted files must exist, and their size is read from disk"""
+        file_key = data.get('file_key', '')
+        if is_local_key(file_key):
+            try:
+                data['file_size'] = default_storage.size(file_key)
+            except (OSError, SuspiciousFileOperation):
+                raise serializers.ValidationError({'file_key': 'No such uploaded file'})
+        return data
 
 class AlbumShareSerializer(serializers.ModelSerializer):
     album_title = serializers.CharField(source='album.title', read_only=True)
@@ -79,3 +242,29 @@ class AlbumShareSerializer(serializers.ModelSerializer):
             'is_active', 'expires_at', 'created_at'
         ]
         read_only_fields = ['share_token']
+
+class UploadSerializer(serializers.ModelSerializer):
+    file_url = serializers.SerializerMethodField()
+    # Announcing the content's hash skips the transfer if it is already stored
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$', write_only=True, required=False)
+    
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'filename', 'content_type', 'size', 'received', 'file_key', 'file_url',
+            'sha256', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['received', 'file_key']
+    
+    def validate_size(self, value):
+        if not 0 < value <= settings.LOCAL_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f'Must be between 1 and {settings.LOCAL_UPLOAD_MAX_BYTES} bytes'
+            )
+        return value
+    
+    def get_file_url(self, obj):
+        """Where the finished file is served, ready for add_media; null until then"""
+        if not obj.file_key:
+            return None
+        return media_url(self.context['request'], obj.file_key)
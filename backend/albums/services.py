@@ -1,14 +1,58 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
-from typing import Dict, Any, Optional
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from typing import Dict, Any, Iterable, List, Optional, Union
+
+class UploadThingError(Exception):
+    """Raised when an UploadThing API call fails after retries"""
 
 class UploadThingService:
-    """Service for handling UploadThing API interactions"""
+    """
+    Service for handling UploadThing API interactions.
+
+    Calls go through one pooled keep-alive session with connect/read timeouts
+    and bounded retries (exponential backoff, honouring Retry-After) on
+    connection errors, 429 and 5xx. Use get_uploadthing_service() to share a
+    single instance, and therefore its connection pool, across the process.
+    """
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
     
-    def __init__(self):
+    def __init__(self, base_url=None, timeout=None, max_retries=None,
+                 backoff_factor=None, pool_size=None, delete_batch_size=None):
         self.secret = settings.UPLOADTHING_SECRET
         self.app_id = settings.UPLOADTHING_APP_ID
-        self.base_url = "https://api.uploadthing.com"
+        self.base_url = (base_url or settings.UPLOADTHING_API_URL).rstrip('/')
+        self.timeout = timeout or (
+            settings.UPLOADTHING_CONNECT_TIMEOUT, settings.UPLOADTHING_READ_TIMEOUT
+        )
+        self.delete_batch_size = delete_batch_size or settings.UPLOADTHING_DELETE_BATCH_SIZE
+        
+        retry = Retry(
+            total=settings.UPLOADTHING_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=(
+                settings.UPLOADTHING_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+            ),
+            status_forcelist=self.RETRY_STATUSES,
+            # deleteFile is idempotent, so POSTs are safe to replay
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        pool_size = pool_size or settings.UPLOADTHING_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(self.get_headers())
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def get_headers(self) -> Dict[str, str]:
         """Get headers for UploadThing API requests"""
@@ -17,43 +61,150 @@ class UploadThingService:
             "Content-Type": "application/json",
         }
     
-    def delete_file(self, file_key: str) -> Dict[str, Any]:
-        """Delete file from UploadThing"""
-        url = f"{self.base_url}/api/deleteFile"
-        payload = {
-            "fileKeys": [file_key]
-        }
-        
+    def _request(self, method: str, path: str, action: str, **kwargs) -> Any:
         try:
-            response = requests.post(url, json=payload, headers=self.get_headers())
+            response = self.session.request(
+                method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs
+            )
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            raise Exception(f"Failed to delete file: {str(e)}")
+        except (requests.RequestException, ValueError) as e:
+            raise UploadThingError(f"Failed to {action}: {str(e)}") from e
+    
+    def delete_file(self, file_key: str) -> Dict[str, Any]:
+        """Delete file from UploadThing"""
+        return self._request(
+            'POST', '/api/deleteFile', 'delete file', json={"fileKeys": [file_key]}
+        )
+    
+    def delete_files(self, file_keys: Iterable[str]) -> List[Dict[str, Any]]:
+        """Delete many files, sending at most delete_batch_size keys per call"""
+        responses, batch = [], []
+        for key in file_keys:
+            batch.append(key)
+            if len(batch) >= self.delete_batch_size:
+                responses.append(self._delete_batch(batch))
+                batch = []
+        if batch:
+            responses.append(self._delete_batch(batch))
+        return responses
+    
+    def _delete_batch(self, file_keys: List[str]) -> Dict[str, Any]:
+        return self._request(
+            'POST', '/api/deleteFile', 'delete files', json={"fileKeys": list(file_keys)}
+        )
     
     def get_file_info(self, file_key: str) -> Optional[Dict[str, Any]]:
         """Get file information from UploadThing"""
-        url = f"{self.base_url}/api/getFileInfo"
-        params = {"fileKey": file_key}
-        
-        try:
-            response = requests.get(url, params=params, headers=self.get_headers())
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            raise Exception(f"Failed to get file info: {str(e)}")
+        return self._request(
+            'GET', '/api/getFileInfo', 'get file info', params={"fileKey": file_key}
+        )
     
-    def list_files(self) -> Dict[str, Any]:
-        """List all files in UploadThing"""
-        url = f"{self.base_url}/api/listFiles"
-        
-        try:
-            response = requests.get(url, headers=self.get_headers())
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            raise Exception(f"Failed to list files: {str(e)}")
+    def list_files(self, limit: Optional[int] = None, offset: Optional[int] = None) -> Dict[str, Any]:
+        """List files in UploadThing, optionally one limit/offset window at a time"""
+        params = {
+            name: value for name, value in (('limit', limit), ('offset', offset))
+            if value is not None
+        }
+        return self._request('GET', '/api/listFiles', 'list files', params=params or None)
+    
+    def close(self):
+        self.session.close()
+
+_uploadthing_service = None
+_service_lock = threading.Lock()
+
+def get_uploadthing_service() -> UploadThingService:
+    """Return the process-wide UploadThingService so its connection pool is reused"""
+    global _uploadthing_service
+    if _uploadthing_service is None:
+        with _service_lock:
+            if _uploadthing_service is None:
+                _uploadthing_service = UploadThingService()
+    return _uploadthing_service
+
+class AsyncUploadThingService:
+    """
+    asyncio interface for fanning many UploadThing calls out at once.
+
+    Each call runs the pooled, retrying UploadThingService on a private
+    thread pool, so the event loop never blocks. An asyncio.Semaphore caps
+    the calls in flight at `concurrency`, which defaults to the HTTP pool
+    size so every in-flight call gets a keep-alive connection.
+    """
+    
+    def __init__(self, service=None, concurrency=None):
+        self.service = service or get_uploadthing_service()
+        self.concurrency = concurrency or settings.UPLOADTHING_ASYNC_CONCURRENCY
+        self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='uploadthing')
+        # asyncio primitives belong to one event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+    
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+    
+    async def _call(self, method, *args) -> Any:
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(method, *args)
+            )
+    
+    async def delete_file(self, file_key: str) -> Dict[str, Any]:
+        return await self._call(self.service.delete_file, file_key)
+    
+    async def delete_files(self, file_keys: Iterable[str]) -> List[Dict[str, Any]]:
+        """Delete many files, sending the delete_batch_size batches concurrently"""
+        keys, size = list(file_keys), self.service.delete_batch_size
+        return list(await asyncio.gather(*(
+            self._call(self.service._delete_batch, keys[start:start + size])
+            for start in range(0, len(keys), size)
+        )))
+    
+    async def get_file_info(self, file_key: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self.service.get_file_info, file_key)
+    
+    async def get_file_infos(
+        self, file_keys: Iterable[str]
+    ) -> Dict[str, Union[Dict[str, Any], UploadThingError]]:
+        """File info for each key, or the UploadThingError its lookup raised"""
+        keys = list(dict.fromkeys(file_keys))
+        results = await asyncio.gather(
+            *(self.get_file_info(key) for key in keys), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, UploadThingError):
+                raise result
+        return dict(zip(keys, results))
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+_async_uploadthing_service = None
+
+def get_async_uploadthing_service() -> AsyncUploadThingService:
+    """Return the process-wide AsyncUploadThingService, built on get_uploadthing_service()"""
+    global _async_uploadthing_service
+    if _async_uploadthing_service is None:
+        with _service_lock:
+            if _async_uploadthing_service is None:
+                _async_uploadthing_service = AsyncUploadThingService()
+    return _async_uploadthing_service
 
+@receiver(setting_changed)
+def _reset_uploadthing_service(setting, **kwargs):
+    global _uploadthing_service, _async_uploadthing_service
+    if not setting.startswith('UPLOADTHING_'):
+        return
+    if _async_uploadthing_service is not None:
+        _async_uploadthing_service.close()
+        _async_uploadthing_service = None
+    if _uploadthing_service is not None:
+        _uploadthing_service.close()
+        _uploadthing_service = None
 
 
 # import requests
@@ -0,0 +1,155 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+from .cache import invalidate_album, invalidate_share
+from .models import Album, AlbumPage, MediaItem, AlbumShare
+from .outbox import enqueue_file_deletions
+from . import search, stats
+
+# A page never moves between albums, so page -> album lookups can be memoised
+# for the life of the process. This keeps cascade deletes of many media items
+# to one lookup per page.
+_page_albums = {}
+_PAGE_ALBUMS_LIMIT = 10000
+
+def album_id_for_page(page_id):
+    album_id = _page_albums.get(page_id)
+    if album_id is None:
+        album_id = AlbumPage.objects.filter(pk=page_id).values_list('album_id', flat=True).first()
+        if album_id is not None:
+            if len(_page_albums) >= _PAGE_ALBUMS_LIMIT:
+                _page_albums.clear()
+            _page_albums[page_id] = album_id
+    return album_id
+
+@receiver([post_save, post_delete], sender=Album)
+def album_changed(sender, instance, **kwargs):
+    invalidate_album(instance.pk)
+
+@receiver([post_save, post_delete], sender=AlbumPage)
+def page_changed(sender, instance, signal, **kwargs):
+    if signal is post_delete:
+        _page_albums.pop(instance.pk, None)
+    invalidate_album(instance.album_id)
+
+@receiver([post_save, post_delete], sender=MediaItem)
+def media_changed(sender, instance, **kwargs):
+    album_id = album_id_for_page(instance.page_id)
+    if album_id is not None:
+        invalidate_album(album_id)
+
+@receiver([post_save, post_delete], sender=AlbumShare)
+def share_changed(sender, instance, **kwargs):
+    invalidate_share(instance.share_token)
+    invalidate_album(instance.album_id)
+
+def _deleted_directly(model, origin):
+    """Whether delete() was called on `model` itself rather than cascading from a parent"""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+# Remote files are queued for deletion in the deleting transaction. A cascade
+# is handled once at its root with a single query for every key underneath,
+# instead of once per media row.
+
+@receiver(pre_delete, sender=Album)
+def queue_album_files(sender, instance, origin=None, **kwargs):
+    keys = list(
+        MediaItem.objects.filter(page__album=instance).values_list('file_key', flat=True)
+    )
+    enqueue_file_deletions(keys + [instance.cover_image_key])
+
+@receiver(pre_delete, sender=AlbumPage)
+def queue_page_files(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(AlbumPage, origin):
+        enqueue_file_deletions(instance.media_items.values_list('file_key', flat=True))
+
+@receiver(post_delete, sender=MediaItem)
+def queue_media_file(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(MediaItem, origin):
+        enqueue_file_deletions([instance.file_key])
+
+@receiver(pre_save, sender=Album)
+def queue_replaced_cover(sender, instance, update_fields=None, **kwargs):
+    """Queue the old key when a save swaps an album cover"""
+    if instance._state.adding or (update_fields is not None and 'cover_image_key' not in update_fields):
+        return
+    old_key = Album.objects.filter(pk=instance.pk).values_list('cover_image_key', flat=True).first()
+    if old_key and old_key != instance.cover_image_key:
+        enqueue_file_deletions([old_key])
+
+@receiver(pre_save, sender=MediaItem)
+def snapshot_media(sender, instance, **kwargs):
+    """
+    Remember the stored row before an update so post_save can apply counter
+    deltas, and queue the old file (and requeue derivatives) when the save
+    swaps it out
+    """
+    instance._previous = None
+    if instance._state.adding:
+        return
+    instance._previous = MediaItem.objects.filter(pk=instance.pk).values(
+        'page_id', 'file_key', 'media_type', 'file_size', 'duration'
+    ).first()
+    old_key = instance._previous and instance._previous['file_key']
+    if old_key and old_key != instance.file_key:
+        enqueue_file_deletions([old_key])
+        # A new file needs measuring and rendering again
+        instance.content_hash = ''
+        instance.derivative_status = 'pending'
+
+# Keep the full-text index in step with saves. Deletes need no receiver:
+# SearchEntry rows cascade from their album, page or media item.
+
+@receiver(post_save, sender=Album)
+def index_album(sender, instance, **kwargs):
+    search.index_entries([search.album_entry(instance)])
+
+@receiver(post_save, sender=AlbumPage)
+def index_page(sender, instance, **kwargs):
+    search.index_entries([search.page_entry(instance)])
+
+@receiver(post_save, sender=MediaItem)
+def index_media(sender, instance, created=False, **kwargs):
+    if instance.caption:
+        search.index_entries([search.media_entry(instance, album_id_for_page(instance.page_id))])
+    elif not created:
+        search.unindex([instance.pk])
+
+# Denormalized counters on Album and AlbumPage. A cascade is settled at its
+# root: deleting a page subtracts its totals from the album once, and media
+# rows removed by that cascade are skipped.
+
+@receiver(post_save, sender=AlbumPage)
+def count_new_page(sender, instance, created=False, **kwargs):
+    if created:
+        stats.apply_stats(None, instance.album_id, {}, pages=1)
+
+@receiver(pre_delete, sender=AlbumPage)
+def uncount_page(sender, instance, origin=None, **kwargs):
+    # pre_delete so the page's stored totals can still be read; the delete
+    # runs in the same transaction
+    if _deleted_directly(AlbumPage, origin):
+        stats.apply_stats(None, instance.album_id, stats.scaled(stats.page_stats(instance.pk), -1), pages=-1)
+
+@receiver(post_save, sender=MediaItem)
+def count_media(sender, instance, created=False, **kwargs):
+    current = stats.media_stats(instance.media_type, instance.file_size, instance.duration)
+    previous = getattr(instance, '_previous', None)
+    if created or previous is None:
+        stats.apply_stats(instance.page_id, album_id_for_page(instance.page_id), current)
+        return
+    old = stats.media_stats(previous['media_type'], previous['file_size'], previous['duration'])
+    if previous['page_id'] != instance.page_id:
+        stats.apply_stats(previous['page_id'], album_id_for_page(previous['page_id']), stats.scaled(old, -1))
+        stats.apply_stats(instance.page_id, album_id_for_page(instance.page_id), current)
+    else:
+        delta = {name: current[name] - old[name] for name in current}
+        stats.apply_stats(instance.page_id, album_id_for_page(instance.page_id), delta)
+
+@receiver(post_delete, sender=MediaItem)
+def uncount_media(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(MediaItem, origin):
+        current = stats.media_stats(instance.media_type, instance.file_size, instance.duration)
+        stats.apply_stats(instance.page_id, album_id_for_page(instance.page_id), stats.scaled(current, -1))
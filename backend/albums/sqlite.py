@@ -0,0 +1,180 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import JsonResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only serialises threads of one process
+    fcntl = None
+
+UNSAFE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+def apply_pragmas(sender=None, connection=None, **kwargs):
+    """
+    connection_created receiver: apply settings.SQLITE_PRAGMAS to new SQLite
+    connections and let them begin immediate transactions
+    """
+    if connection.vendor != 'sqlite':
+        return
+    if immediate_transactions not in connection.execute_wrappers:
+        connection.execute_wrappers.append(immediate_transactions)
+    if not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+
+def immediate_transactions(execute, sql, params, many, context):
+    """
+    Execute wrapper: with settings.SQLITE_IMMEDIATE_TRANSACTIONS, atomic
+    blocks take SQLite's write lock as they begin, waiting on busy_timeout.
+    A deferred transaction that reads first cannot wait for it later and
+    fails at once with "database is locked" when another writer holds it.
+    """
+    if sql == 'BEGIN' and settings.SQLITE_IMMEDIATE_TRANSACTIONS:
+        sql = 'BEGIN IMMEDIATE'
+    return execute(sql, params, many, context)
+
+class WriteLock:
+    """
+    Exclusive lock shared by every thread and worker process on this host:
+    a threading.Lock for the threads of one process and an flock() on a
+    lock file for the processes. Holders never block readers; with WAL they
+    keep writing alongside them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        if not self._thread_lock.acquire(timeout=max(timeout, 0)):
+            return False
+        if fcntl is None:
+            return True
+        if self._file is None:
+            self._file = open(self.path, 'a+')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            pass
+        if self._wait_for_file(deadline - time.monotonic()):
+            return True
+        self._thread_lock.release()
+        return False
+
+    def _wait_for_file(self, timeout):
+        """
+        Block in flock() on a second open file from a helper thread, so the
+        kernel hands over the lock the moment its holder lets go; polling
+        instead left waiters asleep while a writer that had just released
+        it took it again. A helper that wins after the timeout lets go.
+        """
+        acquired, guard, abandoned = threading.Event(), threading.Lock(), []
+        waiter = open(self.path, 'a+')
+
+        def wait():
+            fcntl.flock(waiter.fileno(), fcntl.LOCK_EX)
+            with guard:
+                if not abandoned:
+                    acquired.set()
+                    return
+            waiter.close()
+
+        threading.Thread(target=wait, daemon=True).start()
+        acquired.wait(max(timeout, 0))
+        with guard:
+            if not acquired.is_set():
+                abandoned.append(True)
+                return False
+        self._file.close()
+        self._file = waiter
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+def get_write_lock(alias=DEFAULT_DB_ALIAS):
+    """The WriteLock for a database file; one per process and file"""
+    name = str(connections[alias].settings_dict['NAME'])
+    with _write_locks_guard:
+        if name not in _write_locks:
+            digest = hashlib.sha1(os.path.abspath(name).encode()).hexdigest()[:16]
+            path = os.path.join(tempfile.gettempdir(), f'album-sqlite-{digest}.lock')
+            _write_locks[name] = WriteLock(path)
+        return _write_locks[name]
+
+# A forked worker must open its own lock file: flock() locks are shared by
+# every process holding the same open file
+os.register_at_fork(after_in_child=_write_locks.clear)
+
+class SQLiteWriteLockMiddleware:
+    """
+    Serialise writing requests (POST/PUT/PATCH/DELETE) across threads and
+    worker processes when settings.SQLITE_WRITE_LOCK is on. SQLite admits one
+    writer at a time anyway; queueing writers here instead of inside SQLite
+    avoids "database is locked" errors from transactions that read before
+    writing, which cannot wait for the lock. Immediate transactions avoid
+    them too while holding the lock for less time, so this is opt-in. Safe
+    methods never take it, nor do SQLITE_WRITE_LOCK_EXEMPT_PATHS, whose
+    writes are single statements.
+    """
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.needs_lock(request):
+            return self.get_response(request)
+        lock = get_write_lock()
+        if not lock.acquire(settings.SQLITE_WRITE_LOCK_TIMEOUT):
+            return self.busy()
+        try:
+            return self.get_response(request)
+        finally:
+            lock.release()
+
+    async def __acall__(self, request):
+        if not self.needs_lock(request):
+            return await self.get_response(request)
+        lock = get_write_lock()
+        # Wait off the event loop; the lock is not tied to the acquiring thread
+        if not await sync_to_async(lock.acquire, thread_sensitive=False)(settings.SQLITE_WRITE_LOCK_TIMEOUT):
+            return self.busy()
+        try:
+            return await self.get_response(request)
+        finally:
+            lock.release()
+
+    @staticmethod
+    def needs_lock(request):
+        return (
+            settings.SQLITE_WRITE_LOCK and request.method in UNSAFE_METHODS
+            and not request.path.startswith(tuple(settings.SQLITE_WRITE_LOCK_EXEMPT_PATHS))
+        )
+
+    @staticmethod
+    def busy():
+        response = JsonResponse({'error': 'The server is busy, please retry'}, status=503)
+        response['Retry-After'] = '1'
+        return response
@@ -0,0 +1,86 @@
+from django.db.models import Count, F, Q, Sum
+from .models import Album, AlbumPage, MediaItem, MediaStats, duration_seconds
+
+def media_stats(media_type, file_size, duration):
+    """Counter contribution of a single media item"""
+    return {
+        'image_count': 1 if media_type == 'image' else 0,
+        'video_count': 1 if media_type == 'video' else 0,
+        'total_file_size': file_size or 0,
+        'video_seconds': duration_seconds(duration) if media_type == 'video' else 0,
+    }
+
+def total_stats(media_items):
+    totals = dict.fromkeys(MediaStats.STATS_FIELDS, 0)
+    for media in media_items:
+        for name, value in media_stats(media.media_type, media.file_size, media.duration).items():
+            totals[name] += value
+    return totals
+
+def scaled(stats, factor):
+    return {name: value * factor for name, value in stats.items()}
+
+def apply_stats(page_id, album_id, stats, pages=0):
+    """Atomically add `stats` (and `pages` to page_count) with F() updates"""
+    changes = {name: F(name) + value for name, value in stats.items() if value}
+    if changes and page_id is not None:
+        AlbumPage.objects.filter(pk=page_id).update(**changes)
+    if pages:
+        changes['page_count'] = F('page_count') + pages
+    if changes and album_id is not None:
+        Album.objects.filter(pk=album_id).update(**changes)
+
+def page_stats(page_id):
+    """Current counters of a page as stored, ignoring any in-memory copy"""
+    return AlbumPage.objects.filter(pk=page_id).values(*MediaStats.STATS_FIELDS).first() or {}
+
+_MEDIA_AGGREGATES = {
+    'image_count': Count('id', filter=Q(media_type='image')),
+    'video_count': Count('id', filter=Q(media_type='video')),
+    'total_file_size': Sum('file_size'),
+}
+
+def recompute(album_ids):
+    """
+    Rebuild the counters of the given albums and their pages from the media
+    rows; returns the number of albums written. Used to repair drift and after
+    imports that bypass the incremental paths.
+    """
+    album_ids = list(album_ids)
+    pages = {
+        page.pk: page for page in AlbumPage.objects.filter(album_id__in=album_ids).only(
+            'id', 'album_id', *MediaStats.STATS_FIELDS
+        )
+    }
+    empty = dict.fromkeys(MediaStats.STATS_FIELDS, 0)
+    page_totals = {pk: dict(empty) for pk in pages}
+    rows = (
+        MediaItem.objects.filter(page__album_id__in=album_ids).order_by()
+        .values('page_id').annotate(**_MEDIA_AGGREGATES)
+    )
+    for row in rows:
+        totals = page_totals[row['page_id']]
+        totals.update({name: row[name] or 0 for name in _MEDIA_AGGREGATES})
+    # Durations are free text, so video length is summed in Python
+    videos = (
+        MediaItem.objects.filter(page__album_id__in=album_ids, media_type='video')
+        .exclude(duration='').values_list('page_id', 'duration').iterator()
+    )
+    for page_id, duration in videos:
+        page_totals[page_id]['video_seconds'] += duration_seconds(duration)
+
+    album_totals = {pk: dict(empty, page_count=0) for pk in album_ids}
+    for page_id, totals in page_totals.items():
+        page = pages[page_id]
+        for name, value in totals.items():
+            setattr(page, name, value)
+            album_totals[page.album_id][name] += value
+        album_totals[page.album_id]['page_count'] += 1
+    AlbumPage.objects.bulk_update(pages.values(), MediaStats.STATS_FIELDS, batch_size=500)
+
+    albums = list(Album.objects.filter(pk__in=album_ids).only('id', *Album.STATS_FIELDS))
+    for album in albums:
+        for name, value in album_totals[album.pk].items():
+            setattr(album, name, value)
+    Album.objects.bulk_update(albums, Album.STATS_FIELDS, batch_size=500)
+    return len(albums)
@@ -0,0 +1,256 @@
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils import timezone
+from .models import Upload
+
+# File keys of self-hosted media are their storage names under this prefix;
+# anything else is an UploadThing key
+LOCAL_KEY_PREFIX = 'cas/'
+# Part files of uploads in progress, never served
+PARTS_DIR = 'uploads'
+# Image renditions, named after the content hash of their original
+DERIVATIVES_DIR = 'derivatives'
+COPY_CHUNK_SIZE = 1024 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class UploadConflict(Exception):
+    """A chunk was sent for an offset other than the upload's current one"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+# The only spelling content_name() produces: cas/<2 hex>/<2 hex>/<sha256>[.ext]
+CONTENT_KEY_RE = re.compile(r'cas/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(\.[a-z0-9]{1,10})?')
+
+def is_local_key(file_key):
+    return file_key.startswith(LOCAL_KEY_PREFIX)
+
+def is_content_key(file_key):
+    """
+    Whether a local key is spelled exactly as content_name() spells it.
+    Other spellings (cas/./..., cas/../uploads/...) may resolve to a stored
+    file, but references are compared as strings, so they are refused.
+    """
+    return CONTENT_KEY_RE.fullmatch(file_key) is not None
+
+def is_content_addressed(name):
+    """Whether a stored name is derived from its bytes, so it never changes"""
+    return name.startswith((LOCAL_KEY_PREFIX, DERIVATIVES_DIR + '/'))
+
+def content_name(digest, filename):
+    """Storage name for content with this SHA-256, keeping a sane extension"""
+    extension = os.path.splitext(filename)[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+        extension = ''
+    return f'{LOCAL_KEY_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+def part_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, PARTS_DIR, f'{upload.pk}.part')
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Copy `length` bytes from `stream` into the upload's part file at
+    `offset`, COPY_CHUNK_SIZE at a time, and advance `received` by what
+    arrived (less than `length` if the client went away). Raises
+    UploadConflict when `offset` is not where the upload stands, and
+    ValueError when the chunk would run past the declared size.
+    """
+    if offset != upload.received:
+        raise UploadConflict(upload.received)
+    if length < 0 or offset + length > upload.size:
+        raise ValueError(f'Chunk runs past the declared size of {upload.size} bytes')
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as part:
+        part.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+        received = offset + length - remaining
+        part.truncate(received)
+    # Compare-and-set, so of two writers racing for one offset only one counts
+    if not Upload.objects.filter(pk=upload.pk, received=offset).update(
+        received=received, updated_at=timezone.now()
+    ):
+        upload.refresh_from_db(fields=['received'])
+        raise UploadConflict(upload.received)
+    upload.received = received
+    return received
+
+def finalize(upload):
+    """Move a fully received upload to its content-addressed name; returns the file key"""
+    path = part_path(upload)
+    with open(path, 'rb') as part:
+        digest = hashlib.file_digest(part, 'sha256').hexdigest()
+    name = content_name(digest, upload.filename)
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Same content stored twice replaces it with identical bytes, atomically
+    os.replace(path, target)
+    Upload.objects.filter(pk=upload.pk).update(file_key=name)
+    upload.file_key = name
+    return name
+
+def find_content(digest):
+    """Storage name of already stored content with this SHA-256, whatever its extension"""
+    directory = f'{LOCAL_KEY_PREFIX}{digest[:2]}/{digest[2:4]}'
+    if not default_storage.exists(directory):
+        return None
+    for filename in default_storage.listdir(directory)[1]:
+        if os.path.splitext(filename)[0] == digest:
+            return f'{directory}/{filename}'
+    return None
+
+def reuse_content(upload, digest):
+    """
+    Complete a new upload at once when content with the SHA-256 the client
+    announced is already stored at the declared size, so no bytes are sent.
+    Returns whether it was.
+    """
+    name = find_content(digest)
+    if name is None or default_storage.size(name) != upload.size:
+        return False
+    Upload.objects.filter(pk=upload.pk).update(received=upload.size, file_key=name)
+    upload.received, upload.file_key = upload.size, name
+    return True
+
+def media_url(request, file_key):
+    """Absolute URL a local file is served from, for MediaItem.file_url"""
+    return request.build_absolute_uri(settings.MEDIA_URL + quote(file_key))
+
+def delete_local_files(file_keys):
+    for key in file_keys:
+        if is_content_key(key):
+            default_storage.delete(key)
+
+def purge_uploads(before):
+    """
+    Drop uploads last touched before `before`: part files of unfinished ones,
+    and the rows of finished ones, whose files go through the deletion outbox
+    and so survive if a media item uses them. Returns the number purged.
+    """
+    from .outbox import enqueue_file_deletions
+    stale = list(Upload.objects.filter(updated_at__lt=before))
+    for upload in stale:
+        if not upload.file_key and os.path.exists(part_path(upload)):
+            os.remove(part_path(upload))
+    enqueue_file_deletions(upload.file_key for upload in stale)
+    Upload.objects.filter(pk__in=[upload.pk for upload in stale]).delete()
+    return len(stale)
+
+def parse_range(header, size):
+    """
+    (start, end) of a single byte range, inclusive, or None to send the
+    whole file (no Range, or several ranges). Raises ValueError when the
+    range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+class _BoundedFile:
+    """A file read only up to `length` bytes from its current position"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size) if size > 0 else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+def serve_media(request, name):
+    """
+    Serve a file from MEDIA_ROOT. With MEDIA_ACCEL_REDIRECT (nginx) or
+    MEDIA_SENDFILE_HEADER (Apache, lighttpd) set, the front server sends
+    the bytes and answers ranges itself; otherwise a FileResponse does,
+    seeking to a single requested range. Content-addressed files and their
+    derivatives are cached forever.
+    """
+    if name.startswith(PARTS_DIR + '/'):
+        raise Http404
+    try:
+        path = default_storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+    stat = os.stat(path)
+    etag = f'"{int(stat.st_mtime)}-{stat.st_size}"'
+    if is_local_key(name):
+        etag = f'"{os.path.splitext(os.path.basename(name))[0]}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT.rstrip('/') + '/' + quote(name)
+        elif settings.MEDIA_SENDFILE_HEADER:
+            response = HttpResponse(content_type=content_type)
+            response[settings.MEDIA_SENDFILE_HEADER] = path
+        else:
+            response = _file_response(request, path, stat.st_size, content_type, etag, stat.st_mtime)
+            if response is None:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if is_content_addressed(name):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def _file_response(request, path, size, content_type, etag, mtime):
+    """FileResponse for the whole file or its requested range; None if unsatisfiable"""
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # A range against an older copy of the file gets the whole file instead
+    if header and if_range and if_range != etag and parse_http_date_safe(if_range) != int(mtime):
+        header = None
+    try:
+        byte_range = parse_range(header, size)
+    except ValueError:
+        return None
+    file = open(path, 'rb')
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type)
+    start, end = byte_range
+    file.seek(start)
+    if end == size - 1:
+        # Still a real file: the server can sendfile() it from this offset
+        response = FileResponse(file, content_type=content_type, status=206)
+    else:
+        response = FileResponse(_BoundedFile(file, end - start + 1), content_type=content_type, status=206)
+        response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,63 @@
+import random
+import uuid
+from django.contrib.auth.models import User
+from .importer import AlbumImporter
+
+# Named album shapes for benchmarks: albums x pages per album x media per page
+SHAPES = {
+    'small': (20, 5, 10),
+    'many-albums': (10000, 1, 2),
+    'deep-album': (1, 2000, 50),
+}
+
+WORDS = [
+    'beach', 'sunset', 'mountain', 'city', 'family', 'birthday', 'forest', 'river',
+    'snow', 'festival', 'garden', 'harbor', 'market', 'road', 'trip', 'wedding',
+]
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _phrase(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def generate_records(albums, pages, media, seed=0, video_ratio=0.1):
+    """
+    Yield import records (see albums.importer) for `albums` albums of `pages`
+    pages with `media` items each. The same arguments always produce the same
+    ids, titles, captions and sizes.
+    """
+    rng = random.Random(seed)
+    for a in range(albums):
+        album_id = _uuid(rng)
+        yield {
+            'type': 'album', 'id': album_id, 'title': f'{_phrase(rng, 2).title()} {a}',
+            'subtitle': _phrase(rng, 3), 'description': _phrase(rng, 12),
+            'cover_image_url': f'https://utfs.io/f/cover-{album_id}.jpg',
+            'cover_image_key': f'cover-{album_id}', 'is_public': a % 2 == 0,
+        }
+        for p in range(pages):
+            page_id = _uuid(rng)
+            yield {
+                'type': 'page', 'id': page_id, 'album_id': album_id,
+                'title': _phrase(rng, 2).title(), 'page_number': p + 1,
+            }
+            for m in range(media):
+                media_id = _uuid(rng)
+                video = rng.random() < video_ratio
+                yield {
+                    'type': 'media', 'id': media_id, 'page_id': page_id,
+                    'media_type': 'video' if video else 'image',
+                    'file_url': f"https://utfs.io/f/{media_id}.{'mp4' if video else 'jpg'}",
+                    'file_key': media_id, 'caption': _phrase(rng, 6), 'position': m,
+                    'duration': f'{rng.randint(0, 9)}:{rng.randint(0, 59):02d}' if video else '',
+                    'width': 1600, 'height': 1200,
+                    'file_size': rng.randint(50_000, 50_000_000 if video else 5_000_000),
+                }
+
+def generate(albums, pages, media, seed=0, username='synthetic', batch_size=5000):
+    """Write a generated data set through the bulk importer; returns records written"""
+    user, _ = User.objects.get_or_create(username=username)
+    importer = AlbumImporter(f'synthetic:{seed}:{albums}x{pages}x{media}', user, batch_size)
+    importer.reset()
+    return importer.run(generate_records(albums, pages, media, seed))
@@ -1,3 +1,2260 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import warnings
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F, Sum
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .cache import LRUBackend, get_shared_album_cache
+from .models import (
+    Album, AlbumPage, AlbumShare, FileDeletion, ImportCheckpoint, MediaItem, PHASH_BAND_FIELDS, SearchEntry,
+    Upload, phash_bands
+)
+from .outbox import process_batch
+from .reconcile import reconcile
+from .services import AsyncUploadThingService, UploadThingError, UploadThingService
+from .replicas import ReplicaRouter, RoutingState, _state as routing_state
+from .sqlite import WriteLock, get_write_lock
+from . import (
+    benchmark, compression, concurrency, derivatives, duplicates, imaging, metrics, renderers, stats,
+    storage, synthetic
+)
 
-# Create your tests here.
+def build_album(user, media_count, pages=10, title='Album'):
+    """Create an album whose media_count items are spread across up to `pages` pages"""
+    album = Album.objects.create(title=title, created_by=user)
+    page_count = min(pages, media_count)
+    page_objs = AlbumPage.objects.bulk_create([
+        AlbumPage(album=album, title=f'Page {n}', page_number=n)
+        for n in range(1, page_count + 1)
+    ])
+    MediaItem.objects.bulk_create([
+        MediaItem(
+            page=page_objs[i % page_count],
+            media_type='image',
+            file_url=f'https://utfs.io/f/key-{i}.jpg',
+            file_key=f'key-{i}',
+            caption=f'Caption {i}',
+            position=i // page_count,
+        )
+        for i in range(media_count)
+    ], batch_size=500)
+    # bulk_create skips the signals that maintain the counters
+    stats.recompute([album.pk])
+    return album
+
+class QueryBudgetTests(TestCase):
+    """Read endpoints must cost a fixed number of queries regardless of album size"""
+
+    SIZES = [1, 100, 10000]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+
+    def setUp(self):
+        self.client = APIClient()
+        get_shared_album_cache().backend.clear()
+
+    def assert_budget(self, url, budget):
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_album_list(self):
+        for size in self.SIZES:
+            with self.subTest(media=size):
+                build_album(self.user, size, title=f'Album {size}')
+                # albums + owner, pages, media; keyset pagination runs no COUNT
+                self.assert_budget('/api/albums/', 3)
+                # An empty fieldset means every field, tree included
+                self.assert_budget('/api/albums/?fields=', 3)
+
+    def test_album_retrieve(self):
+        for size in self.SIZES:
+            with self.subTest(media=size):
+                album = build_album(self.user, size)
+                # validators aggregate, album + owner, pages, media
+                for url in (f'/api/albums/{album.id}/', f'/api/albums/{album.id}/?fields='):
+                    response = self.assert_budget(url, 4)
+                    total = sum(len(page['items']) for page in response.data['pages'])
+                    self.assertEqual(total, size)
+
+    def test_album_pages(self):
+        for size in self.SIZES:
+            with self.subTest(media=size):
+                album = build_album(self.user, size)
+                # validators aggregate, pages, media
+                self.assert_budget(f'/api/albums/{album.id}/pages/', 3)
+
+    def test_shared_album(self):
+        for size in self.SIZES:
+            with self.subTest(media=size):
+                album = build_album(self.user, size)
+                share = AlbumShare.objects.create(album=album, share_token=f'token-{size}')
+                # share lookup, validators aggregate, album + owner, pages,
+                # media; then served from cache
+                response = self.assert_budget(f'/api/shared/{share.share_token}/', 5)
+                self.assertEqual(response.json()['id'], str(album.id))
+                self.assert_budget(f'/api/shared/{share.share_token}/', 0)
+
+    def test_shared_album_inactive(self):
+        album = build_album(self.user, 1)
+        AlbumShare.objects.create(album=album, share_token='off', is_active=False)
+        self.assertEqual(self.client.get('/api/shared/off/').status_code, 404)
+
+    def test_media_ordering_preserved(self):
+        album = build_album(self.user, 30, pages=3)
+        response = self.client.get(f'/api/albums/{album.id}/')
+        numbers = [page['page_number'] for page in response.data['pages']]
+        self.assertEqual(numbers, [1, 2, 3])
+        for page in response.data['pages']:
+            positions = [item['position'] for item in page['media_items']]
+            self.assertEqual(positions, sorted(positions))
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = build_album(cls.user, 12, pages=3)
+        build_album(cls.user, 0, title='Empty')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_summary_list_uses_annotated_counts(self):
+        # albums with owner and count subqueries; no page or media fetch
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/albums/?view=summary')
+        rows = {row['title']: row for row in response.data['results']}
+        self.assertEqual(rows['Album']['page_count'], 3)
+        self.assertEqual(rows['Album']['media_count'], 12)
+        self.assertEqual(rows['Empty']['page_count'], 0)
+        self.assertEqual(rows['Empty']['media_count'], 0)
+        self.assertNotIn('pages', rows['Album'])
+
+    def test_summary_expand_pages(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/albums/?view=summary&expand=pages')
+        rows = {row['title']: row for row in response.data['results']}
+        self.assertEqual(len(rows['Album']['pages']), 3)
+
+    def test_fields_restrict_top_level(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/albums/?fields=id,title')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+    def test_nested_fields_skip_media_prefetch(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/albums/{self.album.id}/?fields=title,pages.title')
+        self.assertEqual(response.data['pages'][0], {'title': 'Page 1'})
+
+    def test_nested_media_fields(self):
+        response = self.client.get(
+            f'/api/albums/{self.album.id}/?fields=pages.media_items.file_url'
+        )
+        page = response.data['pages'][0]
+        self.assertEqual(set(page), {'media_items'})
+        self.assertEqual(set(page['media_items'][0]), {'file_url'})
+
+    def test_default_output_unchanged(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/')
+        self.assertIn('pages', response.data)
+        self.assertIn('items', response.data['pages'][0])
+        self.assertNotIn('media_count', response.data)
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.albums = [build_album(cls.user, 0, title=f'Album {n}') for n in range(23)]
+        cls.page = AlbumPage.objects.create(album=cls.albums[0], title='Crowded', page_number=1)
+        # Many items share a position so the tie breakers have to do their job
+        MediaItem.objects.bulk_create([
+            MediaItem(page=cls.page, media_type='image', file_url=f'https://utfs.io/f/{n}',
+                      file_key=f'k{n}', position=n % 3)
+            for n in range(40)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url):
+        """Follow next links to the end, then previous links back to the start"""
+        forward, pages = [], []
+        while url:
+            data = self.client.get(url).data
+            pages.append([row['id'] for row in data['results']])
+            forward.extend(pages[-1])
+            url = data['next']
+            last = data
+        backward = list(pages[-1])
+        url = last['previous']
+        while url:
+            data = self.client.get(url).data
+            backward = [row['id'] for row in data['results']] + backward
+            url = data['previous']
+        return forward, backward
+
+    def test_albums_walk_every_row_once(self):
+        forward, backward = self.walk('/api/albums/?page_size=5')
+        expected = [str(a.id) for a in Album.objects.order_by('-created_at', '-id')]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_deep_page_costs_one_query(self):
+        url = '/api/albums/?page_size=5&fields=id'
+        for _ in range(3):
+            url = self.client.get(url).data['next']
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_media_action_pagination(self):
+        forward, backward = self.walk(f'/api/pages/{self.page.id}/media/?page_size=7')
+        expected = [str(m.id) for m in MediaItem.objects.order_by('position', 'created_at', 'id')]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_media_action_unpaginated_by_default(self):
+        response = self.client.get(f'/api/pages/{self.page.id}/media/')
+        self.assertEqual(len(response.data), 40)
+
+    def test_pages_action_pagination(self):
+        album = build_album(self.user, 9, pages=9)
+        forward, _ = self.walk(f'/api/albums/{album.id}/pages/?page_size=4')
+        self.assertEqual(forward, [str(p.id) for p in album.pages.order_by('page_number')])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/albums/?cursor=bogus').status_code, 404)
+
+    def test_ordering_on_a_nullable_column(self):
+        # Most albums have no cover; NULL sorts lowest in both directions
+        for n, album in enumerate(self.albums[:7]):
+            Album.objects.filter(pk=album.pk).update(cover_image_url=f'https://utfs.io/f/cover-{n % 3}')
+        for ordering in ('cover_image_url', '-cover_image_url'):
+            with self.subTest(ordering=ordering):
+                forward, backward = self.walk(f'/api/albums/?page_size=4&ordering={ordering}')
+                expected = [
+                    str(pk) for pk in Album.objects.order_by(
+                        F('cover_image_url').desc(nulls_last=True) if ordering.startswith('-')
+                        else F('cover_image_url').asc(nulls_first=True),
+                        '-created_at', '-id'
+                    ).values_list('id', flat=True)
+                ]
+                self.assertEqual(forward, expected)
+                self.assertEqual(backward, expected)
+
+    def test_ordering_on_related_paths_is_ignored(self):
+        expected = [str(a.id) for a in Album.objects.order_by('-created_at', '-id')]
+        for ordering in ('created_by__username', 'pages', '-shares__created_at'):
+            with self.subTest(ordering=ordering):
+                forward, backward = self.walk(f'/api/albums/?page_size=5&ordering={ordering}')
+                self.assertEqual(forward, expected)
+                self.assertEqual(backward, expected)
+        response = self.client.get('/api/media/?page_size=5&ordering=page__title')
+        self.assertEqual(response.status_code, 200)
+
+class BulkMediaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = build_album(cls.user, 2, pages=1)
+        cls.page = cls.album.pages.get()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def item(self, n, **extra):
+        return dict(media_type='image', file_url=f'https://utfs.io/f/new-{n}',
+                    file_key=f'new-{n}', **extra)
+
+    def test_bulk_insert_assigns_contiguous_positions(self):
+        items = [self.item(n) for n in range(300)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/api/pages/{self.page.id}/add_media_bulk/', items, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+        # The page lookup and one MAX(position); inserts are batched by the backend
+        selects = [q for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+        self.assertEqual(len(response.data['created']), 300)
+        positions = list(
+            self.page.media_items.filter(file_key__startswith='new-')
+            .order_by('position').values_list('position', flat=True)
+        )
+        # build_album already placed two items at positions 0 and 1
+        self.assertEqual(positions, list(range(2, 302)))
+
+    def test_invalid_items_reported_without_aborting(self):
+        items = [self.item(0), {'media_type': 'audio'}, self.item(2, position=40)]
+        response = self.client.post(
+            f'/api/pages/{self.page.id}/add_media_bulk/', {'items': items}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1])
+        self.assertEqual(response.data['created'][1]['position'], 40)
+
+    def test_all_invalid(self):
+        response = self.client.post(
+            f'/api/pages/{self.page.id}/add_media_bulk/', [{'media_type': 'x'}], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.page.media_items.count(), 2)
+
+class ReorderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_reorder_media_single_update(self):
+        album = build_album(self.user, 500, pages=1)
+        page = album.pages.get()
+        ids = [str(pk) for pk in page.media_items.values_list('id', flat=True)][::-1]
+        # page lookup, savepoint, page lock, one UPDATE, release
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                f'/api/pages/{page.id}/reorder_media/', {'media_order': ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        ordered = [str(pk) for pk in page.media_items.order_by('position').values_list('id', flat=True)]
+        self.assertEqual(ordered, ids)
+
+    def test_reorder_media_ignores_unknown_and_rejects_garbage(self):
+        album = build_album(self.user, 3, pages=1)
+        page = album.pages.get()
+        items = list(page.media_items.order_by('position'))
+        order = [str(uuid.uuid4()), str(items[2].id)]
+        self.client.post(f'/api/pages/{page.id}/reorder_media/', {'media_order': order}, format='json')
+        items[2].refresh_from_db()
+        self.assertEqual(items[2].position, 1)
+        response = self.client.post(
+            f'/api/pages/{page.id}/reorder_media/', {'media_order': ['nope']}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_reorder_pages_respects_unique_constraint(self):
+        album = build_album(self.user, 50, pages=50)
+        pages = list(album.pages.order_by('page_number'))
+        # Move the last two pages to the front; the rest keep their relative order
+        order = [str(pages[-1].id), str(pages[-2].id)]
+        # album lookup, savepoint, album lock, SELECT, two UPDATEs, release
+        with self.assertNumQueries(7):
+            response = self.client.post(
+                f'/api/albums/{album.id}/reorder_pages/', {'page_order': order}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        expected = [pages[-1].id, pages[-2].id] + [p.id for p in pages[:-2]]
+        self.assertEqual(list(album.pages.order_by('page_number').values_list('id', flat=True)), expected)
+        self.assertEqual(
+            list(album.pages.order_by('page_number').values_list('page_number', flat=True)),
+            list(range(1, 51))
+        )
+
+    def test_reorder_pages_numbered_from_zero(self):
+        album = Album.objects.create(title='Zero', created_by=self.user)
+        first = AlbumPage.objects.create(album=album, title='Zero', page_number=0)
+        second = AlbumPage.objects.create(album=album, title='One', page_number=1)
+        response = self.client.post(
+            f'/api/albums/{album.id}/reorder_pages/', {'page_order': [str(second.id), str(first.id)]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(album.pages.order_by('page_number').values_list('id', 'page_number')),
+            [(second.id, 1), (first.id, 2)]
+        )
+
+class SharedAlbumCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.cache = get_shared_album_cache()
+        self.cache.backend.clear()
+        self.album = build_album(self.user, 4, pages=2)
+        self.share = AlbumShare.objects.create(album=self.album, share_token='tok')
+        self.url = '/api/shared/tok/'
+
+    def get(self, url=None):
+        response = self.client.get(url or self.url)
+        return response, response['X-Cache']
+
+    def test_hit_after_miss(self):
+        before = self.cache.stats()
+        self.assertEqual(self.get()[1], 'MISS')
+        response, state = self.get()
+        self.assertEqual(state, 'HIT')
+        self.assertEqual(len(response.json()['pages']), 2)
+        after = self.cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def test_query_string_is_a_separate_variant(self):
+        self.get()
+        response, state = self.get(self.url + '?fields=title')
+        self.assertEqual(state, 'MISS')
+        self.assertEqual(response.json(), {'title': 'Album'})
+
+    def test_writes_invalidate(self):
+        page = self.album.pages.first()
+        writes = [
+            lambda: Album.objects.filter(pk=self.album.pk).first().save(),
+            lambda: AlbumPage.objects.create(album=self.album, title='New', page_number=9),
+            lambda: page.media_items.first().save(),
+            lambda: page.media_items.first().delete(),
+            lambda: self.client.post(
+                f'/api/pages/{page.id}/reorder_media/',
+                {'media_order': [str(m.id) for m in page.media_items.all()][::-1]}, format='json'
+            ),
+        ]
+        for write in writes:
+            self.get()
+            self.assertEqual(self.get()[1], 'HIT')
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertEqual(self.get()[1], 'MISS')
+
+    def test_bulk_paths_invalidate(self):
+        page = self.album.pages.first()
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/pages/{page.id}/add_media_bulk/', [
+                {'media_type': 'image', 'file_url': 'https://utfs.io/f/x', 'file_key': 'x'}
+            ], format='json')
+        response, state = self.get()
+        self.assertEqual(state, 'MISS')
+        self.assertEqual(sum(len(p['items']) for p in response.json()['pages']), 5)
+
+    def test_deactivated_share_stops_serving(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.share.is_active = False
+            self.share.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        SHARED_ALBUM_CACHE={'BACKEND': 'albums.cache.DjangoCacheBackend'},
+    )
+    def test_keys_are_safe_for_memcached(self):
+        AlbumShare.objects.create(album=self.album, share_token='t' * 300)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            for url in (self.url, '/api/shared/' + 't' * 300 + '/'):
+                response = self.client.get(url, HTTP_ACCEPT='application/json; version=2')
+                self.assertEqual(response['X-Cache'], 'MISS')
+                response = self.client.get(url, HTTP_ACCEPT='application/json; version=2')
+                self.assertEqual(response['X-Cache'], 'HIT')
+                self.assertNotIn('items', response.json()['pages'][0])
+
+    def test_lru_entries_expire(self):
+        backend = LRUBackend(max_bytes=100, timeout=10)
+        with patch('albums.cache.time.monotonic', return_value=1000.0):
+            backend.set('a', b'x' * 40)
+        with patch('albums.cache.time.monotonic', return_value=1009.0):
+            self.assertEqual(backend.get('a'), b'x' * 40)
+        with patch('albums.cache.time.monotonic', return_value=1010.0):
+            self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.size, 0)
+
+    def test_default_backend_bounds_staleness(self):
+        self.assertIsNotNone(self.cache.backend.timeout)
+
+    def test_lru_evicts_by_size(self):
+        backend = LRUBackend(max_bytes=100)
+        backend.set('a', b'x' * 40)
+        backend.set('b', b'x' * 40)
+        backend.get('a')
+        backend.set('c', b'x' * 40)
+        self.assertIsNone(backend.get('b'))
+        self.assertIsNotNone(backend.get('a'))
+        self.assertEqual(backend.evictions, 1)
+        self.assertLessEqual(backend.size, 100)
+
+class PageWindowTests(TestCase):
+    """Page skeletons and windows of full pages for very large albums"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = build_album(cls.user, 90, pages=30)
+        AlbumShare.objects.create(album=cls.album, share_token='windows')
+
+    def setUp(self):
+        self.client = APIClient()
+        get_shared_album_cache().backend.clear()
+        self.url = f'/api/albums/{self.album.id}/pages/'
+
+    def test_skeletons_list_every_page_without_media(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'view': 'skeleton'})
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(response.data[0]['page_number'], 1)
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'page_number', 'media_count'})
+        self.assertEqual(sum(page['media_count'] for page in response.data), 90)
+
+        response = self.client.get(f'/api/albums/{self.album.id}/', {'view': 'skeleton'})
+        self.assertEqual(response.data['page_count'], 30)
+        self.assertNotIn('items', response.data['pages'][0])
+        response = self.client.get('/api/shared/windows/', {'view': 'skeleton'})
+        self.assertEqual(len(response.json()['pages']), 30)
+
+    def test_skeletons_ignore_window_validators(self):
+        params = {'view': 'skeleton', 'from': 1, 'to': 2}
+        etag = self.client.get(self.url, params)['ETag']
+        page = self.album.pages.get(page_number=5)
+        page.title = 'Renamed'
+        page.save()
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[4]['title'], 'Renamed')
+
+    def test_window_costs_the_same_at_any_size(self):
+        for first, last in [(1, 1), (1, 50), (11, 20)]:
+            with self.subTest(window=(first, last)):
+                # validators aggregate, page-number bounds, pages, media
+                with self.assertNumQueries(4):
+                    response = self.client.get(self.url, {'from': first, 'to': last})
+                numbers = [page['page_number'] for page in response.data['results']]
+                self.assertEqual(numbers, list(range(first, min(last, 30) + 1)))
+                self.assertTrue(all(len(page['items']) == 3 for page in response.data['results']))
+
+    def test_neighbouring_windows_are_linked(self):
+        response = self.client.get(self.url, {'from': 11})
+        self.assertEqual((response.data['from'], response.data['to']), (11, 20))
+        self.assertEqual(response.data['last_page_number'], 30)
+        self.assertIn('from=21', response.data['next'])
+        self.assertIn('to=30', response.data['next'])
+        self.assertIn('from=1', response.data['previous'])
+        self.assertIn('to=10', response.data['previous'])
+        self.assertIn('rel="next"', response['Link'])
+        self.assertIn('rel="prev"', response['Link'])
+
+        last = self.client.get(response.data['next'])
+        self.assertEqual(len(last.data['results']), 10)
+        self.assertIsNone(last.data['next'])
+        self.assertIsNone(self.client.get(self.url, {'from': 1}).data['previous'])
+
+        shared = self.client.get('/api/shared/windows/pages/', {'from': 11})
+        self.assertEqual(
+            [page['id'] for page in shared.data['results']],
+            [page['id'] for page in response.data['results']]
+        )
+
+    def test_window_etag_ignores_media_on_other_pages(self):
+        etag = self.client.get(self.url, {'from': 1, 'to': 10})['ETag']
+        page = self.album.pages.get(page_number=20)
+        self.client.post(f'/api/pages/{page.id}/add_media/', {
+            'media_type': 'image', 'file_url': 'https://utfs.io/f/late.jpg', 'file_key': 'late',
+        }, format='json')
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'from': 1, 'to': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        page = self.album.pages.get(page_number=5)
+        self.client.post(f'/api/pages/{page.id}/add_media/', {
+            'media_type': 'image', 'file_url': 'https://utfs.io/f/near.jpg', 'file_key': 'near',
+        }, format='json')
+        response = self.client.get(self.url, {'from': 1, 'to': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results'][4]['items']), 4)
+
+    def test_rejects_bad_windows(self):
+        for params in [{'from': 'x'}, {'from': 5, 'to': 4}, {'from': 1, 'to': 51}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(self.client.get(f'/api/albums/{uuid.uuid4()}/pages/', {'from': 1}).status_code, 404)
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+
+    def setUp(self):
+        self.client = APIClient()
+        get_shared_album_cache().backend.clear()
+        self.album = build_album(self.user, 6, pages=2)
+        self.page = self.album.pages.order_by('page_number').first()
+        AlbumShare.objects.create(album=self.album, share_token='cond')
+
+    def urls(self):
+        """Each URL with the queries a matching If-None-Match should cost"""
+        return [
+            (f'/api/albums/{self.album.id}/', 1),  # validators aggregate
+            (f'/api/albums/{self.album.id}/pages/', 1),
+            (f'/api/pages/{self.page.id}/media/', 2),  # page lookup + aggregate
+            ('/api/shared/cond/', 0),  # cached validators
+        ]
+
+    def test_if_none_match_skips_serialization(self):
+        for url, budget in self.urls():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(budget):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        for url, _ in self.urls():
+            with self.subTest(url=url):
+                last_modified = self.client.get(url)['Last-Modified']
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(response.status_code, 304)
+
+    def test_shared_cache_hit_answers_304_without_queries(self):
+        etag = self.client.get('/api/shared/cond/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/shared/cond/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_child_changes_change_the_etag(self):
+        url = f'/api/albums/{self.album.id}/'
+        media = self.page.media_items.first()
+        changes = [
+            lambda: MediaItem.objects.filter(pk=media.pk).update(caption='edited',
+                                                                 updated_at=timezone.now()),
+            lambda: self.client.delete(f'/api/media/{media.id}/'),
+            lambda: AlbumPage.objects.filter(pk=self.page.pk).update(title='x',
+                                                                    updated_at=timezone.now()),
+        ]
+        for change in changes:
+            etag = self.client.get(url)['ETag']
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_variants_have_distinct_etags(self):
+        url = f'/api/albums/{self.album.id}/'
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(url + '?fields=id')['ETag'])
+
+class StubUploadThing:
+    """
+    Local HTTP server standing in for the UploadThing API. `responses` is a
+    queue of (status, payload) tuples served in order, falling back to 200.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.delay = 0
+        # Most requests seen in flight at once
+        self.peak = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with stub._lock:
+                    stub.requests.append((self.command, self.path, body, self.client_address[1]))
+                    stub._active += 1
+                    stub.peak = max(stub.peak, stub._active)
+                    status, payload = stub.responses.pop(0) if stub.responses else (200, {'success': True})
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+                with stub._lock:
+                    stub._active -= 1
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up, e.g. after a read timeout
+
+            do_GET = do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class UploadThingServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubUploadThing()
+        self.addCleanup(self.stub.stop)
+        self.service = UploadThingService(
+            base_url=self.stub.url, backoff_factor=0, delete_batch_size=100
+        )
+        self.addCleanup(self.service.close)
+
+    def test_delete_files_batches_keys(self):
+        keys = [f'key-{n}' for n in range(250)]
+        self.service.delete_files(keys)
+        batches = [body['fileKeys'] for _, path, body, _ in self.stub.requests]
+        self.assertEqual([len(batch) for batch in batches], [100, 100, 50])
+        self.assertEqual(sum(batches, []), keys)
+
+    def test_connections_are_kept_alive(self):
+        for n in range(5):
+            self.service.get_file_info(f'key-{n}')
+        ports = {port for *_, port in self.stub.requests}
+        self.assertEqual(len(ports), 1)
+
+    def test_retries_transient_failures(self):
+        self.stub.responses = [(503, {}), (429, {}), (200, {'success': True})]
+        self.assertEqual(self.service.delete_file('k'), {'success': True})
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_gives_up_after_bounded_retries(self):
+        self.stub.responses = [(500, {})] * 10
+        with self.assertRaises(UploadThingError):
+            self.service.list_files()
+        # the first attempt plus UPLOADTHING_MAX_RETRIES
+        self.assertEqual(len(self.stub.requests), 4)
+
+    def test_client_errors_are_not_retried(self):
+        self.stub.responses = [(404, {'error': 'missing'})]
+        with self.assertRaises(UploadThingError):
+            self.service.get_file_info('k')
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_read_timeout(self):
+        self.stub.delay = 0.5
+        service = UploadThingService(base_url=self.stub.url, timeout=(1, 0.1), max_retries=0)
+        self.addCleanup(service.close)
+        with self.assertRaises(UploadThingError):
+            service.get_file_info('k')
+
+    def test_list_files_window(self):
+        self.service.list_files(limit=500, offset=1000)
+        self.assertEqual(self.stub.requests[0][1], '/api/listFiles?limit=500&offset=1000')
+
+    def test_async_fan_out_is_bounded(self):
+        self.stub.delay = 0.1
+        client = AsyncUploadThingService(self.service, concurrency=4)
+        self.addCleanup(client.close)
+        infos = asyncio.run(client.get_file_infos(f'key-{n}' for n in range(16)))
+        self.assertEqual(len(infos), 16)
+        self.assertEqual(len(self.stub.requests), 16)
+        self.assertGreater(self.stub.peak, 1)
+        self.assertLessEqual(self.stub.peak, 4)
+
+    def test_async_failures_are_returned_per_key(self):
+        self.stub.responses = [(404, {'error': 'missing'})]
+        client = AsyncUploadThingService(self.service, concurrency=2)
+        self.addCleanup(client.close)
+        infos = asyncio.run(client.get_file_infos(['a', 'b', 'c']))
+        errors = [key for key, info in infos.items() if isinstance(info, UploadThingError)]
+        self.assertEqual(len(errors), 1)
+
+    def test_async_delete_files_sends_batches_concurrently(self):
+        self.stub.delay = 0.1
+        client = AsyncUploadThingService(self.service, concurrency=3)
+        self.addCleanup(client.close)
+        keys = [f'key-{n}' for n in range(250)]
+        responses = asyncio.run(client.delete_files(keys))
+        self.assertEqual(len(responses), 3)
+        batches = sorted(body['fileKeys'] for _, _, body, _ in self.stub.requests)
+        self.assertEqual(sorted(sum(batches, [])), sorted(keys))
+        self.assertEqual(self.stub.peak, 3)
+
+class FileDeletionOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.album = build_album(self.user, 6, pages=2)
+        Album.objects.filter(pk=self.album.pk).update(cover_image_key='cover')
+        self.album.refresh_from_db()
+
+    def queued(self):
+        return sorted(FileDeletion.objects.values_list('file_key', flat=True))
+
+    def test_api_delete_queues_without_remote_call(self):
+        media = MediaItem.objects.filter(page__album=self.album).first()
+        response = self.client.delete(f'/api/media/{media.id}/delete_from_uploadthing/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.queued(), [media.file_key])
+
+    def test_album_cascade_queues_every_key_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.delete(f'/api/albums/{self.album.id}/')
+        self.assertEqual(self.queued(), sorted([f'key-{n}' for n in range(6)] + ['cover']))
+        inserts = [q for q in queries.captured_queries
+                   if q['sql'].startswith('INSERT INTO "albums_filedeletion"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_page_cascade(self):
+        page = self.album.pages.order_by('page_number').first()
+        keys = sorted(page.media_items.values_list('file_key', flat=True))
+        self.client.delete(f'/api/pages/{page.id}/')
+        self.assertEqual(self.queued(), keys)
+
+    def test_replaced_keys_are_queued(self):
+        self.client.patch(f'/api/albums/{self.album.id}/', {'cover_image_key': 'cover-2'}, format='json')
+        media = MediaItem.objects.filter(page__album=self.album).first()
+        self.client.patch(f'/api/media/{media.id}/', {'caption': 'same file'}, format='json')
+        self.client.patch(f'/api/media/{media.id}/', {'file_key': 'swapped'}, format='json')
+        self.assertEqual(self.queued(), sorted(['cover', media.file_key]))
+
+@override_settings(UPLOADTHING_MAX_RETRIES=0, UPLOADTHING_BACKOFF_FACTOR=0)
+class FileDeletionWorkerTests(TestCase):
+    def setUp(self):
+        self.stub = StubUploadThing()
+        self.addCleanup(self.stub.stop)
+        self.service = UploadThingService(base_url=self.stub.url, delete_batch_size=2)
+        self.addCleanup(self.service.close)
+        self.user = User.objects.create(username='owner')
+
+    def test_drains_in_batched_calls(self):
+        FileDeletion.objects.bulk_create([FileDeletion(file_key=f'k{n}') for n in range(5)])
+        stats = process_batch(self.service, batch_size=10)
+        self.assertEqual(stats['deleted'], 5)
+        self.assertEqual([len(body['fileKeys']) for _, _, body, _ in self.stub.requests], [2, 2, 1])
+        self.assertFalse(FileDeletion.objects.exists())
+
+    def test_still_referenced_keys_are_skipped(self):
+        build_album(self.user, 1)
+        FileDeletion.objects.create(file_key='key-0')
+        stats = process_batch(self.service)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(self.stub.requests, [])
+        self.assertFalse(FileDeletion.objects.exists())
+
+    def test_failures_back_off_then_dead_letter(self):
+        row = FileDeletion.objects.create(file_key='k')
+        for attempt in range(1, 4):
+            self.stub.responses = [(500, {})]
+            FileDeletion.objects.filter(pk=row.pk).update(next_attempt_at=timezone.now())
+            stats = process_batch(self.service, max_attempts=3)
+            row.refresh_from_db()
+            self.assertEqual(row.attempts, attempt)
+        self.assertEqual(stats['dead'], 1)
+        self.assertEqual(row.status, 'dead')
+        # dead letters are never claimed again
+        self.assertEqual(process_batch(self.service)['claimed'], 0)
+
+    def test_backoff_hides_row_until_due(self):
+        FileDeletion.objects.create(file_key='k')
+        self.stub.responses = [(500, {})]
+        process_batch(self.service)
+        self.assertEqual(process_batch(self.service)['claimed'], 0)
+
+class FakeListing:
+    """list_files() over an in-memory list of remote file dicts"""
+
+    def __init__(self, files):
+        self.files = files
+        self.calls = 0
+
+    def list_files(self, limit=None, offset=None):
+        self.calls += 1
+        window = self.files[offset:offset + limit]
+        return {'files': window, 'hasMore': offset + limit < len(self.files)}
+
+class ReconcileStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.album = build_album(self.user, 5, pages=1)
+        Album.objects.filter(pk=self.album.pk).update(cover_image_key='cover')
+        old = 1_600_000_000_000
+        # key-3 and key-4 are missing remotely; stray-* are orphans, one too new to judge
+        self.files = [{'key': f'key-{n}', 'uploadedAt': old} for n in range(3)] + [
+            {'key': 'cover', 'uploadedAt': old},
+            {'key': 'stray-1', 'uploadedAt': old},
+            {'key': 'stray-2'},
+            {'key': 'fresh', 'uploadedAt': int(timezone.now().timestamp() * 1000)},
+        ]
+
+    def test_diff(self):
+        orphans, missing = [], []
+        listing = FakeListing(self.files)
+        stats = reconcile(
+            listing, orphans.extend, lambda kind, rows: missing.extend((kind, key) for _, key in rows),
+            page_size=2, chunk_size=2,
+        )
+        self.assertEqual(sorted(orphans), ['stray-1', 'stray-2'])
+        self.assertEqual(sorted(missing), [('media', 'key-3'), ('media', 'key-4')])
+        self.assertEqual(stats['remote'], 7)
+        self.assertEqual(stats['too_new'], 1)
+        self.assertEqual(listing.calls, 4)
+
+    def test_command_report_and_purge(self):
+        out = StringIO()
+        with patch('albums.management.commands.reconcile_storage.get_uploadthing_service',
+                   return_value=FakeListing(self.files)):
+            call_command('reconcile_storage', '--purge', '--page-size=3', stdout=out, stderr=StringIO())
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            sorted(line['key'] for line in lines if line['type'] == 'orphaned_remote'),
+            ['stray-1', 'stray-2']
+        )
+        self.assertEqual(
+            sorted(line['key'] for line in lines if line['type'] == 'missing_remote'),
+            ['key-3', 'key-4']
+        )
+        self.assertEqual(sorted(FileDeletion.objects.values_list('file_key', flat=True)),
+                         ['stray-1', 'stray-2'])
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = Album.objects.create(title='Beach Holiday', description='Sun and sand',
+                                         created_by=cls.user)
+        cls.other = Album.objects.create(title='Mountains', created_by=cls.user)
+        cls.page = AlbumPage.objects.create(album=cls.other, title='Beach detour', page_number=1)
+        cls.media = MediaItem.objects.create(page=cls.page, media_type='image', file_url='https://utfs.io/f/a',
+                                             file_key='a', caption='Sunset over the beach')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def hits(self, query, **params):
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_hits_across_models(self):
+        results = self.hits('beach')['results']
+        self.assertEqual({r['type'] for r in results}, {'album', 'page', 'media'})
+        # title matches outrank caption matches
+        self.assertEqual(results[-1]['type'], 'media')
+        self.assertIn('[beach]', results[-1]['snippet'].lower())
+
+    def test_prefix_and_all_tokens(self):
+        self.assertEqual([r['id'] for r in self.hits('sun beac', type='media')['results']],
+                         [self.media.id])
+        self.assertEqual(self.hits('beach zebra')['results'], [])
+
+    def test_user_input_is_not_fts_syntax(self):
+        self.assertEqual(len(self.hits('"beach*" (')['results']), 3)
+        self.assertEqual(self.hits('***')['results'], [])
+
+    def test_incremental_updates(self):
+        self.media.caption = 'Lighthouse at dusk'
+        self.media.save()
+        self.assertEqual(self.hits('sunset')['results'], [])
+        self.assertEqual(len(self.hits('lighthouse')['results']), 1)
+        self.page.delete()
+        self.assertEqual(self.hits('lighthouse')['results'], [])
+        self.assertEqual(self.hits('detour')['results'], [])
+        self.client.post(f'/api/albums/{self.album.id}/add_page/', {'title': 'Harbour', 'page_number': 1}, format='json')
+        page = self.album.pages.get(title='Harbour')
+        self.client.post(f'/api/pages/{page.id}/add_media_bulk/', [
+            {'media_type': 'image', 'file_url': 'https://utfs.io/f/b', 'file_key': 'b', 'caption': 'Harbour seals'}
+        ], format='json')
+        self.assertEqual({r['type'] for r in self.hits('harbour')['results']}, {'page', 'media'})
+
+    def test_pagination(self):
+        for n in range(5):
+            MediaItem.objects.create(page=self.page, media_type='image', file_url='https://utfs.io/f/x',
+                                     file_key=f'x{n}', caption=f'Tide pool {n}')
+        first = self.hits('tide', page_size=2)
+        self.assertEqual(len(first['results']), 2)
+        self.assertIsNone(first['previous'])
+        last = self.client.get(first['next']).data
+        last = self.client.get(last['next']).data
+        self.assertEqual(len(last['results']), 1)
+        self.assertIsNone(last['next'])
+
+    def test_rebuild_command(self):
+        SearchEntry.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.hits('beach')['results']), 3)
+
+    def test_invalid_type(self):
+        response = self.client.get('/api/search/', {'q': 'x', 'type': 'user'})
+        self.assertEqual(response.status_code, 400)
+
+class AlbumStatsTests(TestCase):
+    """Denormalized counters follow every write path and can be rebuilt"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.album = Album.objects.create(title='Trip', created_by=self.user)
+        self.page = AlbumPage.objects.create(album=self.album, title='Day 1', page_number=1)
+
+    def media(self, page=None, **kwargs):
+        data = dict(page=page or self.page, media_type='image', file_url='https://utfs.io/f/a.jpg',
+                    file_key=f'key-{uuid.uuid4()}', file_size=100)
+        data.update(kwargs)
+        return MediaItem.objects.create(**data)
+
+    def counters(self, obj):
+        obj.refresh_from_db()
+        return {name: getattr(obj, name) for name in type(obj).STATS_FIELDS}
+
+    def test_single_writes(self):
+        self.media()
+        video = self.media(media_type='video', duration='1:05', file_size=1000)
+        self.assertEqual(self.counters(self.album), {
+            'image_count': 1, 'video_count': 1, 'total_file_size': 1100,
+            'video_seconds': 65, 'page_count': 1,
+        })
+        video.media_type = 'image'
+        video.file_size = 50
+        video.save()
+        self.assertEqual(self.counters(self.page), {
+            'image_count': 2, 'video_count': 0, 'total_file_size': 150, 'video_seconds': 0,
+        })
+        video.delete()
+        self.assertEqual(self.counters(self.page)['total_file_size'], 100)
+        self.assertEqual(self.counters(self.album)['image_count'], 1)
+
+    def test_moving_media_between_pages(self):
+        other = AlbumPage.objects.create(album=self.album, title='Day 2', page_number=2)
+        item = self.media()
+        item.page = other
+        item.save()
+        self.assertEqual(self.counters(self.page)['image_count'], 0)
+        self.assertEqual(self.counters(other)['image_count'], 1)
+        self.assertEqual(self.counters(self.album)['image_count'], 1)
+
+    def test_bulk_add(self):
+        items = [{'media_type': 'video', 'file_url': 'https://utfs.io/f/v.mp4', 'file_key': f'v{i}',
+                  'duration': '0:30', 'file_size': 10} for i in range(5)]
+        response = self.client.post(f'/api/pages/{self.page.pk}/add_media_bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.counters(self.album), {
+            'image_count': 0, 'video_count': 5, 'total_file_size': 50,
+            'video_seconds': 150, 'page_count': 1,
+        })
+
+    def test_page_cascade(self):
+        other = AlbumPage.objects.create(album=self.album, title='Day 2', page_number=2)
+        self.media()
+        self.media(page=other)
+        self.media(page=other)
+        other.delete()
+        self.assertEqual(self.counters(self.album), {
+            'image_count': 1, 'video_count': 0, 'total_file_size': 100,
+            'video_seconds': 0, 'page_count': 1,
+        })
+
+    def test_save_does_not_overwrite_counters(self):
+        stale = Album.objects.get(pk=self.album.pk)
+        self.media()
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counters(self.album)['image_count'], 1)
+
+    def test_recompute_command_repairs_drift(self):
+        self.media()
+        self.media(media_type='video', duration='2:00')
+        Album.objects.filter(pk=self.album.pk).update(image_count=40, page_count=0)
+        AlbumPage.objects.filter(pk=self.page.pk).update(video_seconds=7)
+        call_command('recompute_album_stats', '--batch-size=1', stdout=StringIO())
+        self.assertEqual(self.counters(self.album), {
+            'image_count': 1, 'video_count': 1, 'total_file_size': 200,
+            'video_seconds': 120, 'page_count': 1,
+        })
+        self.assertEqual(self.counters(self.page)['video_seconds'], 120)
+
+    def test_summary_reads_counters(self):
+        self.media()
+        response = self.client.get('/api/albums/', {'view': 'summary'})
+        album = response.data['results'][0]
+        self.assertEqual((album['page_count'], album['media_count'], album['total_file_size']), (1, 1, 100))
+
+class ExportTests(TestCase):
+    """Exports stream from chunked iterators with a fixed number of queries"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.client = APIClient()
+
+    def export(self, album, **params):
+        response = self.client.get(f'/api/albums/{album.id}/export/', params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_json_manifest_matches_tree(self):
+        album = build_album(self.user, 25, pages=4)
+        AlbumPage.objects.create(album=album, title='Empty', page_number=5)
+        response, body = self.export(album)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn(f'album-{album.id}.json', response['Content-Disposition'])
+        document = json.loads(body)
+        self.assertEqual(document['page_count'], 5)
+        self.assertEqual([page['page_number'] for page in document['pages']], [1, 2, 3, 4, 5])
+        for page in album.pages.with_media():
+            exported = next(p for p in document['pages'] if p['id'] == str(page.id))
+            self.assertEqual(
+                [item['id'] for item in exported['media_items']],
+                [str(item.id) for item in page.media_items.all()]
+            )
+
+    def test_ndjson_records(self):
+        album = build_album(self.user, 12, pages=3)
+        response, body = self.export(album, output='ndjson')
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([r['type'] for r in records[:2]], ['album', 'page'])
+        self.assertEqual(sum(r['type'] == 'media' for r in records), 12)
+        self.assertEqual(sum(r['type'] == 'page' for r in records), 3)
+
+    def test_query_count_is_independent_of_size(self):
+        for size in (1, 2000):
+            album = build_album(self.user, size)
+            with self.assertNumQueries(3):
+                self.export(album, output='ndjson')
+
+    def test_zip_packages_local_files(self):
+        album = build_album(self.user, 3, pages=1)
+        name = storage.content_name('ab' * 32, 'photo.jpg')
+        MediaItem.objects.filter(file_key='key-1').update(file_key=name)
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            default_storage.save(name, ContentFile(b'x' * 200000))
+            response, body = self.export(album, output='zip')
+        archive = zipfile.ZipFile(BytesIO(body))
+        entry = f"files/1/1-{name.replace('/', '_')}"
+        self.assertEqual(archive.namelist(), ['album.json', entry])
+        self.assertEqual(len(archive.read(entry)), 200000)
+        self.assertEqual(len(json.loads(archive.read('album.json'))['pages'][0]['media_items']), 3)
+
+    def test_zip_skips_keys_outside_finished_uploads(self):
+        album = build_album(self.user, 4, pages=1)
+        upload = Upload.objects.create(filename='partial.jpg', size=10)
+        keys = [
+            '../../../etc/passwd', f'{storage.PARTS_DIR}/{upload.pk}.part',
+            f'{storage.LOCAL_KEY_PREFIX}../{storage.PARTS_DIR}/{upload.pk}.part', 'cas/missing.jpg',
+        ]
+        for index, key in enumerate(keys):
+            MediaItem.objects.filter(file_key=f'key-{index}').update(file_key=key)
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            storage.append_chunk(upload, 0, BytesIO(b'half'), 4)
+            response, body = self.export(album, output='zip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(zipfile.ZipFile(BytesIO(body)).namelist(), ['album.json'])
+
+    def test_shared_export_and_errors(self):
+        album = build_album(self.user, 2, pages=1)
+        AlbumShare.objects.create(album=album, share_token='tok')
+        response = self.client.get('/api/shared/tok/export/', {'output': 'ndjson'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+        self.assertEqual(self.client.get('/api/shared/nope/export/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/albums/{album.id}/export/?output=xml').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/albums/{uuid.uuid4()}/export/').status_code, 404)
+
+class ImportAlbumsTests(TestCase):
+    """import_albums bulk loads records, keeps derived data right and resumes"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, lines):
+        path = f'{self.directory.name}/{name}'
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def records(self, albums=2, pages=3, media=4):
+        for a in range(albums):
+            yield {'type': 'album', 'id': f'a{a}', 'title': f'Legacy {a}', 'created_by_username': 'legacy'}
+            for p in range(pages):
+                yield {'type': 'page', 'id': f'a{a}p{p}', 'album_id': f'a{a}', 'title': f'P{p}', 'page_number': p + 1}
+                for m in range(media):
+                    yield {
+                        'type': 'media', 'id': f'a{a}p{p}m{m}', 'page_id': f'a{a}p{p}',
+                        'media_type': 'video' if m == 0 else 'image', 'duration': '0:10',
+                        'file_url': 'https://utfs.io/f/x.jpg', 'file_key': f'k{a}{p}{m}',
+                        'caption': f'sunset {m}', 'position': m, 'file_size': 10,
+                    }
+
+    def run_import(self, path, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_albums', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue() + stderr.getvalue()
+
+    def test_ndjson_import(self):
+        path = self.write('legacy.ndjson', [json.dumps(r) for r in self.records()])
+        with CaptureQueriesContext(connection) as queries:
+            output = self.run_import(path, '--batch-size=10')
+        self.assertIn('rows/s', output)
+        self.assertEqual(Album.objects.count(), 2)
+        self.assertEqual(MediaItem.objects.count(), 24)
+        # Inserts never read their own rows back
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "albums_album"' in q['sql']])
+        album = Album.objects.get(title='Legacy 1')
+        self.assertEqual(album.created_by.username, 'legacy')
+        self.assertEqual(
+            (album.page_count, album.image_count, album.video_count, album.total_file_size, album.video_seconds),
+            (3, 9, 3, 120, 30)
+        )
+        self.assertEqual(SearchEntry.objects.filter(kind='media', album=album).count(), 12)
+        self.assertEqual(album.pages.get(page_number=2).image_count, 3)
+
+    def test_csv_import(self):
+        header = 'type,id,album_id,page_id,title,page_number,media_type,file_url,file_key,position,is_public'
+        path = self.write('legacy.csv', [
+            header,
+            'album,1,,,From CSV,,,,,,true',
+            'page,1,1,,Cover,1,,,,,',
+            'media,1,,1,,,image,https://utfs.io/f/c.jpg,c1,0,',
+        ])
+        self.run_import(path)
+        album = Album.objects.get(title='From CSV')
+        self.assertTrue(album.is_public)
+        self.assertEqual(album.created_by.username, 'anonymous')
+        self.assertEqual(album.pages.get().media_items.get().file_key, 'c1')
+
+    def test_resume_after_failure(self):
+        lines = [json.dumps(r) for r in self.records(albums=3, pages=1, media=5)]
+        broken = list(lines)
+        broken[9] = json.dumps({'type': 'media', 'page_id': 'nowhere', 'file_url': 'x', 'file_key': 'x'})
+        path = self.write('legacy.ndjson', broken)
+        with self.assertRaisesMessage(CommandError, 'record 10'):
+            self.run_import(path, '--batch-size=4')
+        # Two full batches are committed, the failing one is rolled back
+        self.assertEqual(ImportCheckpoint.objects.get().records, 8)
+        self.assertEqual(MediaItem.objects.count(), 5)
+
+        self.write('legacy.ndjson', lines)
+        output = self.run_import(path, '--batch-size=4')
+        self.assertIn('Resuming', output)
+        self.assertEqual(MediaItem.objects.count(), 15)
+        self.assertEqual(Album.objects.get(title='Legacy 1').image_count, 4)
+
+    def test_export_round_trip(self):
+        user = User.objects.create(username='owner')
+        album = build_album(user, 30, pages=3)
+        body = b''.join(self.client.get(f'/api/albums/{album.id}/export/?output=ndjson').streaming_content)
+        album_id = album.pk
+        expected = Album.objects.filter(pk=album_id).values(*Album.STATS_FIELDS).get()
+        album.delete()
+        path = self.write('export.ndjson', body.decode().splitlines())
+        self.run_import(path)
+        self.assertEqual(Album.objects.filter(pk=album_id).values(*Album.STATS_FIELDS).get(), expected)
+        self.assertEqual(Album.objects.get(pk=album_id).created_by, user)
+
+class BenchmarkTests(TestCase):
+    """The synthetic generator is deterministic and the harness covers the router"""
+
+    def test_generator_is_deterministic(self):
+        first = list(synthetic.generate_records(2, 3, 4, seed=7))
+        self.assertEqual(first, list(synthetic.generate_records(2, 3, 4, seed=7)))
+        self.assertNotEqual(first, list(synthetic.generate_records(2, 3, 4, seed=8)))
+        self.assertEqual(len(first), 2 + 2 * 3 + 2 * 3 * 4)
+
+    def test_generate_loads_shape(self):
+        synthetic.generate(2, 3, 4, seed=1)
+        self.assertEqual(
+            Album.objects.aggregate(pages=Sum('page_count'), media=Sum('image_count') + Sum('video_count')),
+            {'pages': 6, 'media': 24}
+        )
+
+    def test_report_covers_every_endpoint(self):
+        synthetic.generate(2, 2, 3)
+        report = benchmark.run(iterations=2, warmup=0)
+        self.assertEqual(report['uncovered'], [])
+        self.assertEqual(report['meta']['media'], 12)
+        detail = report['endpoints']['album-detail']
+        self.assertEqual((detail['status'], detail['queries']), (200, 4))
+        self.assertLessEqual(detail['p50_ms'], detail['p99_ms'])
+        # Writes are rolled back between iterations
+        self.assertEqual(report['endpoints']['album-destroy']['status'], 204)
+        self.assertEqual(Album.objects.count(), 2)
+
+    def test_compare_flags_regressions(self):
+        def endpoint(p95, queries, status=200):
+            return {'status': status, 'p95_ms': p95, 'queries': queries, 'peak_kib': 100}
+        baseline = {'endpoints': {'a': endpoint(10, 3), 'b': endpoint(10, 3), 'c': endpoint(0.1, 1)}}
+        report = {'endpoints': {'a': endpoint(12, 3), 'b': endpoint(20, 4), 'c': endpoint(0.5, 1, 500)}}
+        self.assertEqual(benchmark.compare(report, baseline), [
+            'b: queries 3 -> 4', 'b: p95_ms 10 -> 20', 'c: status 200 -> 500',
+        ])
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsTests(TestCase):
+    """Per-route request, latency, query and byte metrics in Prometheus format"""
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.user = User.objects.create(username='owner')
+        self.album = build_album(self.user, 20, pages=2)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_records_route_queries_and_bytes(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/')
+        body = self.scrape()
+        labels = 'route="AlbumViewSet.retrieve",method="GET"'
+        self.assertIn(f'album_http_requests_total{{{labels},status="200"}} 1', body)
+        self.assertIn(f'album_db_queries_per_request_sum{{{labels}}} 4', body)
+        self.assertIn(f'album_db_queries_per_request_bucket{{{labels},le="3"}} 0', body)
+        self.assertIn(f'album_db_queries_per_request_bucket{{{labels},le="5"}} 1', body)
+        self.assertIn(f'album_http_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'album_http_response_bytes_total{{{labels}}} {len(response.content)}', body)
+
+    def test_streamed_responses_are_recorded_on_close(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/export/')
+        self.assertNotIn('AlbumViewSet.export', self.scrape())
+        size = len(b''.join(response.streaming_content))
+        body = self.scrape()
+        labels = 'route="AlbumViewSet.export",method="GET"'
+        self.assertIn(f'album_db_queries_per_request_sum{{{labels}}} 3', body)
+        self.assertIn(f'album_http_response_bytes_total{{{labels}}} {size}', body)
+
+    def test_shared_album_cache_counters(self):
+        get_shared_album_cache().backend.clear()
+        before = get_shared_album_cache().stats()
+        AlbumShare.objects.create(album=self.album, share_token='scraped')
+        self.client.get('/api/shared/scraped/')
+        self.client.get('/api/shared/scraped/')
+        body = self.scrape()
+        self.assertIn(f"album_shared_cache_hits_total {before['hits'] + 1}", body)
+        self.assertIn(f"album_shared_cache_misses_total {before['misses'] + 1}", body)
+        self.assertIn('# TYPE album_shared_cache_bytes gauge', body)
+
+    def test_unmatched_and_queries_outside_requests(self):
+        self.client.get('/nowhere/')
+        Album.objects.count()
+        body = self.scrape()
+        self.assertIn('route="unmatched",method="GET",status="404"', body)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_SLOW_QUERY_COUNT=2)
+    def test_slow_requests_log_their_slowest_queries(self):
+        with self.assertLogs('albums.metrics', 'WARNING') as logs:
+            self.client.get(f'/api/albums/{self.album.id}/')
+        self.assertIn('AlbumViewSet.retrieve', logs.output[0])
+        self.assertEqual(logs.output[0].count('ms SELECT'), 2)
+
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(
+            self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+        )
+        self.assertIn('# TYPE', self.scrape())
+
+    @override_settings(METRICS_TOKEN='')
+    def test_closed_without_token_unless_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_streams_closed_early_are_recorded_once(self):
+        recorded = []
+        stream = metrics.CountedStream(iter([b'abc', b'de']), metrics.RequestStats(0), recorded.append)
+        self.assertEqual(next(stream), b'abc')
+        stream.close()
+        stream.close()
+        self.assertEqual(recorded, [3])
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.client.get(f'/api/albums/{self.album.id}/')
+        self.assertNotIn('AlbumViewSet', self.scrape())
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    """Parallel writers to one album or page never collide or duplicate numbers"""
+
+    THREADS = 12
+    PER_THREAD = 8
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.album = Album.objects.create(title='Busy', created_by=self.user)
+        self.page = AlbumPage.objects.create(album=self.album, title='Busy', page_number=1)
+
+    def hammer(self, path, payload):
+        """POST from THREADS threads at once; returns every status code"""
+        barrier = threading.Barrier(self.THREADS)
+        statuses, failures = [], []
+
+        def worker():
+            client = APIClient()
+            try:
+                barrier.wait()
+                for _ in range(self.PER_THREAD):
+                    statuses.append(client.post(path, payload, format='json').status_code)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        return statuses
+
+    def test_parallel_add_page(self):
+        statuses = self.hammer(f'/api/albums/{self.album.id}/add_page/', {'title': 'Upload'})
+        self.assertEqual(statuses, [201] * self.THREADS * self.PER_THREAD)
+        numbers = list(self.album.pages.order_by('page_number').values_list('page_number', flat=True))
+        self.assertEqual(numbers, list(range(1, self.THREADS * self.PER_THREAD + 2)))
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.page_count, len(numbers))
+
+    def test_parallel_add_media(self):
+        payload = {'media_type': 'image', 'file_url': 'https://utfs.io/f/a.jpg', 'file_key': 'a'}
+        statuses = self.hammer(f'/api/pages/{self.page.id}/add_media/', payload)
+        self.assertEqual(statuses, [201] * self.THREADS * self.PER_THREAD)
+        positions = list(self.page.media_items.order_by('position').values_list('position', flat=True))
+        self.assertEqual(positions, list(range(self.THREADS * self.PER_THREAD)))
+
+    def test_explicit_duplicate_page_number_is_a_400(self):
+        response = APIClient().post(
+            f'/api/albums/{self.album.id}/add_page/', {'title': 'Dup', 'page_number': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('page_number', response.data)
+
+    def test_production_profile_under_load(self):
+        build_album(self.user, 6, pages=2)
+        report = concurrency.run_profile(
+            'production', connection.settings_dict['NAME'], readers=1, writers=2, seconds=0.5
+        )
+        self.assertGreater(report['read']['requests'], 0)
+        self.assertGreater(report['write']['requests'], 0)
+        self.assertEqual(report['read']['errors'] + report['write']['errors'], 0)
+        # The load ran against a copy
+        self.assertEqual(MediaItem.objects.count(), 6)
+
+class SQLiteProductionTests(TestCase):
+    """Pragmas and the writer lock of the opt-in production SQLite profile"""
+
+    def open_connection(self, path):
+        settings_dict = dict(connection.settings_dict, NAME=path)
+        wrapper = DatabaseWrapper(settings_dict, alias='pragma-check')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connections(self):
+        pragmas = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 1234,
+                   'cache_size': -2048}
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+            wrapper = self.open_connection(f'{directory}/db.sqlite3')
+            self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+            self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 1234)
+            self.assertEqual(self.pragma(wrapper, 'cache_size'), -2048)
+            wrapper.close()
+
+    def test_default_profile_leaves_connections_alone(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS={}):
+            wrapper = self.open_connection(f'{directory}/db.sqlite3')
+            self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+            wrapper.close()
+
+    def test_immediate_transactions_take_the_write_lock_on_begin(self):
+        pragmas = {'journal_mode': 'WAL', 'busy_timeout': 0}
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+            first = self.open_connection(f'{directory}/db.sqlite3')
+            second = self.open_connection(f'{directory}/db.sqlite3')
+            for immediate in (False, True):
+                with self.subTest(immediate=immediate), override_settings(SQLITE_IMMEDIATE_TRANSACTIONS=immediate):
+                    first.cursor().execute('BEGIN')
+                    try:
+                        if immediate:
+                            with self.assertRaisesMessage(OperationalError, 'database is locked'):
+                                second.cursor().execute('BEGIN IMMEDIATE')
+                        else:
+                            second.cursor().execute('BEGIN IMMEDIATE')
+                            second.cursor().execute('ROLLBACK')
+                    finally:
+                        first.cursor().execute('ROLLBACK')
+
+    def test_write_lock_admits_one_holder_at_a_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lock = WriteLock(f'{directory}/write.lock')
+            inside, overlaps = [0], []
+
+            def worker():
+                for _ in range(20):
+                    self.assertTrue(lock.acquire(5))
+                    inside[0] += 1
+                    overlaps.append(inside[0])
+                    inside[0] -= 1
+                    lock.release()
+
+            threads = [threading.Thread(target=worker) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(overlaps, [1] * 120)
+
+    @override_settings(SQLITE_WRITE_LOCK=True, SQLITE_WRITE_LOCK_TIMEOUT=0.05)
+    def test_writes_queue_for_the_lock_reads_do_not(self):
+        user = User.objects.create(username='owner')
+        album = build_album(user, 2)
+        lock = get_write_lock()
+        self.assertTrue(lock.acquire(1))
+        try:
+            self.assertEqual(self.client.get(f'/api/albums/{album.id}/').status_code, 200)
+            response = self.client.patch(
+                f'/api/albums/{album.id}/', {'title': 'Blocked'}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            # Readable by the browser frontend, so it can retry
+            response = self.client.patch(
+                f'/api/albums/{album.id}/', {'title': 'Blocked'}, content_type='application/json',
+                HTTP_ORIGIN='http://localhost:3000'
+            )
+            self.assertEqual(response['Access-Control-Allow-Origin'], 'http://localhost:3000')
+        finally:
+            lock.release()
+        response = self.client.patch(
+            f'/api/albums/{album.id}/', {'title': 'Renamed'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Safe requests read a second SQLite file; writers read their own writes"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.album = build_album(self.user, 4, pages=2, title='Stale')
+        AlbumShare.objects.create(album=self.album, share_token='tok')
+        get_shared_album_cache().backend.clear()
+        # The replica is a copy taken now; later primary writes never reach it
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shutil.copy(connection.settings_dict['NAME'], os.path.join(directory, 'replica.sqlite3'))
+        connections.settings['replica'] = dict(
+            connection.settings_dict, NAME=os.path.join(directory, 'replica.sqlite3')
+        )
+        self.addCleanup(self.drop_replica)
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def title(self, client, url=None):
+        response = client.get(url or f'/api/albums/{self.album.id}/')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['title']
+
+    def test_safe_requests_read_from_the_replica(self):
+        Album.objects.filter(pk=self.album.pk).update(title='Fresh')
+        self.assertEqual(self.title(APIClient()), 'Stale')
+
+    def test_writer_reads_its_own_writes(self):
+        author = APIClient()
+        response = author.patch(f'/api/albums/{self.album.id}/', {'title': 'Fresh'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Fresh')
+        self.assertIn(settings.DATABASE_PRIMARY_COOKIE, response.cookies)
+        self.assertEqual(self.title(author), 'Fresh')
+        self.assertEqual(self.title(APIClient()), 'Stale')
+
+    def test_expired_stickiness_returns_to_the_replica(self):
+        Album.objects.filter(pk=self.album.pk).update(title='Fresh')
+        client = APIClient()
+        client.cookies[settings.DATABASE_PRIMARY_COOKIE] = '1'
+        self.assertEqual(self.title(client), 'Stale')
+
+    def test_shared_cache_is_filled_from_the_primary(self):
+        Album.objects.filter(pk=self.album.pk).update(title='Fresh')
+        self.assertEqual(self.title(APIClient(), '/api/shared/tok/'), 'Fresh')
+
+    def test_reads_after_a_write_in_the_same_request_use_the_primary(self):
+        router = ReplicaRouter()
+        token = routing_state.set(RoutingState(pinned=False))
+        try:
+            self.assertEqual(router.db_for_read(Album), 'replica')
+            self.assertEqual(router.db_for_write(Album), 'default')
+            self.assertEqual(router.db_for_read(Album), 'default')
+        finally:
+            routing_state.reset(token)
+        # Outside a request everything uses the primary
+        self.assertEqual(router.db_for_read(Album), 'default')
+
+class AsyncFrontTests(TestCase):
+    """The async views in front of the hot reads answer like the DRF views they wrap"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = build_album(cls.user, 6, pages=2)
+        cls.page = cls.album.pages.order_by('page_number').first()
+        AlbumShare.objects.create(album=cls.album, share_token='fast')
+
+    def setUp(self):
+        get_shared_album_cache().backend.clear()
+
+    def fetch(self, url):
+        """GET through the ASGI stack from a synchronous test"""
+        async def get():
+            return await self.async_client.get(url)
+        return async_to_sync(get)()
+
+    def test_asgi_middleware_chain_stays_async(self):
+        from album_backend.asgi import application
+        self.assertTrue(iscoroutinefunction(application._middleware_chain))
+
+    async def test_async_client_matches_sync_client(self):
+        for url in [f'/api/albums/{self.album.id}/', f'/api/pages/{self.page.id}/media/',
+                    '/api/shared/fast/']:
+            with self.subTest(url=url):
+                expected = await sync_to_async(self.client.get)(url)
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), json.loads(expected.content))
+                self.assertEqual(response['ETag'], expected['ETag'])
+                self.assertEqual(response['Allow'], expected['Allow'])
+
+    async def test_not_modified_from_the_front(self):
+        url = f'/api/albums/{self.album.id}/'
+        etag = (await self.async_client.get(url))['ETag']
+        response = await self.async_client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Allow'], 'GET, PUT, PATCH, DELETE, HEAD, OPTIONS')
+
+    def test_shared_hits_skip_the_database(self):
+        first = self.fetch('/api/shared/fast/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.fetch('/api/shared/fast/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+    async def test_other_methods_and_renderers_reach_drf(self):
+        url = f'/api/albums/{self.album.id}/'
+        response = await self.async_client.get(url + '?format=api')
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        response = await self.async_client.patch(
+            url, json.dumps({'title': 'Renamed'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['title'], 'Renamed')
+
+    async def test_routes_keep_their_metric_names(self):
+        await self.async_client.get(f'/api/pages/{self.page.id}/media/')
+        routes = {route for route, _ in metrics.registry.snapshot()}
+        self.assertIn('AlbumPageViewSet.media', routes)
+
+    def test_wsgi_requests_use_the_plain_routes(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/')
+        self.assertFalse(iscoroutinefunction(response.resolver_match.func))
+        response = self.fetch(f'/api/albums/{self.album.id}/')
+        self.assertTrue(iscoroutinefunction(response.resolver_match.func))
+
+class LocalStorageTests(TestCase):
+    """Chunked resumable uploads into content-addressed local storage, and ranged serving"""
+
+    def setUp(self):
+        self.client = APIClient()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.content = bytes(range(256)) * 1200
+
+    def start(self, filename='photo.JPG', size=None):
+        response = self.client.post(
+            '/api/uploads/', {'filename': filename, 'size': size or len(self.content)}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send(self, upload_id, offset, data):
+        return self.client.generic(
+            'PATCH', f'/api/uploads/{upload_id}/', data,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def upload(self, content=None, chunk=100_000):
+        content = content or self.content
+        upload_id = self.start(size=len(content))
+        for offset in range(0, len(content), chunk):
+            response = self.send(upload_id, offset, content[offset:offset + chunk])
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_chunks_assemble_under_the_content_hash(self):
+        response = self.upload()
+        digest = hashlib.sha256(self.content).hexdigest()
+        key = f'cas/{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+        self.assertEqual(response.data['file_key'], key)
+        self.assertEqual(response.data['received'], len(self.content))
+        self.assertTrue(response.data['file_url'].endswith(f'/media/{key}'))
+        with open(os.path.join(self.media_root, key), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, storage.PARTS_DIR)), [])
+
+    def test_resume_from_the_reported_offset(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content[:50_000])
+        response = self.client.head(f'/api/uploads/{upload_id}/')
+        self.assertEqual(response['Upload-Offset'], '50000')
+        response = self.send(upload_id, 10_000, self.content[10_000:60_000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 50_000)
+        response = self.send(upload_id, 50_000, self.content[50_000:])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['file_key'])
+
+    def test_chunks_past_the_declared_size_are_rejected(self):
+        upload_id = self.start(size=10)
+        self.assertEqual(self.send(upload_id, 0, b'x' * 11).status_code, 400)
+        self.assertEqual(self.send(upload_id, 0, b'x' * 10).status_code, 200)
+
+    def test_identical_content_shares_one_file(self):
+        first = self.upload().data['file_key']
+        self.assertEqual(self.upload().data['file_key'], first)
+
+    def test_serving_whole_files_and_ranges(self):
+        url = '/media/' + self.upload().data['file_key']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        size = len(self.content)
+        for header, start, end in [
+            ('bytes=10-19', 10, 19), (f'bytes={size - 100}-', size - 100, size - 1),
+            ('bytes=-5', size - 5, size - 1), (f'bytes=10-{size * 2}', 10, size - 1),
+        ]:
+            with self.subTest(range=header):
+                response = self.client.get(url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+                self.assertEqual(int(response['Content-Length']), end - start + 1)
+                self.assertEqual(b''.join(response.streaming_content), self.content[start:end + 1])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_front_server_sends_the_bytes(self):
+        key = self.upload().data['file_key']
+        with self.settings(MEDIA_ACCEL_REDIRECT='/protected-media/'):
+            response = self.client.get(f'/media/{key}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{key}')
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SENDFILE_HEADER='X-Sendfile'):
+            response = self.client.get(f'/media/{key}')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, key))
+
+    def test_parts_and_paths_outside_media_are_not_served(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content[:10])
+        self.assertEqual(self.client.get(f'/media/uploads/{upload_id}.part').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+    def test_unreferenced_local_files_are_deleted_by_the_outbox(self):
+        key = self.upload().data['file_key']
+        user = User.objects.create(username='owner')
+        page = build_album(user, 1).pages.get()
+        media = MediaItem.objects.create(
+            page=page, media_type='image', file_url=f'http://localhost/media/{key}', file_key=key
+        )
+        self.assertEqual(storage.purge_uploads(timezone.now() + timedelta(seconds=1)), 1)
+        media.delete()
+        service = UploadThingService(base_url='http://127.0.0.1:9')
+        self.addCleanup(service.close)
+        stats = process_batch(service)
+        self.assertEqual(stats['deleted'], 2)  # the upload's and the media item's queued key
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, key)))
+
+    def test_other_spellings_of_local_keys_are_refused_and_never_deleted(self):
+        key = self.upload().data['file_key']
+        alias = 'cas/./' + key[len('cas/'):]
+        user = User.objects.create(username='owner')
+        page = build_album(user, 1).pages.get()
+        MediaItem.objects.create(page=page, media_type='image', file_url='http://localhost/x', file_key=key)
+        for file_key in (alias, f'cas/../{storage.PARTS_DIR}/1.part', 'cas/' + key[4:].upper()):
+            with self.subTest(file_key=file_key):
+                response = self.client.post(f'/api/pages/{page.id}/add_media/', {
+                    'media_type': 'image', 'file_url': 'http://localhost/x', 'file_key': file_key
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('file_key', response.data)
+        response = self.client.post(
+            '/api/albums/', {'title': 'Cover', 'cover_image_key': alias}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # A row that predates the check: deleting it must not take the shared file along
+        MediaItem.objects.create(page=page, media_type='image', file_url='http://localhost/x', file_key=alias)
+        MediaItem.objects.filter(file_key=alias).delete()
+        service = UploadThingService(base_url='http://127.0.0.1:9')
+        self.addCleanup(service.close)
+        stats = process_batch(service)
+        self.assertEqual(stats['skipped'], 1)
+        storage.delete_local_files([alias])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, key)))
+
+def jpeg_bytes(width, height, orientation=None):
+    from PIL import Image
+    image = Image.new('RGB', (width, height), (200, 80, 40))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+class DerivativeTests(TestCase):
+    """Thumbnails and responsive widths rendered outside the request path"""
+
+    def setUp(self):
+        self.client = APIClient()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        override = self.settings(
+            MEDIA_ROOT=self.media_root, MEDIA_DERIVATIVE_WIDTHS=[320, 640, 1024],
+            MEDIA_THUMBNAIL_SIZE=128, MEDIA_DERIVATIVE_SOURCE_HOSTS=['utfs.io'],
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(username='owner')
+        album = Album.objects.create(title='Trip', created_by=self.user)
+        self.page = AlbumPage.objects.create(album=album, title='Day 1', page_number=1)
+
+    def store(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        key = storage.content_name(digest, 'photo.jpg')
+        default_storage.save(key, ContentFile(content))
+        return key, digest
+
+    def media(self, key, **kwargs):
+        data = dict(page=self.page, media_type='image', file_url=f'http://localhost/media/{key}',
+                    file_key=key, width=1, height=1, file_size=1)
+        data.update(kwargs)
+        return MediaItem.objects.create(**data)
+
+    def run_pipeline(self):
+        with ThreadPoolExecutor(2) as pool:
+            return derivatives.process_batch(pool)
+
+    def test_render_upright_widths_and_thumbnail(self):
+        from PIL import Image
+        key, digest = self.store(jpeg_bytes(1200, 800, orientation=6))
+        options = dict(media_root=self.media_root, directory=storage.DERIVATIVES_DIR,
+                       widths=[320, 640, 1024], thumbnail_size=128, quality=80, max_pixels=10 ** 8)
+        width, height, _ = imaging.render(default_storage.path(key), digest, **options)
+        self.assertEqual((width, height), (800, 1200))
+        for name, expected in [(320, (320, 480)), (640, (640, 960)), ('thumb', (128, 128))]:
+            with Image.open(default_storage.path(derivatives.rendition_name(digest, name))) as image:
+                self.assertEqual(image.size, expected)
+        self.assertFalse(default_storage.exists(derivatives.rendition_name(digest, 1024)))
+
+    def test_images_over_the_pixel_limit_are_not_decoded(self):
+        from PIL import Image
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        key, digest = self.store(jpeg_bytes(300, 200))
+        options = dict(media_root=self.media_root, directory=storage.DERIVATIVES_DIR,
+                       widths=[100], thumbnail_size=32, quality=80, max_pixels=40_000)
+        with warnings.catch_warnings(), patch.object(Image.Image, 'load') as load:
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with self.assertRaises(Image.DecompressionBombError):
+                imaging.render(default_storage.path(key), digest, **options)
+            result = imaging.derive({'path': default_storage.path(key), 'digest': digest, 'options': options})
+        load.assert_not_called()
+        self.assertIn('DecompressionBombError', result['error'])
+        self.assertFalse(default_storage.exists(derivatives.rendition_name(digest, 'thumb')))
+
+    def test_pipeline_measures_and_exposes_srcset(self):
+        content = jpeg_bytes(1000, 500)
+        key, digest = self.store(content)
+        first, second = self.media(key), self.media(key, position=1)
+        self.assertEqual(
+            self.run_pipeline(),
+            {'claimed': 2, 'ready': 2, 'failed': 0, 'skipped': 0, 'deduplicated': 0}
+        )
+        first.refresh_from_db()
+        self.assertEqual(
+            (first.width, first.height, first.file_size, first.content_hash, first.derivative_status),
+            (1000, 500, len(content), digest, 'ready')
+        )
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.total_file_size, 2 * len(content))
+
+        item = self.client.get(f'/api/pages/{self.page.pk}/').data['items'][0]
+        base = f'http://testserver/media/derivatives/{digest[:2]}/{digest[2:4]}/{digest}'
+        self.assertEqual(item['srcset'], (
+            f'{base}/320.webp 320w, {base}/640.webp 640w, '
+            f'http://localhost/media/{key} 1000w'
+        ))
+        self.assertEqual(item['thumbnail'], f'{base}/thumb.webp')
+        self.assertEqual((item['width'], item['height']), (1000, 500))
+        data = self.client.get(f'/api/media/{second.pk}/').data
+        self.assertEqual((data['srcset'], data['thumbnail_url']), (item['srcset'], item['thumbnail']))
+        response = self.client.get(item['thumbnail'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_pending_items_keep_the_original_shape(self):
+        key, _ = self.store(jpeg_bytes(400, 300))
+        self.media(key)
+        item = self.client.get(f'/api/pages/{self.page.pk}/').data['items'][0]
+        self.assertEqual(set(item), {'type', 'src', 'caption'})
+
+    def test_unreadable_and_disallowed_sources_fail(self):
+        key, _ = self.store(b'not an image')
+        broken = self.media(key)
+        elsewhere = self.media('remote-key', file_url='http://127.0.0.1:9/photo.jpg')
+        with self.assertLogs('albums.derivatives', 'WARNING'):
+            self.assertEqual(self.run_pipeline()['failed'], 2)
+        for media in (broken, elsewhere):
+            media.refresh_from_db()
+            self.assertEqual(media.derivative_status, 'failed')
+            self.assertEqual(media.file_size, 1)
+        self.assertEqual(derivatives.requeue(('failed',)), 2)
+
+    def test_remote_originals_follow_allowed_redirects_only(self):
+        content = jpeg_bytes(700, 700)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/hop':
+                    self.send_response(302)
+                    self.send_header('Location', '/photo.jpg')
+                    self.end_headers()
+                elif self.path == '/away':
+                    self.send_response(302)
+                    self.send_header('Location', 'http://example.com/photo.jpg')
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        origin = f'http://127.0.0.1:{server.server_port}'
+        hop = self.media('hop', file_url=f'{origin}/hop')
+        away = self.media('away', file_url=f'{origin}/away')
+        with self.settings(MEDIA_DERIVATIVE_SOURCE_HOSTS=['127.0.0.1']), self.assertLogs('albums.derivatives'):
+            self.run_pipeline()
+        hop.refresh_from_db()
+        away.refresh_from_db()
+        self.assertEqual((hop.derivative_status, hop.file_size), ('ready', len(content)))
+        self.assertEqual(hop.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(away.derivative_status, 'failed')
+
+    def test_client_sizes_of_local_files_are_replaced(self):
+        key, _ = self.store(b'x' * 50)
+        url = f'/api/pages/{self.page.pk}/add_media/'
+        body = {'media_type': 'image', 'file_url': f'http://localhost/media/{key}', 'file_key': key,
+                'file_size': 10 ** 9}
+        response = self.client.post(url, body, format='json')
+        self.assertEqual(response.data['file_size'], 50)
+        body['file_key'] = 'cas/00/00/missing.jpg'
+        self.assertEqual(self.client.post(url, body, format='json').status_code, 400)
+
+    def test_replacing_the_file_requeues(self):
+        key, _ = self.store(jpeg_bytes(400, 300))
+        media = self.media(key)
+        self.run_pipeline()
+        media.refresh_from_db()
+        media.file_key = 'other-key'
+        media.save()
+        media.refresh_from_db()
+        self.assertEqual((media.derivative_status, media.content_hash), ('pending', ''))
+
+    def test_command_renders_in_worker_processes(self):
+        key, digest = self.store(jpeg_bytes(700, 400))
+        media = self.media(key)
+        stdout = StringIO()
+        call_command('build_derivatives', '--workers=1', stdout=stdout)
+        self.assertIn('ready 1, failed 0', stdout.getvalue())
+        media.refresh_from_db()
+        self.assertEqual((media.width, media.height), (700, 400))
+        self.assertTrue(default_storage.exists(derivatives.rendition_name(digest, 640)))
+
+def fractal_bytes(extent, size=(480, 360), quality=90):
+    from PIL import Image
+    image = Image.effect_mandelbrot(size, extent, 64).convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+class DuplicateTests(TestCase):
+    """Exact and perceptual-hash duplicate lookups, and reuse of stored files"""
+
+    def setUp(self):
+        self.client = APIClient()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        override = self.settings(MEDIA_ROOT=self.media_root, MEDIA_DERIVATIVE_WIDTHS=[320])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(username='owner')
+        self.album = Album.objects.create(title='Trip', created_by=self.user)
+        self.page = AlbumPage.objects.create(album=self.album, title='Day 1', page_number=1)
+
+    def media(self, page=None, phash=None, **kwargs):
+        data = dict(page=page or self.page, media_type='image', file_url='https://utfs.io/f/x.jpg',
+                    file_key=f'key-{uuid.uuid4()}', file_size=100)
+        data.update(kwargs)
+        media = MediaItem.objects.create(**data)
+        if phash is not None:
+            bands = dict(zip(PHASH_BAND_FIELDS, phash_bands(phash)))
+            MediaItem.objects.filter(pk=media.pk).update(perceptual_hash=phash, **bands)
+            media.refresh_from_db()
+        return media
+
+    def store(self, content, filename='photo.jpg'):
+        digest = hashlib.sha256(content).hexdigest()
+        key = storage.content_name(digest, filename)
+        default_storage.save(key, ContentFile(content))
+        return key, digest
+
+    def test_dhash_tolerates_resizing_and_recompression(self):
+        from PIL import Image
+        original = Image.open(BytesIO(fractal_bytes((-2, -1.2, 1, 1.2))))
+        copy = Image.open(BytesIO(fractal_bytes((-2, -1.2, 1, 1.2), size=(240, 180), quality=40)))
+        other = Image.open(BytesIO(fractal_bytes((-0.8, 0, -0.4, 0.3))))
+        self.assertLessEqual(duplicates.hamming(imaging.dhash(original), imaging.dhash(copy)), 4)
+        self.assertGreater(duplicates.hamming(imaging.dhash(original), imaging.dhash(other)), 10)
+
+    def test_multi_index_lookup_finds_everything_within_distance(self):
+        base = -0x1234_5678_9abc_def0
+        near = {}
+        for distance in range(10):
+            # Spread the flipped bits over all four bands
+            flipped = base
+            for n in range(distance):
+                flipped ^= 1 << ((n * 16 + n) % 64)
+            near[self.media(phash=flipped).pk] = distance
+        self.media(phash=None)
+        with self.assertNumQueries(1):
+            matches = duplicates.similar(base, MediaItem.objects.all(), 7)
+        self.assertEqual([d for d, _ in matches], list(range(8)))
+        self.assertTrue(all(near[media.pk] == d for d, media in matches))
+        self.assertEqual(len(duplicates.similar(base, MediaItem.objects.all(), 3)), 4)
+
+    def test_library_and_album_groups(self):
+        other_album = Album.objects.create(title='Later', created_by=self.user)
+        other_page = AlbumPage.objects.create(album=other_album, title='Day 2', page_number=1)
+        shared = 'a' * 64
+        first = self.media(content_hash=shared, phash=0b1011)
+        second = self.media(page=other_page, content_hash=shared, phash=0b1011, file_size=300)
+        close = self.media(content_hash='b' * 64, phash=0b1011 ^ (1 << 40))
+        self.media(content_hash='c' * 64, phash=~0b1011)
+        stranger = User.objects.create(username='stranger')
+        foreign = Album.objects.create(title='Theirs', created_by=stranger)
+        self.media(page=AlbumPage.objects.create(album=foreign, title='P', page_number=1),
+                   content_hash=shared, phash=0b1011)
+
+        data = self.client.get('/api/duplicates/', {'user': self.user.pk}).data
+        self.assertEqual(len(data['exact']), 1)
+        self.assertEqual({item['id'] for item in data['exact'][0]['items']}, {first.pk, second.pk})
+        self.assertEqual(data['exact'][0]['wasted_bytes'], 100)
+        self.assertEqual(len(data['similar']), 1)
+        self.assertEqual({item['id'] for item in data['similar'][0]['items']}, {first.pk, second.pk, close.pk})
+
+        data = self.client.get('/api/duplicates/', {'album': self.album.pk, 'distance': 0}).data
+        self.assertEqual((data['exact'], data['similar']), ([], []))
+        self.assertEqual(self.client.get('/api/duplicates/').status_code, 400)
+        self.assertEqual(self.client.get('/api/duplicates/', {'user': self.user.pk, 'distance': 9}).status_code, 400)
+
+        response = self.client.get(f'/api/media/{first.pk}/similar/')
+        self.assertEqual([(m['id'], m['distance']) for m in response.data], [(str(second.pk), 0), (str(close.pk), 1)])
+        response = self.client.get(f'/api/media/{first.pk}/similar/', {'scope': 'all'})
+        self.assertEqual(len(response.data), 3)
+
+    def test_upload_time_check_returns_the_stored_file(self):
+        media = self.media(content_hash='d' * 64, file_key='existing', file_url='https://utfs.io/f/existing')
+        response = self.client.get('/api/duplicates/check/', {'sha256': 'd' * 64})
+        self.assertEqual(response.data, {
+            'duplicate': True, 'media_id': media.pk,
+            'file_key': 'existing', 'file_url': 'https://utfs.io/f/existing',
+        })
+        key, digest = self.store(b'local bytes')
+        response = self.client.get('/api/duplicates/check/', {'sha256': digest})
+        self.assertEqual(response.data['file_key'], key)
+        self.assertEqual(self.client.get('/api/duplicates/check/', {'sha256': 'e' * 64}).data, {'duplicate': False})
+        self.assertEqual(self.client.get('/api/duplicates/check/', {'sha256': 'nope'}).status_code, 400)
+
+    def test_upload_with_a_known_hash_completes_at_once(self):
+        content = b'already here' * 100
+        key, digest = self.store(content)
+        response = self.client.post('/api/uploads/', {
+            'filename': 'again.jpg', 'size': len(content), 'sha256': digest,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['file_key'], response.data['received']), (key, len(content)))
+        self.assertNotIn('sha256', response.data)
+        response = self.client.post('/api/uploads/', {
+            'filename': 'other.jpg', 'size': len(content) + 1, 'sha256': digest,
+        }, format='json')
+        self.assertEqual((response.data['file_key'], response.data['received']), ('', 0))
+
+    def test_pipeline_points_copies_at_the_first_file(self):
+        content = fractal_bytes((-2, -1.2, 1, 1.2))
+        first_key, digest = self.store(content)
+        copy_key, _ = self.store(content, 'copy.jpeg')
+        first = self.media(file_key=first_key, file_url=f'http://localhost/media/{first_key}')
+        copy = self.media(file_key=copy_key, file_url=f'http://localhost/media/{copy_key}')
+        with ThreadPoolExecutor(1) as pool:
+            stats = derivatives.process_batch(pool)
+        self.assertEqual((stats['ready'], stats['deduplicated']), (2, 1))
+        copy.refresh_from_db()
+        self.assertEqual((copy.file_key, copy.file_url), (first_key, first.file_url))
+        self.assertEqual(copy.content_hash, digest)
+        self.assertIsNotNone(copy.perceptual_hash)
+        self.assertEqual(copy.phash_band3, phash_bands(copy.perceptual_hash)[3])
+        self.assertTrue(FileDeletion.objects.filter(file_key=copy_key).exists())
+        with self.settings(MEDIA_REUSE_DUPLICATE_FILES=False):
+            third = self.media(file_key=copy_key, file_url=f'http://localhost/media/{copy_key}')
+            with ThreadPoolExecutor(1) as pool:
+                derivatives.process_batch(pool)
+        third.refresh_from_db()
+        self.assertEqual(third.file_key, copy_key)
+
+class WireFormatTests(TestCase):
+    """orjson and MessagePack rendering, API version 2 without `items`, and compression"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.album = build_album(cls.user, 40, pages=4)
+        AlbumShare.objects.create(album=cls.album, share_token='wire')
+
+    def setUp(self):
+        self.client = APIClient()
+        get_shared_album_cache().backend.clear()
+        self.url = f'/api/albums/{self.album.id}/'
+
+    def test_orjson_renders_what_drf_would(self):
+        data = self.client.get(self.url).data
+        extra = {
+            'price': Decimal('1.50'), 'when': timezone.now(), 'key': uuid.uuid4(), 'line': 'a\u2028b', 3: 'int key',
+        }
+        for value in (data, extra):
+            self.assertEqual(
+                renderers.ORJSONRenderer().render(value), JSONRenderer().render(value)
+            )
+        indented = renderers.ORJSONRenderer().render({'a': 1}, 'application/json; indent=4')
+        self.assertEqual(indented, b'{\n  "a": 1\n}')
+        self.assertEqual(renderers.ORJSONRenderer().render(None), b'')
+
+    def test_version_2_drops_items(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json; version=2')
+        page = response.json()['pages'][0]
+        self.assertNotIn('items', page)
+        self.assertEqual(len(page['media_items']), 10)
+        self.assertIn('items', self.client.get(self.url).json()['pages'][0])
+        self.assertNotIn('items', self.client.get(
+            '/api/shared/wire/', HTTP_ACCEPT='application/json; version=2'
+        ).json()['pages'][0])
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json; version=3')
+        self.assertEqual(response.status_code, 406)
+
+    @skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_messagepack_by_accept(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), self.client.get(self.url).json())
+        for state in ('MISS', 'HIT'):
+            response = self.client.get('/api/shared/wire/', HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['X-Cache'], state)
+            self.assertEqual(renderers.msgpack.unpackb(response.content)['id'], str(self.album.id))
+
+    def test_gzip_above_the_threshold(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        response = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with self.settings(RESPONSE_COMPRESSION_MIN_BYTES=len(plain.content) + 1):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streamed_exports_are_compressed(self):
+        plain = b''.join(self.client.get(f'{self.url}export/?output=ndjson').streaming_content)
+        response = self.client.get(f'{self.url}export/?output=ndjson', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+        response = self.client.get(f'{self.url}export/?output=zip', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiation(self):
+        self.assertEqual(compression.negotiate(''), None)
+        self.assertEqual(compression.negotiate('deflate'), None)
+        self.assertEqual(compression.negotiate('gzip;q=0.5, *;q=0.1'), 'gzip')
+        preferred = 'br' if compression.brotli else 'gzip'
+        self.assertEqual(compression.negotiate('gzip, deflate, br'), preferred)
+        self.assertEqual(compression.negotiate('*'), preferred)
+        if compression.brotli:
+            self.assertEqual(compression.negotiate('br;q=0.5, gzip'), 'gzip')
+
+    def test_wire_benchmark(self):
+        report = benchmark.wire_formats(iterations=1)
+        formats = report['formats']
+        self.assertEqual(formats['orjson']['bytes'], formats['drf-json']['bytes'])
+        self.assertLess(formats['orjson-v2']['bytes'], formats['orjson']['bytes'])
+        self.assertLess(formats['orjson-v2-gzip']['bytes'], formats['orjson-v2']['bytes'])
+        self.assertEqual(report['meta']['album_media'], 40)
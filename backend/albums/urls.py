@@ -1,13 +1,34 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
-from .views import AlbumViewSet, AlbumPageViewSet, MediaItemViewSet, SharedAlbumViewSet
+from .views import (
+    AlbumViewSet, AlbumPageViewSet, MediaItemViewSet, SharedAlbumViewSet, SearchViewSet,
+    UploadViewSet, DuplicatesViewSet
+)
+from .async_views import async_front, album_fast_path, page_media_fast_path, shared_album_fast_path
 
 router = DefaultRouter()
 router.register(r'albums', AlbumViewSet)
 router.register(r'pages', AlbumPageViewSet)
 router.register(r'media', MediaItemViewSet)
 router.register(r'shared', SharedAlbumViewSet, basename='shared-album')
+router.register(r'search', SearchViewSet, basename='search')
+router.register(r'uploads', UploadViewSet)
+router.register(r'duplicates', DuplicatesViewSet, basename='duplicates')
 
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+routes = {pattern.name: pattern.callback for pattern in router.urls}
+
+# Async fronts for the hot reads. The ASGI URLconf (see AsyncURLConfMiddleware)
+# matches them before the router routes they wrap
+async_urlpatterns = [
+    path('albums/<uuid:pk>/', async_front(routes['album-detail'], album_fast_path),
+         name='album-detail'),
+    re_path(r'^shared/(?P<share_token>[^/.]+)/$',
+            async_front(routes['shared-album-detail'], shared_album_fast_path),
+            name='shared-album-detail'),
+    path('pages/<uuid:pk>/media/', async_front(routes['albumpage-media'], page_media_fast_path),
+         name='albumpage-media'),
+]
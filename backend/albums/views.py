@@ -1,25 +1,170 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Max, Value, When
+from django.utils import timezone
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
-from .models import Album, AlbumPage, MediaItem, AlbumShare
+from .models import Album, AlbumPage, MediaItem, AlbumShare, SearchEntry, Upload
 from .serializers import (
     AlbumSerializer, AlbumCreateSerializer, AlbumPageSerializer, 
     AlbumPageCreateSerializer, MediaItemSerializer, MediaItemCreateSerializer,
-    AlbumShareSerializer
+    AlbumShareSerializer, AlbumSummarySerializer, AlbumSkeletonSerializer,
+    AlbumPageSkeletonSerializer, UploadSerializer, parse_fieldset
 )
-from .services import UploadThingService
+from .cache import get_shared_album_cache, invalidate_album
+from .search import index_media, search
+from .stats import apply_stats, total_stats
+from .allocation import allocate, lock_parent
+from .replicas import use_primary
+from . import duplicates, export, storage
+from .conditional import (
+    album_validators, page_validators, window_validators, known_validators, request_variant,
+    apply_validators, not_modified
+)
+from .pagination import (
+    AlbumCursorPagination, AlbumPageCursorPagination, MediaItemCursorPagination, PageNumberWindow
+)
+import re
 import uuid
 
+def parse_id_list(values):
+    """Parse a list of UUID strings, keeping the last index of any repeated id"""
+    if not isinstance(values, list):
+        raise ValueError('Expected a list of ids')
+    return {uuid.UUID(str(value)): index for index, value in enumerate(values)}
+
+def ordinal_case(ordinals, offset=0):
+    """CASE expression mapping primary keys to offset + ordinal in a single UPDATE"""
+    return Case(
+        *[When(pk=pk, then=Value(offset + ordinal)) for pk, ordinal in ordinals.items()],
+        output_field=IntegerField()
+    )
+
+def parse_distance(request):
+    """?distance=, the perceptual-hash bits near-duplicates may differ by"""
+    try:
+        distance = int(request.query_params.get('distance', settings.MEDIA_NEAR_DUPLICATE_DISTANCE))
+    except ValueError:
+        distance = -1
+    if not 0 <= distance <= duplicates.MAX_DISTANCE:
+        raise ValidationError({'distance': f'Expected an integer from 0 to {duplicates.MAX_DISTANCE}'})
+    return distance
+
+def is_skeleton(request):
+    """Album reads made with ?view=skeleton list pages without their media"""
+    return request.query_params.get('view') == 'skeleton'
+
+def pages_response(view, request, album_id):
+    """
+    An album's pages, answering conditional GETs first: page skeletons with
+    ?view=skeleton, a window of full pages with ?from=/?to=, or else every
+    page with its media (?cursor= or ?page_size= paginate those).
+    """
+    variant = request_variant(request)
+    skeleton = is_skeleton(request)
+    # Skeletons list every page, so they are validated against the whole album
+    window = None if skeleton or not PageNumberWindow.is_requested(request) else PageNumberWindow(request)
+    if window is not None:
+        validators = window_validators(album_id, window.first, window.last, variant)
+    else:
+        validators = album_validators(album_id, variant)
+    if validators is None:
+        raise Http404
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    
+    context = view.get_serializer_context()
+    pages = AlbumPage.objects.filter(album_id=album_id)
+    if skeleton:
+        serializer = AlbumPageSkeletonSerializer(pages.skeletons(), many=True, context=context)
+        return apply_validators(Response(serializer.data), validators)
+    pages = pages.with_media()
+    paginator = window
+    if window is not None:
+        pages = window.paginate_queryset(pages)
+    elif AlbumPageCursorPagination.is_requested(request):
+        paginator = AlbumPageCursorPagination()
+        pages = paginator.paginate_queryset(pages, request, view=view)
+    serializer = AlbumPageSerializer(pages, many=True, context=context)
+    if paginator:
+        response = paginator.get_paginated_response(serializer.data)
+    else:
+        response = Response(serializer.data)
+    return apply_validators(response, validators)
+
+def export_response(request, album_id):
+    """
+    Stream an album as ?output=json (default), ndjson or zip. Pages and media
+    are read with chunked iterators, so memory stays flat for any album size.
+    """
+    export_format = request.query_params.get('output', 'json')
+    if export_format not in export.FORMATS:
+        raise ValidationError({'output': f"Expected one of: {', '.join(export.FORMATS)}"})
+    header = export.album_header(album_id)
+    if header is None:
+        raise Http404
+    response = StreamingHttpResponse(
+        export.export_chunks(header, export_format, settings.ALBUM_EXPORT_CHUNK_SIZE),
+        content_type=export.CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{export.export_filename(header, export_format)}"'
+    )
+    return response
+
 class AlbumViewSet(viewsets.ModelViewSet):
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
     permission_classes = [permissions.AllowAny]  # Change as needed
+    pagination_class = AlbumCursorPagination
+    # ?ordering= accepts the album's own columns only: cursors hold their values
+    ordering_fields = [
+        'title', 'subtitle', 'cover_image_url', 'created_at', 'updated_at', 'is_public', 'page_count',
+        *Album.STATS_FIELDS,
+    ]
+    
+    def is_summary(self):
+        """List requests made with ?view=summary use the lightweight projection"""
+        return self.action == 'list' and self.request.query_params.get('view') == 'summary'
+    
+    def get_queryset(self):
+        if self.action not in ('list', 'retrieve'):
+            return super().get_queryset()
+        
+        if self.action == 'retrieve' and is_skeleton(self.request):
+            return Album.objects.with_skeleton()
+        queryset = Album.objects.with_owner()
+        fields, nested = parse_fieldset(self.request.query_params.get('fields'))
+        if self.is_summary():
+            queryset = queryset.with_counts()
+            expand, _ = parse_fieldset(self.request.query_params.get('expand'))
+            wants_pages = 'pages' in (fields or set()) | (expand or set())
+        else:
+            wants_pages = fields is None or 'pages' in fields
+        if not wants_pages:
+            return queryset
+        
+        # Only prefetch media when the requested page fields actually render it
+        page_fields = nested.get('pages')
+        wants_media = page_fields is None or any(
+            path.split('.')[0] in ('media_items', 'items') for path in page_fields
+        )
+        return queryset.with_tree(media=wants_media)
     
     def get_serializer_class(self):
         if self.action == 'create':
             return AlbumCreateSerializer
+        if self.is_summary():
+            return AlbumSummarySerializer
+        if self.action == 'retrieve' and is_skeleton(self.request):
+            return AlbumSkeletonSerializer
         return AlbumSerializer
     
     def perform_create(self, serializer):
@@ -28,30 +173,90 @@ class AlbumViewSet(viewsets.ModelViewSet):
         user, created = User.objects.get_or_create(username='anonymous')
         serializer.save(created_by=user)
     
+    def retrieve(self, request, *args, **kwargs):
+        """Answer conditional GETs with 304 before loading or serializing the tree"""
+        validators = known_validators(request, album_validators, self._lookup_pk(), request_variant(request))
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        return not_modified(request, validators) or apply_validators(
+            super().retrieve(request, *args, **kwargs), validators
+        )
+    
+    def _lookup_pk(self):
+        try:
+            return uuid.UUID(str(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+        except ValueError:
+            return None
+    
     @action(detail=True, methods=['get'])
     def pages(self, request, pk=None):
-        """Get all pages for an album"""
-        album = self.get_object()
-        pages = album.pages.all()
-        serializer = AlbumPageSerializer(pages, many=True)
-        return Response(serializer.data)
+        """
+        Get an album's pages. For very large albums, fetch ?view=skeleton
+        first and then windows of full pages with ?from=&to= page numbers.
+        """
+        album_id = self._lookup_pk()
+        if album_id is None:
+            raise Http404
+        return pages_response(self, request, album_id)
     
     @action(detail=True, methods=['post'])
     def add_page(self, request, pk=None):
-        """Add a new page to an album"""
+        """Add a new page to an album; without page_number it goes after the last page"""
         album = self.get_object()
         serializer = AlbumPageCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        if 'page_number' in data:
+            try:
+                with transaction.atomic():
+                    page = AlbumPage.objects.create(album=album, **data)
+            except IntegrityError:
+                return Response(
+                    {'page_number': ['This album already has a page with this number.']},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            page = allocate(
+                Album, album.pk, album.pages.all(), 'page_number', 1,
+                lambda number: AlbumPage.objects.create(album=album, page_number=number, **data)
+            )
+        return Response(AlbumPageCreateSerializer(page).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'])
+    def reorder_pages(self, request, pk=None):
+        """
+        Renumber an album's pages from `page_order` (a list of page ids).
+        Listed pages become 1..n and any unlisted pages follow in their
+        current order.
+        """
+        album = self.get_object()
+        try:
+            requested = parse_id_list(request.data.get('page_order', []))
+        except ValueError:
+            return Response({'error': 'page_order must be a list of page ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        if serializer.is_valid():
-            # Auto-increment page number if not provided
-            if 'page_number' not in request.data:
-                last_page = album.pages.order_by('-page_number').first()
-                page_number = (last_page.page_number + 1) if last_page else 1
-                serializer.validated_data['page_number'] = page_number
+        with transaction.atomic():
+            lock_parent(Album, album.pk)
+            current = list(
+                album.pages.order_by('page_number').values_list('id', 'page_number')
+            )
+            known = {pid for pid, _ in current}
+            listed = sorted((pid for pid in requested if pid in known), key=requested.get)
+            rest = [pid for pid, _ in current if pid not in requested]
+            ordinals = {pid: number for number, pid in enumerate(listed + rest, start=1)}
             
-            serializer.save(album=album)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            # Stage through numbers above both the current maximum and the
+            # final 1..n so no intermediate row collides with the (album,
+            # page_number) unique constraint in either pass
+            offset = max(current[-1][1] if current else 0, len(ordinals))
+            pages = album.pages.filter(id__in=list(ordinals))
+            pages.update(page_number=ordinal_case(ordinals, offset), updated_at=timezone.now())
+            pages.update(page_number=F('page_number') - offset)
+            invalidate_album(album.id)
+        
+        return Response({'status': 'success'})
     
     @action(detail=True, methods=['get'])
     def shared_link(self, request, pk=None):
@@ -63,55 +268,146 @@ class AlbumViewSet(viewsets.ModelViewSet):
         )
         serializer = AlbumShareSerializer(share)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Download the album as a streamed JSON manifest, NDJSON or ZIP"""
+        return export_response(request, self._lookup_pk())
 
 class AlbumPageViewSet(viewsets.ModelViewSet):
     queryset = AlbumPage.objects.all()
     serializer_class = AlbumPageSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = AlbumPageCursorPagination
+    ordering_fields = ['title', 'page_number', 'created_at', 'updated_at', *AlbumPage.STATS_FIELDS]
+    
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return AlbumPage.objects.with_media()
+        return super().get_queryset()
     
     def get_serializer_class(self):
         if self.action == 'create':
             return AlbumPageCreateSerializer
         return AlbumPageSerializer
     
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            # Bump the parent so the album's Last-Modified moves past the deletion
+            Album.objects.filter(pk=instance.album_id).update(updated_at=timezone.now())
+    
     @action(detail=True, methods=['get'])
     def media(self, request, pk=None):
-        """Get all media items for a page"""
+        """Get all media items for a page; pass ?cursor= or ?page_size= to paginate"""
         page = self.get_object()
+        validators = known_validators(request, page_validators, page.pk, request_variant(request))
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        
         media_items = page.media_items.all()
-        serializer = MediaItemSerializer(media_items, many=True)
-        return Response(serializer.data)
+        paginator = None
+        if MediaItemCursorPagination.is_requested(request):
+            paginator = MediaItemCursorPagination()
+            media_items = paginator.paginate_queryset(media_items, request, view=self)
+        serializer = MediaItemSerializer(media_items, many=True, context=self.get_serializer_context())
+        if paginator:
+            response = paginator.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return apply_validators(response, validators)
     
     @action(detail=True, methods=['post'])
     def add_media(self, request, pk=None):
-        """Add media item to a page"""
+        """Add media item to a page; without position it goes after the last item"""
         page = self.get_object()
         serializer = MediaItemCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
         
-        if serializer.is_valid():
-            # Auto-increment position if not provided
-            if 'position' not in request.data:
-                last_media = page.media_items.order_by('-position').first()
-                position = (last_media.position + 1) if last_media else 0
-                serializer.validated_data['position'] = position
-            
-            serializer.save(page=page)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if 'position' in data:
+            media = MediaItem.objects.create(page=page, **data)
+        else:
+            media = allocate(
+                AlbumPage, page.pk, page.media_items.all(), 'position', 0,
+                lambda position: MediaItem.objects.create(page=page, position=position, **data)
+            )
+        return Response(MediaItemCreateSerializer(media).data, status=status.HTTP_201_CREATED)
+    
+    BULK_MEDIA_LIMIT = 1000
+    
+    @action(detail=True, methods=['post'])
+    def add_media_bulk(self, request, pk=None):
+        """
+        Add many media items to a page in one request. Accepts a list (or
+        {"items": [...]}); valid items are inserted in a single transaction
+        and invalid ones are reported by index without aborting the batch.
+        """
+        page = self.get_object()
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'Expected a non-empty list of media items'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > self.BULK_MEDIA_LIMIT:
+            return Response(
+                {'error': f'At most {self.BULK_MEDIA_LIMIT} items per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = MediaItemCreateSerializer(data=items, many=True)
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                valid.append((item, serializer.child.run_validation(item)))
+            except ValidationError as e:
+                errors.append({'index': index, 'errors': e.detail})
+        
+        created = []
+        if valid:
+            with transaction.atomic():
+                # Lock the page, then one lookup for the tail position and
+                # contiguous numbering
+                lock_parent(AlbumPage, page.pk)
+                last = page.media_items.aggregate(last=Max('position'))['last']
+                position = -1 if last is None else last
+                media_items = []
+                for item, data in valid:
+                    if 'position' not in item:
+                        position += 1
+                        data['position'] = position
+                    media_items.append(MediaItem(page=page, **data))
+                created = MediaItem.objects.bulk_create(media_items, batch_size=500)
+                index_media(created, page.album_id)
+                apply_stats(page.id, page.album_id, total_stats(created))
+                invalidate_album(page.album_id)
+        
+        response_status = status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': MediaItemSerializer(created, many=True).data,
+            'errors': errors,
+        }, status=response_status)
     
     @action(detail=True, methods=['post'])
     def reorder_media(self, request, pk=None):
         """Reorder media items on a page"""
         page = self.get_object()
-        media_order = request.data.get('media_order', [])
+        try:
+            ordinals = parse_id_list(request.data.get('media_order', []))
+        except ValueError:
+            return Response({'error': 'media_order must be a list of media ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        for index, media_id in enumerate(media_order):
-            try:
-                media_item = page.media_items.get(id=media_id)
-                media_item.position = index
-                media_item.save()
-            except MediaItem.DoesNotExist:
-                continue
+        # Unknown ids are ignored, as before; everything else moves in one UPDATE
+        if ordinals:
+            with transaction.atomic():
+                lock_parent(AlbumPage, page.pk)
+                page.media_items.filter(id__in=list(ordinals)).update(
+                    position=ordinal_case(ordinals), updated_at=timezone.now()
+                )
+                invalidate_album(page.album_id)
         
         return Response({'status': 'success'})
 
@@ -119,26 +415,55 @@ class MediaItemViewSet(viewsets.ModelViewSet):
     queryset = MediaItem.objects.all()
     serializer_class = MediaItemSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = MediaItemCursorPagination
+    ordering_fields = [
+        'media_type', 'caption', 'position', 'width', 'height', 'file_size', 'created_at', 'updated_at'
+    ]
     
     def get_serializer_class(self):
         if self.action == 'create':
             return MediaItemCreateSerializer
         return MediaItemSerializer
     
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            # Bump the parent so page and album Last-Modified move past the deletion
+            AlbumPage.objects.filter(pk=instance.page_id).update(updated_at=timezone.now())
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Near-duplicates of this image, closest first, from the album owner's
+        library or with ?scope=all from every album; ?distance= bounds them
+        """
+        media = self.get_object()
+        distance = parse_distance(request)
+        if media.perceptual_hash is None:
+            return Response([])
+        if request.query_params.get('scope', 'library') == 'all':
+            queryset = MediaItem.objects.all()
+        else:
+            owner = AlbumPage.objects.filter(pk=media.page_id).values_list(
+                'album__created_by_id', flat=True
+            ).first()
+            queryset = duplicates.scope(user_id=owner)
+        matches = duplicates.similar(media.perceptual_hash, queryset.exclude(pk=media.pk), distance)
+        context = self.get_serializer_context()
+        return Response([
+            {'distance': d, **MediaItemSerializer(match, context=context).data}
+            for d, match in matches
+        ])
+    
     @action(detail=True, methods=['delete'])
     def delete_from_uploadthing(self, request, pk=None):
-        """Delete file from UploadThing and database"""
+        """
+        Delete the media item; its UploadThing file is queued in the deletion
+        outbox in the same transaction and removed by process_file_deletions
+        """
         media_item = self.get_object()
-        try:
-            upload_service = UploadThingService()
-            upload_service.delete_file(media_item.file_key)
-            media_item.delete()
-            return Response({'status': 'deleted'})
-        except Exception as e:
-            return Response(
-                {'error': str(e)}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        self.perform_destroy(media_item)
+        return Response({'status': 'deleted'})
 
 class SharedAlbumViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for accessing shared albums via token"""
@@ -147,12 +472,227 @@ class SharedAlbumViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_field = 'share_token'
     
     def get_queryset(self):
-        return Album.objects.filter(
+        queryset = Album.objects.with_skeleton() if is_skeleton(self.request) else Album.objects.with_tree()
+        return queryset.filter(
             shares__is_active=True,
             shares__share_token=self.kwargs.get('share_token')
         )
     
+    def get_serializer_class(self):
+        return AlbumSkeletonSerializer if is_skeleton(self.request) else AlbumSerializer
+    
     def get_object(self):
-        share_token = self.kwargs.get('share_token')
-        share = get_object_or_404(AlbumShare, share_token=share_token, is_active=True)
-        return share.album
+        # share_token is unique, so the join yields at most one album row
+        return get_object_or_404(self.get_queryset())
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Serve the rendered body (JSON or MessagePack) from the shared album cache when possible"""
+        if request.accepted_renderer.format not in ('json', 'msgpack'):
+            return super().retrieve(request, *args, **kwargs)
+        
+        cache = get_shared_album_cache()
+        token = kwargs.get('share_token')
+        variant = request_variant(request)
+        entry = cache.get(token, variant)
+        if entry is None:
+            album_id = cache.album_for_token(token)
+            if album_id is None:
+                album_id = get_object_or_404(
+                    AlbumShare.objects.values_list('album_id', flat=True),
+                    share_token=token, is_active=True
+                )
+                cache.remember_token(token, album_id)
+            # Pin the version before reading so a concurrent write orphans
+            # this body instead of being masked by it. Fill from the primary:
+            # a lagging replica would cache a stale body under the new version
+            version = cache.version(album_id)
+            with use_primary():
+                validators = album_validators(album_id, variant)
+                if validators is not None:
+                    response = not_modified(request, validators)
+                    if response is not None:
+                        return response
+                serializer = self.get_serializer(self.get_object())
+                body = request.accepted_renderer.render(serializer.data)
+            cache.set(token, version, body, validators, variant)
+            cache_status = 'MISS'
+        else:
+            body, validators = entry
+            response = not_modified(request, validators)
+            if response is not None:
+                response['X-Cache'] = 'HIT'
+                return response
+            cache_status = 'HIT'
+        
+        response = HttpResponse(body, content_type=request.accepted_renderer.media_type)
+        response['X-Cache'] = cache_status
+        return apply_validators(response, validators)
+    
+    @action(detail=True, methods=['get'])
+    def pages(self, request, share_token=None):
+        """A shared album's pages, skeletons or windows; see AlbumViewSet.pages"""
+        album_id = get_object_or_404(
+            AlbumShare.objects.values_list('album_id', flat=True),
+            share_token=share_token, is_active=True
+        )
+        return pages_response(self, request, album_id)
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, share_token=None):
+        """Download a shared album; see AlbumViewSet.export"""
+        album_id = get_object_or_404(
+            AlbumShare.objects.values_list('album_id', flat=True),
+            share_token=share_token, is_active=True
+        )
+        return export_response(request, album_id)
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Ranked full-text search over album titles/descriptions, page titles and
+    media captions: /api/search/?q=beach&type=media&page=2
+    """
+    permission_classes = [permissions.AllowAny]
+    page_size = 20
+    max_page_size = 100
+    
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        kind = request.query_params.get('type') or None
+        if kind and kind not in dict(SearchEntry.KINDS):
+            return Response({'error': 'type must be album, page or media'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.page_size)), 1),
+                            self.max_page_size)
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Fetch one extra hit to learn whether a next page exists without a COUNT
+        hits = search(query, kind, limit=page_size + 1, offset=(page - 1) * page_size)
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if len(hits) > page_size else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'results': [
+                {
+                    'type': hit['kind'],
+                    'id': hit['object_id'],
+                    'album_id': hit['album_id'],
+                    'page_id': hit['page_id'],
+                    'title': hit['title'],
+                    'snippet': hit['snippet'],
+                    'rank': hit['rank'],
+                }
+                for hit in hits[:page_size]
+            ],
+        })
+
+class DuplicatesViewSet(viewsets.ViewSet):
+    """
+    Duplicate media in one album (?album=<id>) or a user's library
+    (?user=<id>): `exact` groups share a content hash, `similar` groups are
+    images within ?distance= perceptual-hash bits (0 for exact only).
+    Groups come largest waste first.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def list(self, request):
+        params = request.query_params
+        try:
+            album_id = uuid.UUID(params['album']) if 'album' in params else None
+            user_id = int(params['user']) if 'user' in params else None
+        except ValueError:
+            return Response({'error': 'album must be an id, user a number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if (album_id is None) == (user_id is None):
+            return Response({'error': 'Pass either album or user'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        distance = parse_distance(request)
+        queryset = duplicates.scope(album_id, user_id)
+        return Response({
+            'distance': distance,
+            'exact': duplicates.describe(duplicates.exact_groups(queryset)),
+            'similar': (
+                duplicates.describe(duplicates.similar_groups(queryset, distance)) if distance else []
+            ),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def check(self, request):
+        """
+        Upload-time check: ?sha256= of a file about to be uploaded. When the
+        content is already stored, reuse the returned file_key and file_url
+        with add_media instead of uploading it again.
+        """
+        digest = request.query_params.get('sha256', '').lower()
+        if not re.fullmatch(r'[0-9a-f]{64}', digest):
+            return Response({'error': 'sha256 must be 64 hex digits'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        match = (
+            MediaItem.objects.filter(content_hash=digest).order_by('created_at')
+            .values('id', 'file_key', 'file_url').first()
+        )
+        if match is None:
+            name = storage.find_content(digest)
+            if name is not None:
+                match = {'id': None, 'file_key': name, 'file_url': storage.media_url(request, name)}
+        if match is None:
+            return Response({'duplicate': False})
+        return Response({
+            'duplicate': True, 'media_id': match['id'],
+            'file_key': match['file_key'], 'file_url': match['file_url'],
+        })
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable uploads into self-hosted media storage:
+    POST /api/uploads/ {filename, size, content_type} starts one (complete
+    at once if its optional sha256 is already stored),
+    PATCH /api/uploads/{id}/ with an Upload-Offset header and the raw bytes
+    appends a chunk (streamed to disk), and GET or HEAD reports the offset to
+    resume from. The last chunk moves the file to its content-addressed name;
+    the response's file_key and file_url then go to add_media.
+    """
+    queryset = Upload.objects.all()
+    serializer_class = UploadSerializer
+    permission_classes = [permissions.AllowAny]
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        upload = getattr(self, 'upload', None)
+        if upload is not None:
+            response['Upload-Offset'] = str(upload.received)
+            response['Upload-Length'] = str(upload.size)
+        return super().finalize_response(request, response, *args, **kwargs)
+    
+    def get_object(self):
+        self.upload = super().get_object()
+        return self.upload
+    
+    def perform_create(self, serializer):
+        digest = serializer.validated_data.pop('sha256', None)
+        self.upload = serializer.save()
+        if digest:
+            storage.reuse_content(self.upload, digest)
+    
+    def partial_update(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset and Content-Length headers are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if upload.file_key:
+            return Response(self.get_serializer(upload).data)
+        try:
+            if length:
+                storage.append_chunk(upload, offset, request.stream, length)
+        except storage.UploadConflict as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.received == upload.size:
+            storage.finalize(upload)
+        return Response(self.get_serializer(upload).data)